@@ -7,6 +7,7 @@ import streamlit as st
 import extra_streamlit_components as stx
 from streamlit_js_eval import get_geolocation
 import time
+import uuid
 import urllib.parse
 import xlsxwriter
 import folium
@@ -16,23 +17,40 @@ import io
 import sys
 import traceback
 import json
+import hashlib
 
 from utils import (
     get_agora_br,
     validar_gps_basico,
     sanitize_whatsapp,
     obter_endereco_simples,
-    _get_gspread_client,
     _get_drive_credentials,
     carregar_dados,
+    carregar_indice_usuarios,
+    carregar_abas,
+    consultar_dados,
+    atualizar_snapshots,
+    descartar_consultas,
+    status_snapshots,
+    status_google,
     salvar_foto_drive,
+    preparar_foto,
     salvar_documento_drive,
-    registrar_acao,
+    enfileirar_acao,
+    gravar_linha_duravel,
+    iniciar_saida,
+    iniciar_envio_fotos,
+    agendar_foto,
+    status_fotos,
+    FOTOS_EM_SEGUNDO_PLANO,
+    status_saida,
+    status_fila_acoes,
+    status_enderecos_pendentes,
     registrar_novo_contrato_admin,
     atualizar_contrato_enviado,
-    # Funções de gestão de grupos (VERSÕES COM CACHE)
-    carregar_macro_grupos_cached,
-    carregar_grupos_completos_cached,
+    upsert_linhas,
+    # Funções de gestão de grupos (MODELO EM CACHE)
+    carregar_modelo_grupos,
     criar_novo_grupo,
     criar_novo_macro_grupo,
     # 🆕 NOVAS FUNÇÕES DE SUPORTE
@@ -264,6 +282,58 @@ if "error_log" not in st.session_state:
 # Inicializa captura global de erros
 inicializar_captura_erros()
 
+# Retoma o envio de gravações e fotos que ficaram pendentes (ex.: antes de um restart)
+iniciar_saida(st.secrets)
+iniciar_envio_fotos(st.secrets)
+
+# =============================================================================
+# REGISTRO DE AÇÕES (GRAVAÇÃO EM SEGUNDO PLANO)
+# =============================================================================
+
+def chave_de_intencao(nome):
+    """Chave de idempotência do botão: a mesma até a ação ser aceita, depois outra"""
+    return st.session_state.setdefault(f"intencao_{nome}", f"{nome}|{uuid.uuid4().hex}")
+
+
+def enviar_acao(u, tipo_acao, localizacao, feedback="", chave=None, intencao=None):
+    """
+    Enfileira a ação do usuário. chave: idempotência explícita (ex.: hash da foto);
+    intencao: nome do botão, cuja chave vale até a ação ser aceita (toque repetido
+    antes disso não duplica; um toque novo depois é outra ação).
+    """
+    if intencao is not None:
+        chave = chave_de_intencao(intencao)
+    _, situacao = enfileirar_acao(u['ID_Usuario'], tipo_acao, localizacao, feedback, st.secrets,
+                                  st.session_state.get('error_log'), chave=chave)
+    if intencao is not None:
+        st.session_state.pop(f"intencao_{intencao}", None)
+    if situacao == "duplicada":
+        st.toast("✅ Essa ação já tinha sido registrada.")
+    elif situacao == "adiada":
+        st.toast("⏳ Muitos registros ao mesmo tempo: o seu foi salvo e será enviado em instantes.")
+    return True
+
+
+def foto_da_acao(u, foto, nome_img, tipo_acao):
+    """
+    Texto da ação com a foto: no modo em segundo plano volta na hora com a
+    referência pendente; senão (ou se não der para guardar) sobe a foto antes.
+    Retorna None se o envio falhou.
+    """
+    if FOTOS_EM_SEGUNDO_PLANO:
+        texto = agendar_foto(foto, nome_img, tipo_acao, st.secrets, u['ID_Usuario'])
+        if texto:
+            return texto
+    link = salvar_foto_drive(foto, nome_img, st.secrets, st.session_state.get('error_log'))
+    return f"{tipo_acao} | Foto: {link}" if link else None
+
+
+def barra_de_envio(texto):
+    """Barra de progresso de um upload; retorna a função que a atualiza (fração de 0 a 1)"""
+    barra = st.progress(0.0, text=texto)
+    return lambda fracao: barra.progress(min(fracao, 1.0), text=f"{texto} {int(fracao * 100)}%")
+
+
 # =============================================================================
 # MODAIS DE PRESENÇA (DIALOG)
 # =============================================================================
@@ -284,17 +354,14 @@ def modal_checkin(u, agora):
             gps_in = st.session_state.get('last_coords', "Sem GPS")
             with st.status("🚀 PROCESSANDO REGISTRO...", expanded=True) as status:
                 nome_img = f"checkin_{u['Nome']}_{agora_real.strftime('%d-%m-%Y_%H-%M')}.jpg"
-                link = salvar_foto_drive(foto_in, nome_img, st.secrets, st.session_state.get('error_log'))
-
-                if link:
-                    registrar_acao(
-                        u['ID_Usuario'],
-                        f"Check-in | Foto: {link}",
-                        localizacao=gps_in,
-                        feedback="",
-                        secrets=st.secrets,
-                        error_log=st.session_state.get('error_log')
-                    )
+                foto, miniatura = preparar_foto(foto_in)
+                if miniatura is not None:
+                    st.image(miniatura)
+                acao_texto = foto_da_acao(u, foto, nome_img, "Check-in")
+
+                if acao_texto:
+                    enviar_acao(u, acao_texto, localizacao=gps_in,
+                                chave=f"{u['ID_Usuario']}|checkin|{hashlib.sha1(foto_in.getbuffer()).hexdigest()}")
                     try:
                         horario_formatado = agora_real.strftime("%Y-%m-%d %H:%M:%S")
                         cookie_manager.set("comando2026_checkin_time", horario_formatado)
@@ -308,7 +375,7 @@ def modal_checkin(u, agora):
                         })
 
                     status.update(label="✅ ENTRADA REGISTRADA!", state="complete")
-                    time.sleep(2)
+                    time.sleep(0.5 if FOTOS_EM_SEGUNDO_PLANO else 2)
                     st.rerun()
         else:
             st.error("⚠️ VOCÊ PRECISA TIRAR A FOTO!")
@@ -340,20 +407,14 @@ def modal_checkout(u, agora):
 
             with st.spinner("📡 ENVIANDO DADOS..."):
                 nome_img = f"checkout_{u['Nome']}_{agora_real.strftime('%d-%m-%Y_%H-%M')}.jpg"
-                link_drive = salvar_foto_drive(foto_out, nome_img, st.secrets, st.session_state.get('error_log'))
+                foto, _ = preparar_foto(foto_out)
+                acao_texto = foto_da_acao(u, foto, nome_img, "Check-out")
 
-                if link_drive:
-                    acao_texto = f"Check-out | Foto: {link_drive}"
+                if acao_texto:
                     feedback_texto = f"{clima} | Obs: {obs if obs else 'Nenhuma'}"
 
-                    registrar_acao(
-                        u['ID_Usuario'],
-                        acao_texto,
-                        localizacao=gps_out,
-                        feedback=feedback_texto,
-                        secrets=st.secrets,
-                        error_log=st.session_state.get('error_log')
-                    )
+                    enviar_acao(u, acao_texto, localizacao=gps_out, feedback=feedback_texto,
+                                chave=f"{u['ID_Usuario']}|checkout|{hashlib.sha1(foto_out.getbuffer()).hexdigest()}")
 
                     try:
                         if "comando2026_checkin_time" in cookie_manager.get_all():
@@ -368,7 +429,7 @@ def modal_checkout(u, agora):
                         })
 
                     st.success("✅ TUDO SALVO! BOM DESCANSO.")
-                    time.sleep(2)
+                    time.sleep(0.5 if FOTOS_EM_SEGUNDO_PLANO else 2)
                     st.rerun()
         else:
             st.error("⚠️ VOCÊ PRECISA TIRAR A FOTO PARA ENCERRAR!")
@@ -382,11 +443,11 @@ if todos_os_cookies and not st.session_state["logout_em_andamento"]:
     user_id_cookie = todos_os_cookies.get("comando2026_user_id")
 
     if user_id_cookie and st.session_state["usuario_logado"] is None:
-        df_usuarios = carregar_dados("Usuarios", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-        if df_usuarios is not None:
-            user_match = df_usuarios[df_usuarios['ID_Usuario'].str.lower() == user_id_cookie.lower().strip()]
-            if not user_match.empty:
-                st.session_state["usuario_logado"] = user_match.iloc[0].to_dict()
+        indice_usuarios = carregar_indice_usuarios(st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+        if indice_usuarios is not None:
+            user_match = indice_usuarios['por_id'].get(user_id_cookie.lower().strip())
+            if user_match is not None:
+                st.session_state["usuario_logado"] = dict(user_match)
                 st.rerun()
 
 # =============================================================================
@@ -421,11 +482,12 @@ if st.session_state["usuario_logado"] is None:
 
             if st.button("ENTRAR NO PAINEL", width='stretch', type="primary"):
                 with st.spinner("VALIDANDO..."):
-                    df_usuarios = carregar_dados("Usuarios", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-                    if df_usuarios is not None:
-                        user_match = df_usuarios[df_usuarios['ID_Usuario'].str.lower() == email_input.lower().strip()]
-                        if not user_match.empty:
-                            st.session_state["usuario_logado"] = user_match.iloc[0].to_dict()
+                    indice_usuarios = carregar_indice_usuarios(st.secrets["planilha"]["id"],
+                                                               st.session_state.get('error_log'))
+                    if indice_usuarios is not None:
+                        user_match = indice_usuarios['por_id'].get(email_input.lower().strip())
+                        if user_match is not None:
+                            st.session_state["usuario_logado"] = dict(user_match)
                             cookie_manager.set("comando2026_user_id", email_input.lower().strip(),
                                                key="set_user_cookie")
                             st.rerun()
@@ -456,9 +518,26 @@ with st.sidebar:
     st.write(f"Olá, **{u['Nome'].split()[0]}**")
     st.caption(f"Cargo: {u['Cargo']}")
 
+    fila_usuario = status_fila_acoes(u['ID_Usuario'])
+    if fila_usuario['pendentes']:
+        st.caption(f"⏳ {fila_usuario['pendentes']} registro(s) sendo enviado(s)...")
+    if fila_usuario['falhas']:
+        st.warning(f"📶 {len(fila_usuario['falhas'])} registro(s) guardado(s), aguardando conexão para envio.")
+    fotos_usuario = status_fotos(u['ID_Usuario'])
+    if fotos_usuario['enviando'] or fotos_usuario['vinculando']:
+        st.caption(f"📸 {fotos_usuario['enviando'] + fotos_usuario['vinculando']} foto(s) sendo enviada(s)... "
+                   "sua presença já está registrada.")
+
     if st.button("🔄 ATUALIZAR PAINEL", width="stretch"):
         with st.spinner("Buscando dados..."):
-            st.cache_data.clear()
+            if cargo_limpo in ("suporte", "admin"):
+                st.cache_data.clear()
+                atualizar_snapshots(st.secrets["planilha"]["id"], error_log=st.session_state.get('error_log'),
+                                    completa=True)
+            else:
+                # Voluntário: só as próprias consultas e a sonda de cauda (nada de baixar o histórico todo)
+                descartar_consultas(st.secrets["planilha"]["id"], [u['ID_Usuario'], u.get('ID_Grupo', '')])
+                atualizar_snapshots(st.secrets["planilha"]["id"], error_log=st.session_state.get('error_log'))
             st.rerun()
 
     if st.button("Sair / Trocar Conta", width='stretch'):
@@ -536,15 +615,20 @@ st.markdown(f"""
 
 if cargo_limpo == "colaborador":
 
-    df_msgs = carregar_dados("Mensagens", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-    df_usuarios = carregar_dados("Usuarios", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-    df_logs = carregar_dados("Logs", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+    # Só as linhas deste colaborador/grupo saem do Google (filtro aplicado no servidor)
+    planilha_id = st.secrets["planilha"]["id"]
+    indice_usuarios = carregar_indice_usuarios(planilha_id, st.session_state.get('error_log'))
+    df_msgs = consultar_dados("Mensagens", planilha_id, [("ID_Alvo", "=", str(u['ID_Grupo']).strip())],
+                              st.session_state.get('error_log'))
     m = None
 
     hoje_str = agora.strftime("%d/%m/%Y")
-    meus_logs_hoje = df_logs[(df_logs['ID_Usuario'] == u['ID_Usuario']) & (
-        df_logs['Data_Hora'].str.contains(hoje_str))] if df_logs is not None else pd.DataFrame()
-    qtd_acoes_hoje = len(meus_logs_hoje)
+    meus_logs_hoje = consultar_dados(
+        "Logs", planilha_id,
+        [("ID_Usuario", "=", u['ID_Usuario']), ("Data_Hora", "starts with", hoje_str)],
+        st.session_state.get('error_log')
+    )
+    qtd_acoes_hoje = len(meus_logs_hoje) if meus_logs_hoje is not None else 0
 
     st.markdown(f"""
         <div style='
@@ -664,8 +748,8 @@ if cargo_limpo == "colaborador":
                 unsafe_allow_html=True)
 
             if st.button(f"CONCLUIR MISSÃO DE HOJE", width='stretch', key="btn_tarefa_fixa"):
-                registrar_acao(u['ID_Usuario'], f"CONCLUIU: {t_txt}", localizacao=st.session_state.get('last_coords'),
-                               feedback="", secrets=st.secrets, error_log=st.session_state.get('error_log'))
+                enviar_acao(u, f"CONCLUIU: {t_txt}", localizacao=st.session_state.get('last_coords'),
+                            chave=f"{u['ID_Usuario']}|CONCLUIU|{t_txt}|{get_agora_br().strftime('%d/%m/%Y')}")
                 st.success("MISSÃO REGISTRADA COM SUCESSO!")
 
         st.markdown("<br>", unsafe_allow_html=True)
@@ -675,9 +759,8 @@ if cargo_limpo == "colaborador":
 
         with col_m1:
             if st.button("📸 CURTA, COMENTE E COMPARTILHE NOSSO ÚLTIMO POST!", width='stretch', key="fixo_insta"):
-                registrar_acao(u['ID_Usuario'], "AÇÃO: INTERAÇÃO INSTAGRAM",
-                               localizacao=st.session_state.get('last_coords'), feedback="", secrets=st.secrets,
-                               error_log=st.session_state.get('error_log'))
+                enviar_acao(u, "AÇÃO: INTERAÇÃO INSTAGRAM", localizacao=st.session_state.get('last_coords'),
+                            intencao="fixo_insta")
                 st.markdown(f"""
                     <a href="https://www.instagram.com/maxmacieldf/" target="_blank">
                         <div style='background-color: #1D1D1B; color: #FFEB00; text-align: center; padding: 10px; border: 2px solid #FFEB00; font-weight: bold; font-size: 0.8rem;'>
@@ -688,9 +771,8 @@ if cargo_limpo == "colaborador":
 
         with col_m2:
             if st.button("💬 TRAGA UM NOVO AMIGO PARA SER COLABORADOR!", width='stretch', key="fixo_whats"):
-                registrar_acao(u['ID_Usuario'], "AÇÃO: TRAZER NOVO COLABORADOR!",
-                               localizacao=st.session_state.get('last_coords'), feedback="", secrets=st.secrets,
-                               error_log=st.session_state.get('error_log'))
+                enviar_acao(u, "AÇÃO: TRAZER NOVO COLABORADOR!", localizacao=st.session_state.get('last_coords'),
+                            intencao="fixo_whats")
                 mensagem_pronta = "Salve! Já acompanha o trabalho do Max Maciel pelo DF?? Sou colaborador dele e estou muito feliz com o trabalho que estamos fazendo. Vamos juntos nessa campanha? 🚀 https://forms.gle/NzJy6NEynbaPyD6w6"
                 msg_url = urllib.parse.quote(mensagem_pronta)
                 st.markdown(f"""
@@ -718,7 +800,8 @@ if cargo_limpo == "colaborador":
         st.divider()
 
         st.subheader("📄 Meus Documentos")
-        df_contratos = carregar_dados("Contratos", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+        df_contratos = consultar_dados("Contratos", planilha_id, [("ID_Usuario", "=", u['ID_Usuario'])],
+                                       st.session_state.get('error_log'))
         if df_contratos is not None:
             meus_docs = df_contratos[df_contratos['ID_Usuario'].astype(str) == str(u['ID_Usuario'])]
             if not meus_docs.empty:
@@ -732,12 +815,16 @@ if cargo_limpo == "colaborador":
                             if arq:
                                 with st.spinner("Enviando..."):
                                     link = salvar_documento_drive(arq, f"ASSINADO_{u['Nome']}_{doc['Nome_Arquivo']}",
-                                                                  st.secrets, st.session_state.get('error_log'))
+                                                                  st.secrets, st.session_state.get('error_log'),
+                                                                  progresso=barra_de_envio("📤 Enviando contrato..."))
                                     if link and atualizar_contrato_enviado(u['ID_Usuario'], doc['Nome_Arquivo'], link,
                                                                            st.secrets, st.session_state.get('error_log')):
                                         st.success("Enviado com sucesso!")
                                         time.sleep(1)
                                         st.rerun()
+                                    elif not link:
+                                        st.error("O envio foi interrompido. Toque em Confirmar de novo: "
+                                                 "ele continua de onde parou.")
             else:
                 st.info("Nenhum contrato pendente.")
 
@@ -747,13 +834,12 @@ if cargo_limpo == "colaborador":
 
     col_sup1, col_sup2 = st.columns(2)
     id_supervisor_dele = str(u.get('ID_Supervisor', '')).strip().lower()
-    dados_supervisor = df_usuarios[df_usuarios[
-                                       'ID_Usuario'].str.lower().str.strip() == id_supervisor_dele] if df_usuarios is not None else pd.DataFrame()
+    dados_supervisor = indice_usuarios['por_id'].get(id_supervisor_dele) if indice_usuarios is not None else None
 
     with col_sup1:
-        if not dados_supervisor.empty:
-            whats_sup = sanitize_whatsapp(dados_supervisor.iloc[0]['WhatsApp'])
-            nome_sup = dados_supervisor.iloc[0]['Nome'].split()[0].upper()
+        if dados_supervisor is not None:
+            whats_sup = sanitize_whatsapp(dados_supervisor['WhatsApp'])
+            nome_sup = dados_supervisor['Nome'].split()[0].upper()
             msg_sup = f"Olá {nome_sup}! Sou colaborador da sua equipe e preciso de ajuda."
             st.link_button(f"👤 FALAR COM {nome_sup}", f"https://wa.me/{whats_sup}?text={urllib.parse.quote(msg_sup)}",
                            width='stretch')
@@ -774,9 +860,9 @@ if cargo_limpo == "colaborador":
 
 elif cargo_limpo == "supervisor":
 
-    df_msgs = carregar_dados("Mensagens", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-    df_usuarios = carregar_dados("Usuarios", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-    df_logs = carregar_dados("Logs", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+    dados = carregar_abas(["Mensagens", "Usuarios", "Logs"], st.secrets, st.session_state.get('error_log'))
+    df_msgs, df_usuarios, df_logs = dados["Mensagens"], dados["Usuarios"], dados["Logs"]
+    indice_usuarios = carregar_indice_usuarios(st.secrets["planilha"]["id"], st.session_state.get('error_log'))
     m = None
 
     if df_msgs is not None and not df_msgs.empty:
@@ -844,7 +930,7 @@ elif cargo_limpo == "supervisor":
             "<div style='background-color: #FFEB00; padding: 15px; border: 4px solid #1D1D1B; box-shadow: 8px 8px 0px #1D1D1B; text-align: center; margin-bottom: 25px;'><h2 style='margin:0; font-size: 1.8rem; font-style: italic; color: #1D1D1B;'>🚀 MISSÕES DIÁRIAS</h2></div>",
             unsafe_allow_html=True)
 
-        t_txt = str(m.get('Tarefa_Direcionada', 'MISSÃO GERAL')).upper() if m is not None else "MISSÃO GERAL"
+        t_txt = (str(m.get('Tarefa_Direcionada', '')).upper() or "MISSÃO GERAL") if m is not None else "MISSÃO GERAL"
         with st.container(border=True):
             st.markdown(
                 f"<h3 style='text-align: center; color: #1D1D1B; margin-bottom: 10px;'>🚩 MISSÃO PRIORITÁRIA</h3>",
@@ -853,25 +939,23 @@ elif cargo_limpo == "supervisor":
                 f"<p style='text-align: center; font-weight: bold; font-size: 1.1rem; color: #E20613;'>{t_txt}</p>",
                 unsafe_allow_html=True)
             if st.button("CONCLUIR MISSÃO DE HOJE", width='stretch', key="sup_task_done"):
-                registrar_acao(u['ID_Usuario'], f"CONCLUIU: {t_txt}", localizacao=st.session_state.get('last_coords'),
-                               feedback="", secrets=st.secrets, error_log=st.session_state.get('error_log'))
+                enviar_acao(u, f"CONCLUIU: {t_txt}", localizacao=st.session_state.get('last_coords'),
+                            chave=f"{u['ID_Usuario']}|CONCLUIU|{t_txt}|{get_agora_br().strftime('%d/%m/%Y')}")
                 st.success("MISSÃO REGISTRADA!")
 
         st.markdown("<h3 style='font-size: 1.2rem;'>📲 AÇÕES DE REDE</h3>", unsafe_allow_html=True)
         cm1, cm2 = st.columns(2)
         with cm1:
             if st.button("📸 INSTAGRAM", width='stretch', key="sup_insta"):
-                registrar_acao(u['ID_Usuario'], "AÇÃO: INTERAÇÃO INSTAGRAM",
-                               localizacao=st.session_state.get('last_coords'), feedback="", secrets=st.secrets,
-                               error_log=st.session_state.get('error_log'))
+                enviar_acao(u, "AÇÃO: INTERAÇÃO INSTAGRAM", localizacao=st.session_state.get('last_coords'),
+                            intencao="sup_insta")
                 st.markdown(
                     f"<a href='https://www.instagram.com/maxmacieldf/' target='_blank'><div style='background-color: #1D1D1B; color: #FFEB00; text-align: center; padding: 10px; font-weight: bold; font-size: 0.8rem;'>ABRIR PERFIL ↗️</div></a>",
                     unsafe_allow_html=True)
         with cm2:
             if st.button("💬 WHATSAPP", width='stretch', key="sup_whats"):
-                registrar_acao(u['ID_Usuario'], "AÇÃO: MOBILIZAÇÃO WHATSAPP",
-                               localizacao=st.session_state.get('last_coords'), feedback="", secrets=st.secrets,
-                               error_log=st.session_state.get('error_log'))
+                enviar_acao(u, "AÇÃO: MOBILIZAÇÃO WHATSAPP", localizacao=st.session_state.get('last_coords'),
+                            intencao="sup_whats")
                 msg_zap = urllib.parse.quote(
                     "Salve! Vamos juntos com Max Maciel 🚀 https://www.instagram.com/maxmacieldf/")
                 st.markdown(
@@ -895,7 +979,8 @@ elif cargo_limpo == "supervisor":
         st.divider()
 
         st.subheader("📄 Meus Documentos")
-        df_contratos = carregar_dados("Contratos", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+        df_contratos = consultar_dados("Contratos", st.secrets["planilha"]["id"],
+                                       [("ID_Usuario", "=", u['ID_Usuario'])], st.session_state.get('error_log'))
         if df_contratos is not None:
             meus_docs = df_contratos[df_contratos['ID_Usuario'].astype(str) == str(u['ID_Usuario'])]
             if not meus_docs.empty:
@@ -909,19 +994,24 @@ elif cargo_limpo == "supervisor":
                             if arq:
                                 with st.spinner("Enviando..."):
                                     link = salvar_documento_drive(arq, f"ASSINADO_{u['Nome']}_{doc['Nome_Arquivo']}",
-                                                                  st.secrets, st.session_state.get('error_log'))
+                                                                  st.secrets, st.session_state.get('error_log'),
+                                                                  progresso=barra_de_envio("📤 Enviando contrato..."))
                                     if link and atualizar_contrato_enviado(u['ID_Usuario'], doc['Nome_Arquivo'], link,
                                                                            st.secrets, st.session_state.get('error_log')):
                                         st.success("Enviado com sucesso!")
                                         time.sleep(1)
                                         st.rerun()
+                                    elif not link:
+                                        st.error("O envio foi interrompido. Toque em Confirmar de novo: "
+                                                 "ele continua de onde parou.")
             else:
                 st.info("Nenhum contrato pendente.")
 
     with tab_equipe:
         st.markdown("<div style='margin-top: 20px;'></div>", unsafe_allow_html=True)
-        if df_usuarios is not None and df_logs is not None:
-            minha_equipe = df_usuarios[df_usuarios['ID_Supervisor'].astype(str) == str(u['ID_Usuario'])]
+        if indice_usuarios is not None and df_logs is not None:
+            minha_equipe = indice_usuarios['por_supervisor'].get(str(u['ID_Usuario']).strip().lower(),
+                                                                  indice_usuarios['vazio'])
 
             espaco_metricas = st.empty()
 
@@ -930,7 +1020,7 @@ elif cargo_limpo == "supervisor":
                 data_sel = st.date_input("📅 DATA DE ANÁLISE", datetime.now(timezone.utc) - timedelta(hours=3))
             d_str = data_sel.strftime("%d/%m/%Y")
 
-            logs_dia = df_logs[df_logs['Data_Hora'].str.contains(d_str)]
+            logs_dia = df_logs[df_logs['Data_Filtro'] == d_str]
             ativos_dia = logs_dia[logs_dia['ID_Usuario'].isin(minha_equipe['ID_Usuario'])]
             total_vol = len(minha_equipe)
             num_ativos = ativos_dia[ativos_dia['Tipo_Acao'].str.contains("Check-in")]['ID_Usuario'].nunique()
@@ -959,7 +1049,7 @@ elif cargo_limpo == "supervisor":
 
             for _, vol in minha_equipe.iterrows():
                 logs_vol = df_logs[
-                    (df_logs['ID_Usuario'] == vol['ID_Usuario']) & (df_logs['Data_Hora'].str.contains(d_str))]
+                    (df_logs['ID_Usuario'] == vol['ID_Usuario']) & (df_logs['Data_Filtro'] == d_str)]
 
                 tem_in = not logs_vol[logs_vol['Tipo_Acao'].str.contains("Check-in")].empty
                 tem_net = not logs_vol[logs_vol['Tipo_Acao'].str.contains("AÇÃO:")].empty
@@ -1041,8 +1131,12 @@ elif cargo_limpo == "admin":
     agora_br = get_agora_br()
     hoje_str = agora_br.strftime("%d/%m/%Y")
 
-    df_usuarios = carregar_dados("Usuarios", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-    df_logs = carregar_dados("Logs", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+    dados = carregar_abas(["Usuarios", "Logs", "Grupos", "Contratos"], st.secrets,
+                          st.session_state.get('error_log'))
+    df_usuarios, df_logs = dados["Usuarios"], dados["Logs"]
+    # Modelo único de Grupos (macros, grupos e mapeamentos) para todas as abas do admin
+    modelo_grupos = carregar_modelo_grupos(st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+    indice_usuarios = carregar_indice_usuarios(st.secrets["planilha"]["id"], st.session_state.get('error_log'))
 
     if not df_logs.empty:
         ultimos_logs_raw = df_logs.tail(10)
@@ -1107,8 +1201,7 @@ elif cargo_limpo == "admin":
 
         planilha_id = st.secrets["planilha"]["id"]
 
-        # Carrega Macro_Grupos com cache (1 chamada só)
-        macro_grupos_disponiveis = carregar_macro_grupos_cached(planilha_id)
+        macro_grupos_disponiveis = modelo_grupos['macros']
 
         # Filtro de Macro Região
         st.markdown(
@@ -1121,19 +1214,22 @@ elif cargo_limpo == "admin":
             key="select_macro_hierarquia"
         )
 
-        df_usuarios_raw = carregar_dados("Usuarios", planilha_id, st.session_state.get('error_log'))
-        df_grupos_info = carregar_dados("Grupos", planilha_id, st.session_state.get('error_log'))
-
-        if df_usuarios_raw is not None and df_grupos_info is not None:
-            df_gerencial = pd.merge(df_usuarios_raw, df_grupos_info, on='ID_Grupo', how='left')
-            df_gerencial['Macro_Grupo'] = df_gerencial['Macro_Grupo'].fillna("GERAL")
+        if df_usuarios is not None and indice_usuarios is not None:
+            # Macro_Grupo e Link_Grupo vêm do modelo de Grupos (sem merge com a aba)
+            df_gerencial = df_usuarios.copy()
+            ids_grupo = df_gerencial['ID_Grupo'].astype(str).str.strip()
+            df_gerencial['Macro_Grupo'] = ids_grupo.map(modelo_grupos['grupo_para_macro']).fillna("GERAL")
+            df_gerencial['Link_Grupo'] = ids_grupo.map(
+                lambda g: modelo_grupos['grupos_por_id'].get(g, {}).get('Link_Grupo', ''))
 
             if macro_selecionada == "TODAS AS REGIÕES":
                 df_f_admin = df_gerencial.copy()
             else:
                 df_f_admin = df_gerencial[df_gerencial['Macro_Grupo'] == macro_selecionada]
 
-            supervisores = df_f_admin[df_f_admin['Cargo'].str.lower().str.strip() == "supervisor"]
+            ids_supervisores = indice_usuarios['por_cargo'].get("supervisor", indice_usuarios['vazio'])['ID_Usuario']
+            supervisores = df_f_admin[df_f_admin['ID_Usuario'].isin(ids_supervisores)]
+            ids_regiao = set(df_f_admin['ID_Usuario'])
 
             if supervisores.empty:
                 st.warning("Nenhum supervisor nesta região.")
@@ -1144,12 +1240,13 @@ elif cargo_limpo == "admin":
                     col_alvo = col_sup1 if i % 2 == 0 else col_sup2
 
                     with col_alvo:
-                        equipe = df_f_admin[
-                            df_f_admin['ID_Supervisor'].astype(str).str.strip() == str(sup['ID_Usuario']).strip()]
+                        equipe = indice_usuarios['por_supervisor'].get(str(sup['ID_Usuario']).strip().lower(),
+                                                                        indice_usuarios['vazio'])
+                        equipe = equipe[equipe['ID_Usuario'].isin(ids_regiao)]
                         qtd_equipe = len(equipe)
 
                         logs_eq = df_logs[(df_logs['ID_Usuario'].isin(equipe['ID_Usuario'])) & (
-                            df_logs['Data_Hora'].str.contains(hoje_str))]
+                            df_logs['Data_Filtro'] == hoje_str)]
                         ativos_hoje = logs_eq[logs_eq['Tipo_Acao'].str.contains("Check-in")]['ID_Usuario'].nunique()
                         cor_ativos = "#E20613" if ativos_hoje > 0 else "#666666"
 
@@ -1223,10 +1320,10 @@ elif cargo_limpo == "admin":
         """, unsafe_allow_html=True)
 
         try:
-            client = _get_gspread_client(st.secrets, st.session_state.get('error_log'))
-            aba_msg = client.open_by_key(st.secrets["planilha"]["id"]).worksheet("Mensagens")
-            dados_msg = aba_msg.get_all_records()
-            df_msg = pd.DataFrame(dados_msg)
+            # Leitura pelo snapshot compartilhado; a gravação é um upsert por ID_Alvo
+            df_msg = carregar_dados("Mensagens", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+            if df_msg is None:
+                df_msg = pd.DataFrame()
 
             lista_alvos = df_msg["ID_Alvo"].unique().tolist() if not df_msg.empty else []
             alvo_selecionado = st.selectbox("1. SELECIONE O GRUPO:", ["Novo..."] + lista_alvos)
@@ -1249,21 +1346,13 @@ elif cargo_limpo == "admin":
                         data_auto = (get_agora_br()).strftime("%d/%m/%Y")
                         nova_linha = [f_id, f_msg, f_tar, data_auto]
 
-                        if alvo_selecionado != "Novo...":
-                            try:
-                                cell = aba_msg.find(str(alvo_selecionado))
-                                if cell:
-                                    aba_msg.delete_rows(cell.row)
-                            except Exception as e:
-                                st.session_state['error_log'].append({
-                                    'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
-                                    'erro': str(e),
-                                    'funcao': 'tab_mensagens.delete',
-                                    'traceback': traceback.format_exc(),
-                                    'tipo': type(e).__name__
-                                })
-
-                        aba_msg.append_row(nova_linha)
+                        # Upsert por ID_Alvo: sobrescreve a linha no lugar (sem find/delete/append)
+                        chave_alvo = alvo_selecionado if alvo_selecionado != "Novo..." else f_id
+                        resultado = upsert_linhas(st.secrets, "Mensagens", "ID_Alvo", [nova_linha],
+                                                  st.session_state.get('error_log'), chaves=[chave_alvo])
+                        if resultado is None:
+                            st.error("Erro ao gravar as diretrizes")
+                            st.stop()
                         st.success("✅ ATUALIZADO!")
                         st.cache_data.clear()
                         st.rerun()
@@ -1284,18 +1373,8 @@ elif cargo_limpo == "admin":
             "<h2 style='font-family: \"Archivo Black\", sans-serif; color: #1D1D1B; margin-bottom: 25px; font-size: 2rem;'>ESTATÍSTICAS DO COMANDO</h2>",
             unsafe_allow_html=True)
 
-        if 'Localização' not in df_logs.columns:
-            df_logs['Localização'] = "Sem GPS"
-        if 'Endereço' not in df_logs.columns:
-            df_logs['Endereço'] = "Não identificado"
-        if 'Feedback' not in df_logs.columns:
-            df_logs['Feedback'] = "Nenhum"
-
-        df_logs['Data_Hora_DT'] = pd.to_datetime(df_logs['Data_Hora'], dayfirst=True, errors='coerce')
-        df_logs['Data_Filtro'] = df_logs['Data_Hora'].str.split().str[0]
-
         datas_disponiveis = sorted(
-            [d for d in df_logs['Data_Filtro'].unique().tolist() if isinstance(d, str) and "/" in d],
+            [d for d in df_logs['Data_Filtro'].unique().tolist() if d],
             key=lambda x: datetime.strptime(x, "%d/%m/%Y"),
             reverse=True
         )
@@ -1304,7 +1383,7 @@ elif cargo_limpo == "admin":
         with c_f1:
             periodo_selecionado = st.selectbox("📅 FILTRAR POR DATA:", ["Histórico Completo"] + datas_disponiveis)
         with c_f2:
-            lista_sups = ["TODOS"] + df_usuarios[df_usuarios['Cargo'].str.lower() == "supervisor"][
+            lista_sups = ["TODOS"] + indice_usuarios['por_cargo'].get("supervisor", indice_usuarios['vazio'])[
                 'Nome'].unique().tolist()
             sup_filtro = st.selectbox("👤 FILTRAR POR SUPERVISOR:", lista_sups)
 
@@ -1384,7 +1463,7 @@ elif cargo_limpo == "admin":
                     ['Nome', 'Supervisor_Nome', 'ID_Grupo', 'Tipo_Acao', 'Data_Hora', 'Feedback', 'Endereço',
                      'Localização']].copy()
 
-                df_excel = df_excel.fillna('')
+                df_excel = df_excel.astype(object).fillna('')
 
                 for col in df_excel.columns:
                     df_excel[col] = df_excel[col].astype(str)
@@ -1426,9 +1505,8 @@ elif cargo_limpo == "admin":
     with tab_cadastro:
         planilha_id = st.secrets["planilha"]["id"]
 
-        df_usuarios = carregar_dados("Usuarios", planilha_id, st.session_state.get('error_log'))
-        grupos_existentes = carregar_grupos_completos_cached(planilha_id)
-        macro_grupos_lista = carregar_macro_grupos_cached(planilha_id)
+        grupos_existentes = modelo_grupos['grupos']
+        macro_grupos_lista = modelo_grupos['macros']
 
         lista_grupos = sorted([g['ID_Grupo'] for g in grupos_existentes]) if grupos_existentes else []
 
@@ -1439,8 +1517,8 @@ elif cargo_limpo == "admin":
             "<h2 style='font-family: \"Archivo Black\", sans-serif; color: #1D1D1B; margin-bottom: 20px; font-size: 1.8rem;'>👤 NOVO INTEGRANTE</h2>",
             unsafe_allow_html=True)
 
-        df_sup_only = df_usuarios[
-            df_usuarios['Cargo'].str.lower().str.strip() == "supervisor"] if df_usuarios is not None else pd.DataFrame()
+        df_sup_only = indice_usuarios['por_cargo'].get(
+            "supervisor", indice_usuarios['vazio']) if indice_usuarios is not None else pd.DataFrame()
 
         mapeamento_sup = {
             f"{row['Nome'].upper()} ({row['ID_Usuario'].lower()})": row['ID_Usuario']
@@ -1481,25 +1559,28 @@ elif cargo_limpo == "admin":
                             st.error("⚠️ Cadastre pelo menos um grupo antes de criar usuários!")
                         else:
                             try:
-                                client = _get_gspread_client(st.secrets, st.session_state.get('error_log'))
-                                aba_u = client.open_by_key(planilha_id).worksheet("Usuarios")
-
                                 if n_sup_selecionado_display == "NENHUM / PRÓPRIO SUPERVISOR":
                                     id_supervisor_final = ""
                                 else:
                                     id_supervisor_final = mapeamento_sup[n_sup_selecionado_display]
 
-                                aba_u.append_row([
+                                situacao = gravar_linha_duravel(st.secrets, "Usuarios", [
                                     n_id,
                                     n_nome.upper(),
                                     n_whats,
                                     n_cargo,
                                     n_grupo,
                                     id_supervisor_final
-                                ])
+                                ], f"usuario|{n_id.lower().strip()}", st.session_state.get('error_log'))
 
-                                st.success(f"🚀 {n_nome.upper()} CADASTRADO!")
+                                if situacao == "duplicada":
+                                    st.warning(f"⚠️ {n_id} já foi cadastrado antes.")
+                                elif situacao == "pendente":
+                                    st.warning(f"📶 {n_nome.upper()} salvo; será enviado à planilha assim que a conexão voltar.")
+                                else:
+                                    st.success(f"🚀 {n_nome.upper()} CADASTRADO!")
                                 st.cache_data.clear()
+                                atualizar_snapshots(planilha_id, ["Usuarios"], st.session_state.get('error_log'))
                                 time.sleep(1)
                                 st.rerun()
                             except Exception as e:
@@ -1542,24 +1623,13 @@ elif cargo_limpo == "admin":
                                 sucesso, msg = criar_novo_grupo(g_nome, g_macro, g_link, st.secrets, st.session_state.get('error_log'))
                                 if sucesso:
                                     st.success(f"✅ {msg}")
-                                    try:
-                                        client = _get_gspread_client(st.secrets, st.session_state.get('error_log'))
-                                        plan = client.open_by_key(planilha_id)
-                                        data_atual_msg = (get_agora_br()).strftime("%d/%m/%Y")
-                                        plan.worksheet("Mensagens").append_row([
-                                            g_nome.upper(),
-                                            "BEM-VINDO AO COMANDO!",
-                                            "MISSÃO INICIAL DE RUA",
-                                            data_atual_msg
-                                        ])
-                                    except Exception as e:
-                                        st.session_state['error_log'].append({
-                                            'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
-                                            'erro': str(e),
-                                            'funcao': 'tab_cadastro.mensagem_boas_vindas',
-                                            'traceback': traceback.format_exc(),
-                                            'tipo': type(e).__name__
-                                        })
+                                    data_atual_msg = (get_agora_br()).strftime("%d/%m/%Y")
+                                    upsert_linhas(st.secrets, "Mensagens", "ID_Alvo", [[
+                                        g_nome.upper(),
+                                        "BEM-VINDO AO COMANDO!",
+                                        "MISSÃO INICIAL DE RUA",
+                                        data_atual_msg
+                                    ]], st.session_state.get('error_log'))
                                     st.cache_data.clear()
                                     time.sleep(1)
                                     st.rerun()
@@ -1596,7 +1666,7 @@ elif cargo_limpo == "admin":
             df_resumo = pd.DataFrame(grupos_existentes)
 
             for macro in macro_grupos_lista:
-                grupos_do_macro = [g for g in grupos_existentes if g.get('Macro_Grupo', '') == macro]
+                grupos_do_macro = modelo_grupos['macro_para_grupos'].get(macro, [])
 
                 with st.expander(f"📍 {macro} ({len(grupos_do_macro)} grupos)", expanded=False):
                     if grupos_do_macro:
@@ -1622,9 +1692,8 @@ elif cargo_limpo == "admin":
 
         from folium.plugins import MarkerCluster
 
-        df_logs['Data_Filtro'] = df_logs['Data_Hora'].str.split().str[0]
         datas_mapa = sorted(
-            [d for d in df_logs['Data_Filtro'].unique().tolist() if isinstance(d, str) and "/" in d],
+            [d for d in df_logs['Data_Filtro'].unique().tolist() if d],
             key=lambda x: datetime.strptime(x, "%d/%m/%Y"),
             reverse=True
         )
@@ -1639,25 +1708,6 @@ elif cargo_limpo == "admin":
         else:
             df_m = df_completo[df_completo['Data_Filtro'] == periodo_mapa].copy()
 
-
-        def extrair_lat_lon(pos):
-            try:
-                if pos and "," in str(pos):
-                    lat, lon = str(pos).split(",")
-                    return float(lat), float(lon)
-            except Exception as e:
-                st.session_state['error_log'].append({
-                    'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
-                    'erro': str(e),
-                    'funcao': 'tab_mapa.extrair_lat_lon',
-                    'traceback': traceback.format_exc(),
-                    'tipo': type(e).__name__
-                })
-                return None, None
-            return None, None
-
-
-        df_m['lat'], df_m['lon'] = zip(*df_m['Localização'].apply(extrair_lat_lon))
         df_geo = df_m.dropna(subset=['lat', 'lon'])
 
         if not df_geo.empty:
@@ -1719,12 +1769,19 @@ elif cargo_limpo == "admin":
 
                             with st.spinner("Subindo para o Drive..."):
                                 link_gerado = salvar_documento_drive(arq_pdf, f"ORIGINAL_{n_doc}_{u_destino}",
-                                                                     st.secrets, st.session_state.get('error_log'))
+                                                                     st.secrets, st.session_state.get('error_log'),
+                                                                     progresso=barra_de_envio("📤 Subindo PDF..."))
 
                                 if link_gerado:
-                                    if registrar_novo_contrato_admin(u_destino, n_doc, link_gerado, st.secrets, st.session_state.get('error_log')):
+                                    situacao = registrar_novo_contrato_admin(u_destino, n_doc, link_gerado, st.secrets,
+                                                                             st.session_state.get('error_log'))
+                                    if situacao == "duplicada":
+                                        st.warning("Esse envio já tinha sido registrado para essa pessoa.")
+                                    elif situacao:
                                         st.success(f"✅ DOCUMENTO ENVIADO COM SUCESSO!")
                                         st.cache_data.clear()
+                                        atualizar_snapshots(st.secrets["planilha"]["id"], ["Contratos"],
+                                                            st.session_state.get('error_log'))
                                         time.sleep(1)
                                         st.rerun()
                         else:
@@ -1732,7 +1789,7 @@ elif cargo_limpo == "admin":
 
         with col_status:
             st.markdown("### 📋 MONITORAMENTO")
-            df_cont = carregar_dados("Contratos", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+            df_cont = dados["Contratos"]
 
             if df_cont is not None and not df_cont.empty:
                 df_view = pd.merge(df_cont, df_usuarios[['ID_Usuario', 'Nome']], on='ID_Usuario', how='left')
@@ -1800,8 +1857,8 @@ elif cargo_limpo == "suporte":
         </div>
     """, unsafe_allow_html=True)
 
-    df_usuarios = carregar_dados("Usuarios", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
-    df_logs = carregar_dados("Logs", st.secrets["planilha"]["id"], st.session_state.get('error_log'))
+    dados = carregar_abas(["Usuarios", "Logs"], st.secrets, st.session_state.get('error_log'))
+    df_usuarios, df_logs = dados["Usuarios"], dados["Logs"]
 
     tab_diagnostico, tab_logs_erro, tab_acoes, tab_simulador, tab_sistema = st.tabs([
         "🔍 DIAGNÓSTICO", "📛 LOGS DE ERRO", "👁️ TODAS AS AÇÕES", "🧪 SIMULADOR", "⚙️ SISTEMA"
@@ -1962,7 +2019,8 @@ elif cargo_limpo == "suporte":
 
         with c_f1:
             datas_disponiveis = sorted(
-                [d for d in df_logs['Data_Hora'].str.split().str[0].unique().tolist() if "/" in str(d)],
+                [d for d in df_logs['Data_Filtro'].unique().tolist() if d],
+                key=lambda x: datetime.strptime(x, "%d/%m/%Y"),
                 reverse=True
             ) if not df_logs.empty else []
             data_filtro = st.selectbox("📅 DATA:", ["Todas"] + datas_disponiveis[:30])
@@ -1980,7 +2038,7 @@ elif cargo_limpo == "suporte":
 
         if not df_filtrado.empty:
             if data_filtro != "Todas":
-                df_filtrado = df_filtrado[df_filtrado['Data_Hora'].str.contains(data_filtro)]
+                df_filtrado = df_filtrado[df_filtrado['Data_Filtro'] == data_filtro]
             if tipo_filtro != "Todos":
                 df_filtrado = df_filtrado[df_filtrado['Tipo_Acao'].str.contains(tipo_filtro)]
 
@@ -2002,7 +2060,7 @@ elif cargo_limpo == "suporte":
 
             # Tabela detalhada
             st.dataframe(
-                df_filtrado.sort_values('Data_Hora', ascending=False)[
+                df_filtrado.sort_values('Data_Hora_DT', ascending=False)[
                     ['Data_Hora', 'Nome', 'Cargo', 'Tipo_Acao', 'Localização', 'Endereço', 'Feedback']
                 ],
                 use_container_width=True,
@@ -2082,18 +2140,73 @@ elif cargo_limpo == "suporte":
 
             st.markdown("</div>", unsafe_allow_html=True)
 
+        st.markdown("<br>", unsafe_allow_html=True)
+        st.markdown("### 📤 FILA DE REGISTROS")
+
+        fila = status_fila_acoes()
+        c_fila1, c_fila2, c_fila3, c_fila4 = st.columns(4)
+        c_fila1.metric("Na Fila", f"{fila['na_fila']} / {fila['limite']}")
+        c_fila2.metric("Pendentes", fila['pendentes'])
+        c_fila3.metric("Aguardando Reenvio", len(fila['falhas']))
+        c_fila4.metric("Linhas por Chamada", fila['lotes']['linhas_por_chamada'],
+                       help=f"{fila['lotes']['chamadas']} chamadas append_rows, maior lote: {fila['lotes']['maior_lote']}")
+        if fila['falhas']:
+            st.dataframe(pd.DataFrame(fila['falhas'])[['id_usuario', 'tipo_acao', 'tentativas', 'erro']],
+                         width='stretch', hide_index=True)
+
+        saida = status_saida()
+        st.caption(f"💾 Saída durável: {saida['pendentes']} pendente(s), {saida['falhas']} com falha definitiva"
+                   + (f", mais antiga há {saida['mais_antiga_s']}s" if saida['mais_antiga_s'] is not None else "")
+                   + (f" | último erro: {saida['ultimo_erro']}" if saida['ultimo_erro'] else ""))
+
+        fotos = status_fotos()
+        st.caption(f"📸 Fotos em segundo plano: {fotos['enviando']} subindo, {fotos['vinculando']} aguardando "
+                   f"a linha na planilha, {fotos['falhou']} com falha | {fotos['enviadas']} enviada(s) desde o início")
+        if fotos['falhou']:
+            st.dataframe(pd.DataFrame([f for f in fotos['fotos'] if f['situacao'] == "falhou"]),
+                         width='stretch', hide_index=True)
+
+        enderecos = status_enderecos_pendentes()
+        st.caption(f"📍 Endereços pendentes: {enderecos['pendentes']} | "
+                   f"preenchidos: {enderecos['enderecos']} em {enderecos['passadas']} gravações em lote")
+
+        st.markdown("<br>", unsafe_allow_html=True)
+        st.markdown("### 🚦 COTA E DISJUNTOR DO GOOGLE")
+
+        google = status_google()
+        c_google = st.columns(len(google))
+        for coluna, familia in zip(c_google, google):
+            rotulo = {"fechado": "🟢 Normal", "meio_aberto": "🟡 Testando", "aberto": "🔴 Em pausa"}[familia['estado']]
+            coluna.metric(familia['familia'].upper(), rotulo,
+                          f"volta em {familia['reabre_em_s']}s" if familia['reabre_em_s'] else None,
+                          delta_color="off",
+                          help=f"{familia['chamadas']} chamadas, {familia['esperas']} esperaram a cota, "
+                               f"{familia['recusadas']} recusadas, {familia['aberturas']} pausas "
+                               f"(cota: {familia['cota_por_s']}/s, fichas livres: {familia['fichas']})")
+        erros_google = [f"{f['familia']}: {f['ultimo_erro']}" for f in google if f['ultimo_erro']]
+        if erros_google:
+            st.caption("Último erro de sobrecarga — " + " | ".join(erros_google))
+
         st.markdown("<br>", unsafe_allow_html=True)
         st.markdown("### 🗄️ STATUS DO CACHE")
 
+        df_snap = pd.DataFrame(status_snapshots())
+        if not df_snap.empty:
+            st.dataframe(df_snap, width='stretch', hide_index=True)
+        else:
+            st.caption("Nenhuma aba em memória ainda.")
+
         if st.button("🔄 LIMPAR TODO O CACHE", width='stretch'):
             st.cache_data.clear()
+            atualizar_snapshots(st.secrets["planilha"]["id"], error_log=st.session_state.get('error_log'),
+                                completa=True)
             st.success("✅ Cache limpo! A página será recarregada.")
             time.sleep(2)
             st.rerun()
 
         st.info("""
         💡 **Dicas de Debug:**
-        - Se houver erro 429, limpe o cache e aguarde 2 minutos
+        - Erro 429 pausa o Google sozinho (disjuntor): leituras seguem no cache e registros na saída durável
         - Verifique a aba "Logs de Erro" para detalhes
         - Use o Simulador para testar sem afetar produção
         - Em caso de problema no Drive, verifique as credenciais no secrets.toml
@@ -2104,6 +2217,8 @@ elif cargo_limpo == "suporte":
 
         if st.button("🔄 ATUALIZAR TUDO", width='stretch'):
             st.cache_data.clear()
+            atualizar_snapshots(st.secrets["planilha"]["id"], error_log=st.session_state.get('error_log'),
+                                completa=True)
             st.rerun()
 
         if st.button("📸 CAPTURAR SCREENSHOT (DEBUG)", width='stretch'):
@@ -0,0 +1,128 @@
+# =============================================================================
+# REGIOES_DF.PY - REGIÕES ADMINISTRATIVAS DO DF (RESOLUÇÃO OFFLINE, SEM REDE)
+# =============================================================================
+
+# Resolução offline: a campanha é toda no DF e o painel só precisa da região
+# administrativa. Primeiro o ponto é testado contra o contorno (grosseiro) do DF:
+# fora dele (Entorno goiano) fica para o Nominatim. Dentro, RAs com polígono
+# próprio ganham; no resto o ponto vai para o centro de RA mais próximo.
+RAIO_MAXIMO_RA = 0.12  # Graus (~13 km): mais longe que isso de qualquer centro = deixa para o Nominatim
+TAMANHO_BALDE_RA = 0.1  # Graus por célula do índice em grade
+CIDADE_DF = "Brasília"
+
+REGIOES_ADMINISTRATIVAS_DF = {
+    "Plano Piloto": (-15.7942, -47.8822),
+    "Gama": (-16.0190, -48.0660),
+    "Taguatinga": (-15.8333, -48.0564),
+    "Brazlândia": (-15.6750, -48.2000),
+    "Sobradinho": (-15.6530, -47.7910),
+    "Planaltina": (-15.6190, -47.6530),
+    "Paranoá": (-15.7740, -47.7800),
+    "Núcleo Bandeirante": (-15.8710, -47.9670),
+    "Ceilândia": (-15.8190, -48.1080),
+    "Guará": (-15.8220, -47.9800),
+    "Cruzeiro": (-15.7910, -47.9370),
+    "Samambaia": (-15.8760, -48.0880),
+    "Santa Maria": (-16.0190, -48.0130),
+    "São Sebastião": (-15.9020, -47.7790),
+    "Recanto das Emas": (-15.9040, -48.0630),
+    "Lago Sul": (-15.8440, -47.8720),
+    "Riacho Fundo": (-15.8830, -48.0170),
+    "Lago Norte": (-15.7340, -47.8380),
+    "Candangolândia": (-15.8510, -47.9500),
+    "Águas Claras": (-15.8400, -48.0270),
+    "Riacho Fundo II": (-15.9050, -48.0480),
+    "Sudoeste/Octogonal": (-15.7980, -47.9260),
+    "Varjão": (-15.7100, -47.8770),
+    "Park Way": (-15.9000, -47.9600),
+    "SCIA/Estrutural": (-15.7830, -47.9960),
+    "Sobradinho II": (-15.6470, -47.8250),
+    "Jardim Botânico": (-15.8700, -47.8000),
+    "Itapoã": (-15.7480, -47.7680),
+    "SIA": (-15.8020, -47.9530),
+    "Vicente Pires": (-15.8030, -48.0300),
+    "Fercal": (-15.6020, -47.8720),
+    "Sol Nascente/Pôr do Sol": (-15.8300, -48.1350),
+    "Arniqueira": (-15.8530, -48.0050),
+    "Arapoanga": (-15.6380, -47.6480),
+    "Água Quente": (-15.9940, -48.1650),
+}
+
+
+# Contorno do DF em (lat, lon), um pouco para dentro nas divisas com cidades
+# goianas (Águas Lindas, Santo Antônio do Descoberto, Novo Gama, Valparaíso,
+# Cidade Ocidental, Formosa): na dúvida o ponto vai para o Nominatim.
+CONTORNO_DF = [
+    (-15.500, -48.205), (-15.500, -47.400), (-16.050, -47.310), (-16.050, -48.270),
+    (-15.945, -48.225), (-15.850, -48.230), (-15.765, -48.240), (-15.700, -48.262),
+    (-15.600, -48.280),
+]
+
+# RAs alongadas cujo centro engana a busca pelo mais próximo (ex.: o fim da Asa
+# Norte fica mais perto do centro do Varjão que da Rodoviária)
+POLIGONOS_RA = {
+    "Plano Piloto": [
+        (-15.722, -47.905), (-15.722, -47.872), (-15.760, -47.862), (-15.795, -47.860),
+        (-15.818, -47.880), (-15.842, -47.900), (-15.848, -47.925), (-15.830, -47.932),
+        (-15.805, -47.921), (-15.785, -47.925), (-15.760, -47.930), (-15.735, -47.918),
+    ],
+}
+
+
+def dentro_do_poligono(lat, lon, poligono):
+    """Teste do raio (par/ímpar) para um ponto contra um polígono [(lat, lon), ...]"""
+    dentro = False
+    for (lat_a, lon_a), (lat_b, lon_b) in zip(poligono, poligono[1:] + poligono[:1]):
+        if (lat_a > lat) != (lat_b > lat):
+            if lon < lon_a + (lat - lat_a) * (lon_b - lon_a) / (lat_b - lat_a):
+                dentro = not dentro
+    return dentro
+
+
+def _balde_ra(lat, lon):
+    """Célula do índice em grade que contém o ponto"""
+    return int(lat // TAMANHO_BALDE_RA), int(lon // TAMANHO_BALDE_RA)
+
+
+def _montar_indice_ra():
+    """
+    Índice em grade: cada RA entra na sua célula e nas vizinhas alcançáveis pelo
+    raio, então uma consulta só olha as poucas RAs do próprio balde.
+    """
+    indice = {}
+    alcance = int(RAIO_MAXIMO_RA // TAMANHO_BALDE_RA) + 1
+    for nome, (lat, lon) in REGIOES_ADMINISTRATIVAS_DF.items():
+        b_lat, b_lon = _balde_ra(lat, lon)
+        for d_lat in range(-alcance, alcance + 1):
+            for d_lon in range(-alcance, alcance + 1):
+                indice.setdefault((b_lat + d_lat, b_lon + d_lon), []).append((nome, lat, lon))
+    return indice
+
+
+_INDICE_RA = _montar_indice_ra()
+
+
+def regiao_administrativa(lat, lon):
+    """RA do DF que contém o ponto (None se estiver fora do DF ou longe de tudo)"""
+    if not dentro_do_poligono(lat, lon, CONTORNO_DF):
+        return None
+    for nome, poligono in POLIGONOS_RA.items():
+        if dentro_do_poligono(lat, lon, poligono):
+            return nome
+
+    melhor, menor = None, RAIO_MAXIMO_RA ** 2
+    for nome, lat_ra, lon_ra in _INDICE_RA.get(_balde_ra(lat, lon), []):
+        distancia = (lat - lat_ra) ** 2 + (lon - lon_ra) ** 2
+        if distancia <= menor:
+            melhor, menor = nome, distancia
+    return melhor
+
+
+def endereco_da_regiao(c_str):
+    """'Região, Brasília' para 'lat, lon' sem rede; None se o ponto precisar do Nominatim"""
+    try:
+        lat, lon = (float(parte) for parte in str(c_str).split(",", 1))
+    except ValueError:
+        return None
+    regiao = regiao_administrativa(lat, lon)
+    return f"{regiao}, {CIDADE_DF}" if regiao else None
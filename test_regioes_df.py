@@ -0,0 +1,37 @@
+# =============================================================================
+# TESTES - RESOLUÇÃO OFFLINE DE ENDEREÇOS (RAs DO DF)
+# =============================================================================
+
+import pytest
+
+import regioes_df
+
+
+@pytest.mark.parametrize("coords", [
+    "-15.7617, -48.2817",  # Águas Lindas de Goiás
+    "-16.0683, -47.9764",  # Valparaíso de Goiás
+    "-16.0592, -48.0417",  # Novo Gama
+    "-16.0764, -47.9253",  # Cidade Ocidental
+    "-15.9406, -48.2578",  # Santo Antônio do Descoberto
+    "-15.5370, -47.3340",  # Formosa
+])
+def test_entorno_goiano_fica_para_o_nominatim(coords):
+    assert regioes_df.endereco_da_regiao(coords) is None
+
+
+@pytest.mark.parametrize("coords, esperado", [
+    ("-15.7410, -47.8830", "Plano Piloto, Brasília"),  # Asa Norte, quadra 216
+    ("-15.7940, -47.8820", "Plano Piloto, Brasília"),  # Rodoviária
+    ("-15.8300, -47.9150", "Plano Piloto, Brasília"),  # Asa Sul
+    ("-15.7100, -47.8770", "Varjão, Brasília"),
+    ("-16.0190, -48.0660", "Gama, Brasília"),
+    ("-16.0190, -48.0130", "Santa Maria, Brasília"),
+    ("-15.6750, -48.2000", "Brazlândia, Brasília"),
+])
+def test_pontos_do_df_caem_na_ra_certa(coords, esperado):
+    assert regioes_df.endereco_da_regiao(coords) == esperado
+
+
+def test_centro_de_cada_ra_resolve_para_ela_mesma():
+    for nome, (lat, lon) in regioes_df.REGIOES_ADMINISTRATIVAS_DF.items():
+        assert regioes_df.regiao_administrativa(lat, lon) == nome
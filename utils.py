@@ -2,19 +2,37 @@
 # UTILS.PY - FUNÇÕES UTILITÁRIAS E CONEXÕES (SEM UI STREAMLIT)
 # =============================================================================
 
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timezone, timedelta
 import gspread
+import hashlib
 import io
+import json
+import os
+import queue
+import re
 import pandas as pd
+from pandas.api.types import union_categoricals
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from geopy.geocoders import Nominatim
-import streamlit as st
+from PIL import Image, ImageOps
+import sqlite3
+import threading
+import time
 import traceback
+import urllib.parse
+import uuid
+
+from regioes_df import endereco_da_regiao
 
 # Google Credentials
 from google.oauth2.service_account import Credentials as ServiceAccountCredentials
 from google.oauth2.credentials import Credentials as OAuthCredentials
 from google.auth.transport.requests import Request
+from google_auth_httplib2 import AuthorizedHttp
+import httplib2
 from googleapiclient.http import MediaIoBaseUpload
 from googleapiclient.discovery import build
 
@@ -24,6 +42,9 @@ from googleapiclient.discovery import build
 
 TIMEZONE_OFFSET = -3  # Horário de Brasília
 
+# Pasta local (fora do git) para dados que precisam sobreviver a um restart
+PASTA_CACHE_LOCAL = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
 
 # =============================================================================
 # FUNÇÕES DE TEMPO
@@ -83,19 +104,29 @@ def sanitize_whatsapp(v):
 # FUNÇÕES DE GOOGLE - CREDENCIAIS
 # =============================================================================
 
+# Credenciais e serviço do Drive compartilhados pelo processo: sem troca do
+# refresh token nem download do documento de descoberta a cada upload.
+TIMEOUT_DRIVE = 120  # Segundos por requisição ao Drive
+_DRIVE = {'creds': None, 'service': None}
+_DRIVE_LOCK = threading.Lock()
+_DRIVE_HTTP = threading.local()  # Conexão autorizada de cada thread
+
 def _get_drive_credentials(secrets, error_log=None):
-    """Usa OAuthCredentials (Refresh Token) para os 15GB do Drive"""
+    """Usa OAuthCredentials (Refresh Token) para os 15GB do Drive (token reaproveitado até perto de vencer)"""
     try:
         creds_info = secrets["google_drive"]
-        creds = OAuthCredentials(
-            token=None,
-            refresh_token=creds_info["refresh_token"],
-            token_uri=creds_info["token_uri"],
-            client_id=creds_info["client_id"],
-            client_secret=creds_info["client_secret"]
-        )
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
+        with _DRIVE_LOCK:
+            creds = _DRIVE['creds']
+            if creds is None or creds.refresh_token != creds_info["refresh_token"]:
+                creds = OAuthCredentials(
+                    token=None,
+                    refresh_token=creds_info["refresh_token"],
+                    token_uri=creds_info["token_uri"],
+                    client_id=creds_info["client_id"],
+                    client_secret=creds_info["client_secret"]
+                )
+                _DRIVE.update(creds=creds, service=None)
+            if _token_perto_de_vencer(creds):
                 creds.refresh(Request())
         return creds
     except Exception as e:
@@ -111,6 +142,39 @@ def _get_drive_credentials(secrets, error_log=None):
         return None
 
 
+def _get_drive_service(secrets, error_log=None):
+    """
+    Retorna (service, http): o serviço do Drive compartilhado (montado uma vez,
+    com o documento de descoberta embutido na biblioteca) e a conexão autorizada
+    desta thread, a ser passada em execute(http=http). Retorna (None, None) em caso de erro.
+    """
+    creds = _get_drive_credentials(secrets, error_log)
+    if creds is None:
+        return None, None
+    try:
+        with _DRIVE_LOCK:
+            if _DRIVE['service'] is None:
+                _DRIVE['service'] = build('drive', 'v3', credentials=creds,
+                                          static_discovery=True, cache_discovery=False)
+            service = _DRIVE['service']
+        # httplib2.Http não é thread-safe: cada thread mantém a sua conexão (e o keep-alive dela)
+        if getattr(_DRIVE_HTTP, 'creds', None) is not creds:
+            _DRIVE_HTTP.http = AuthorizedHttp(creds, http=httplib2.Http(timeout=TIMEOUT_DRIVE))
+            _DRIVE_HTTP.creds = creds
+        return service, _DRIVE_HTTP.http
+    except Exception as e:
+        if error_log is not None:
+            error_log.append({
+                'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                'erro': str(e),
+                'funcao': '_get_drive_service',
+                'traceback': traceback.format_exc(),
+                'tipo': type(e).__name__
+            })
+        print(f"Erro ao montar serviço do Drive: {e}")
+        return None, None
+
+
 def _get_sheets_credentials(secrets, error_log=None):
     """Service Account - Para o Sheets (Logs/Usuarios)"""
     try:
@@ -130,11 +194,40 @@ def _get_sheets_credentials(secrets, error_log=None):
         return None
 
 
+# Cliente gspread e handles de planilha/aba reaproveitados por todas as sessões:
+# autorizar, open_by_key e worksheet() custam chamadas de metadados cada um.
+RENOVAR_TOKEN_ANTES = 300  # Segundos antes de o token vencer em que ele é renovado
+VALIDADE_HANDLES = 3600  # Handles de planilha/aba são refeitos depois disso
+
+_CLIENTES = {}  # conta de serviço -> {'client', 'creds'}
+_HANDLES = {}  # (planilha_id, aba ou None) -> (handle, criado_em)
+_CLIENTES_LOCK = threading.Lock()
+
+
+def _token_perto_de_vencer(creds):
+    """Indica se o token de acesso não existe ou vence nos próximos minutos"""
+    if not creds.valid or creds.expiry is None:
+        return True
+    # google-auth guarda expiry como datetime UTC sem fuso
+    return (creds.expiry - datetime.now(timezone.utc).replace(tzinfo=None)).total_seconds() < RENOVAR_TOKEN_ANTES
+
+
 def _get_gspread_client(secrets, error_log=None):
-    """Inicializa cliente do Google Sheets"""
+    """Cliente do Google Sheets compartilhado (um por conta de serviço), com token sempre válido"""
     try:
-        creds = _get_sheets_credentials(secrets, error_log)
-        return gspread.authorize(creds) if creds else None
+        creds_dict = secrets.get("connections", {}).get("gsheets")
+        conta = str(creds_dict.get("client_email", "")) if creds_dict else ""
+        with _CLIENTES_LOCK:
+            pool = _CLIENTES.get(conta)
+            if pool is None:
+                creds = _get_sheets_credentials(secrets, error_log)
+                if creds is None:
+                    return None
+                pool = {'client': gspread.authorize(creds), 'creds': creds}
+                _CLIENTES[conta] = pool
+            if _token_perto_de_vencer(pool['creds']):
+                pool['creds'].refresh(Request())
+            return pool['client']
     except Exception as e:
         if error_log is not None:
             error_log.append({
@@ -148,16 +241,771 @@ def _get_gspread_client(secrets, error_log=None):
         return None
 
 
+def _get_handle(secrets, nome_aba, error_log=None):
+    """Handle em cache da planilha (nome_aba=None) ou de uma aba dela"""
+    planilha_id = secrets["planilha"]["id"]
+    chave = (planilha_id, nome_aba)
+    client = _get_gspread_client(secrets, error_log)
+    if client is None:
+        return None
+
+    with _CLIENTES_LOCK:
+        em_cache = _HANDLES.get(chave)
+        if em_cache is not None and time.time() - em_cache[1] < VALIDADE_HANDLES:
+            return em_cache[0]
+
+    if nome_aba is None:
+        with _chamada_google('sheets'):
+            handle = client.open_by_key(planilha_id)
+    else:
+        planilha = _get_handle(secrets, None, error_log)
+        if planilha is None:
+            return None
+        with _chamada_google('sheets'):
+            handle = planilha.worksheet(nome_aba)
+
+    with _CLIENTES_LOCK:
+        _HANDLES[chave] = (handle, time.time())
+    return handle
+
+
+def _get_planilha(secrets, error_log=None):
+    """Planilha principal (handle compartilhado)"""
+    return _get_handle(secrets, None, error_log)
+
+
+def _get_worksheet(secrets, nome_aba, error_log=None):
+    """Aba da planilha principal pronta para gravar (handle compartilhado)"""
+    try:
+        return _get_handle(secrets, nome_aba, error_log)
+    except Exception as e:
+        if error_log is not None:
+            error_log.append({
+                'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                'erro': str(e),
+                'funcao': '_get_worksheet',
+                'traceback': traceback.format_exc(),
+                'tipo': type(e).__name__
+            })
+        print(f"Erro ao abrir aba {nome_aba}: {e}")
+        return None
+
+
+def _descartar_handles(planilha_id=None):
+    """Esquece handles em cache (ex.: aba renomeada ou apagada na planilha)"""
+    with _CLIENTES_LOCK:
+        for chave in list(_HANDLES):
+            if planilha_id is None or chave[0] == planilha_id:
+                del _HANDLES[chave]
+
+
+# =============================================================================
+# COTA E DISJUNTOR DAS APIS DO GOOGLE
+# =============================================================================
+
+# Toda chamada ao Google passa por um balde de fichas da sua família (processo
+# inteiro, todas as sessões) e por um disjuntor. 429 ou 5xx/rede seguidos abrem
+# o disjuntor: enquanto aberto as chamadas falham na hora, as leituras ficam nos
+# snapshots/espelho e as gravações na saída durável, até uma chamada de teste passar.
+# Família -> (fichas repostas por segundo, rajada máxima)
+COTAS_GOOGLE = {
+    'gviz': (2.0, 10),
+    'sheets': (1.0, 10),  # Sheets API: 60 requisições/min por usuário
+    'drive': (3.0, 10),
+}
+ESPERA_MAXIMA_COTA = 15  # Segundos; se a fila pela cota for maior, a chamada falha na hora
+FALHAS_PARA_ABRIR = 3  # Erros 5xx/rede seguidos que abrem o disjuntor (429 abre na hora)
+PAUSA_DISJUNTOR = 30  # Segundos aberto; dobra a cada nova abertura seguida
+PAUSA_COTA_ESGOTADA = 60  # Pausa mínima após um 429 (as cotas do Google são por minuto)
+PAUSA_MAXIMA_DISJUNTOR = 600
+
+_CONTROLE_GOOGLE = {
+    familia: {
+        'fichas': float(rajada), 'reposto_em': time.time(),
+        'estado': "fechado", 'falhas': 0, 'aberto_ate': 0.0, 'pausa': PAUSA_DISJUNTOR, 'testando': False,
+        'chamadas': 0, 'esperas': 0, 'recusadas': 0, 'aberturas': 0, 'ultimo_erro': None
+    }
+    for familia, (_, rajada) in COTAS_GOOGLE.items()
+}
+_CONTROLE_GOOGLE_LOCK = threading.Lock()
+
+
+def _status_http(erro):
+    """Código HTTP de um erro do gspread, requests, urllib ou googleapiclient (None se não houver)"""
+    for atributo in ('response', 'resp'):
+        resposta = getattr(erro, atributo, None)
+        if resposta is not None:
+            status = getattr(resposta, 'status_code', None) or getattr(resposta, 'status', None)
+            if status is not None:
+                return int(status)
+    codigo = getattr(erro, 'code', None)
+    return codigo if isinstance(codigo, int) else None
+
+
+def _erro_de_sobrecarga(erro):
+    """429, 5xx ou falha de rede: o problema é o Google, não a requisição"""
+    status = _status_http(erro)
+    if status is not None:
+        return status == 429 or status >= 500
+    return isinstance(erro, OSError)  # Timeout/conexão (requests e urllib herdam de OSError)
+
+
+def _disjuntor_aberto(familia):
+    """Indica se as chamadas da família estão suspensas agora"""
+    with _CONTROLE_GOOGLE_LOCK:
+        controle = _CONTROLE_GOOGLE[familia]
+        return controle['estado'] != "fechado" and (time.time() < controle['aberto_ate'] or controle['testando'])
+
+
+def _fim_da_pausa(familia):
+    """Momento (time.time) em que a família volta a aceitar chamadas (0 se já aceita)"""
+    with _CONTROLE_GOOGLE_LOCK:
+        controle = _CONTROLE_GOOGLE[familia]
+        return controle['aberto_ate'] if controle['estado'] != "fechado" else 0.0
+
+
+def _liberar_chamada(familia):
+    """Reserva uma ficha da família, esperando a reposição se preciso; falha na hora se não der"""
+    with _CONTROLE_GOOGLE_LOCK:
+        controle = _CONTROLE_GOOGLE[familia]
+        agora = time.time()
+        testar = False
+        if controle['estado'] != "fechado":
+            if agora < controle['aberto_ate'] or controle['testando']:
+                controle['recusadas'] += 1
+                raise ConnectionError(f"Google {familia} em pausa (disjuntor aberto)")
+            testar = True  # Passou a pausa: só esta chamada testa se o Google voltou
+
+        taxa, rajada = COTAS_GOOGLE[familia]
+        controle['fichas'] = min(rajada, controle['fichas'] + (agora - controle['reposto_em']) * taxa)
+        controle['reposto_em'] = agora
+        espera = max(0.0, (1 - controle['fichas']) / taxa)
+        if espera > ESPERA_MAXIMA_COTA:
+            controle['recusadas'] += 1
+            raise ConnectionError(f"Cota local de Google {familia} esgotada (espera de {int(espera)}s)")
+
+        # A ficha fica reservada (o saldo pode ficar negativo): cada um espera a sua vez
+        controle['fichas'] -= 1
+        controle['chamadas'] += 1
+        if espera:
+            controle['esperas'] += 1
+        if testar:
+            controle['estado'] = "meio_aberto"
+            controle['testando'] = True
+    if espera:
+        time.sleep(espera)
+
+
+def _registrar_resultado(familia, erro=None):
+    """Fecha o disjuntor se o Google respondeu; abre após 429 ou FALHAS_PARA_ABRIR falhas seguidas"""
+    with _CONTROLE_GOOGLE_LOCK:
+        controle = _CONTROLE_GOOGLE[familia]
+        controle['testando'] = False
+        if erro is None or not _erro_de_sobrecarga(erro):
+            if controle['estado'] != "fechado":
+                print(f"Google {familia} voltou a responder: disjuntor fechado")
+            controle.update(estado="fechado", falhas=0, pausa=PAUSA_DISJUNTOR)
+            return
+
+        controle['falhas'] += 1
+        controle['ultimo_erro'] = f"{type(erro).__name__}: {erro}"[:300]
+        status = _status_http(erro)
+        if status == 429 or controle['estado'] == "meio_aberto" or controle['falhas'] >= FALHAS_PARA_ABRIR:
+            pausa = max(controle['pausa'], PAUSA_COTA_ESGOTADA) if status == 429 else controle['pausa']
+            controle.update(
+                estado="aberto",
+                aberto_ate=time.time() + pausa,
+                pausa=min(pausa * 2, PAUSA_MAXIMA_DISJUNTOR),
+                aberturas=controle['aberturas'] + 1
+            )
+            print(f"Disjuntor de Google {familia} aberto por {pausa}s: {controle['ultimo_erro']}")
+
+
+@contextmanager
+def _chamada_google(familia):
+    """Envolve uma chamada ao Google (with _chamada_google('sheets'): ...) com cota e disjuntor"""
+    _liberar_chamada(familia)
+    try:
+        yield
+    except Exception as e:
+        _registrar_resultado(familia, e)
+        raise
+    except BaseException:
+        # GeneratorExit/KeyboardInterrupt não dizem nada do Google, mas a chamada
+        # de teste (meio_aberto) precisa ser liberada ou o disjuntor fica travado
+        with _CONTROLE_GOOGLE_LOCK:
+            _CONTROLE_GOOGLE[familia]['testando'] = False
+        raise
+    _registrar_resultado(familia)
+
+
+def status_google():
+    """Estado da cota e do disjuntor de cada família de API (para o painel de suporte)"""
+    agora = time.time()
+    with _CONTROLE_GOOGLE_LOCK:
+        return [
+            {
+                'familia': familia,
+                'estado': controle['estado'],
+                'fichas': round(max(0.0, min(COTAS_GOOGLE[familia][1], controle['fichas']
+                                             + (agora - controle['reposto_em']) * COTAS_GOOGLE[familia][0])), 1),
+                'cota_por_s': COTAS_GOOGLE[familia][0],
+                'chamadas': controle['chamadas'],
+                'esperas': controle['esperas'],
+                'recusadas': controle['recusadas'],
+                'aberturas': controle['aberturas'],
+                'reabre_em_s': max(0, int(controle['aberto_ate'] - agora)) if controle['estado'] != "fechado" else None,
+                'ultimo_erro': controle['ultimo_erro']
+            }
+            for familia, controle in _CONTROLE_GOOGLE.items()
+        ]
+
+
 # =============================================================================
 # FUNÇÕES DE GOOGLE SHEETS - DADOS
 # =============================================================================
 
+# Tempo (em segundos) que o snapshot de cada aba é considerado fresco. Vencido
+# esse prazo, a versão anterior continua sendo servida enquanto UMA única
+# atualização roda em segundo plano (stale-while-revalidate).
+TTL_ABAS = {
+    "Usuarios": 300,
+    "Grupos": 300,
+    "Mensagens": 120,
+    "Contratos": 60,
+    "Logs": 30,
+}
+TTL_PADRAO = 120
+ESPERA_APOS_FALHA = 30  # Segundos antes de tentar de novo uma atualização que falhou
+
+# Vencido o TTL, a aba não é rebaixada direto: primeiro uma sonda barata (só a
+# última linha conhecida em diante) diz se algo mudou. Edições manuais no meio
+# da planilha não aparecem na sonda, então de tempos em tempos a carga é completa.
+RECARGA_COMPLETA_A_CADA = 1800
+# Quantas vezes a revalidação sonda de novo quando o app mexe no snapshot durante a busca
+TENTATIVAS_REVALIDACAO = 3
+# Cargas completas pedidas por botão dentro deste prazo de outra são a mesma (cliques repetidos)
+INTERVALO_MINIMO_CARGA_COMPLETA = 30
+
+# Cache compartilhado por TODAS as sessões do processo: (planilha_id, aba) -> snapshot
+_SNAPSHOTS = {}
+_SNAPSHOTS_LOCK = threading.Lock()
+_CARGA_INICIAL_LOCKS = {}
+_CARGA_FORCADA_LOCKS = {}
+
+# Abas em que o app só acrescenta linhas (registrar_acao): a atualização busca
+# apenas a cauda nova em vez de baixar todo o histórico de novo.
+ABAS_INCREMENTAIS = {"Logs"}
+
+
+# Esquema declarado de cada aba. Tudo chega como texto (sem "nan"); depois:
+#  - data_hora: coluna "dd/mm/aaaa HH:MM:SS" convertida UMA vez em Data_Hora_DT
+#    (datetime64) + Data_Filtro ("dd/mm/aaaa", chave de data para filtros)
+#  - coordenadas: coluna "lat,lon" separada em lat/lon (float)
+#  - categorias: campos de baixa cardinalidade guardados como category
+#  - obrigatorias: colunas criadas com valor padrão se faltarem na planilha
+ESQUEMAS_ABAS = {
+    "Usuarios": {
+        "categorias": ["Cargo", "ID_Grupo"],
+    },
+    "Logs": {
+        "data_hora": "Data_Hora",
+        "coordenadas": "Localização",
+        "obrigatorias": {
+            "Localização": "Sem GPS",
+            "Endereço": "Não identificado",
+            "Feedback": "Nenhum",
+        },
+    },
+    "Grupos": {
+        "categorias": ["Macro_Grupo"],
+    },
+    "Contratos": {
+        "categorias": ["Status"],
+        "obrigatorias": {"Link_Assinado": ""},
+    },
+}
+
+# Colunas criadas pelo esquema (não existem na planilha)
+COLUNAS_DERIVADAS = ["Data_Hora_DT", "Data_Filtro", "lat", "lon"]
+
+# Downloads completos são lidos em blocos deste tamanho: cada bloco já é tipado
+# antes do próximo ser lido, então o pico de memória não cresce com o texto cru.
+LINHAS_POR_BLOCO = 20000
+TIMEOUT_DOWNLOAD = 60
+
+
+def _aplicar_esquema(df, nome_aba):
+    """Converte um DataFrame de texto cru nos tipos declarados em ESQUEMAS_ABAS"""
+    esquema = ESQUEMAS_ABAS.get(nome_aba, {})
+
+    for coluna in df.columns:
+        df[coluna] = df[coluna].str.strip()
+
+    for coluna, padrao in esquema.get("obrigatorias", {}).items():
+        if coluna not in df.columns:
+            df[coluna] = padrao
+
+    col_data = esquema.get("data_hora")
+    if col_data and col_data in df.columns:
+        data_hora = pd.to_datetime(df[col_data], format="%d/%m/%Y %H:%M:%S", errors='coerce')
+        df["Data_Hora_DT"] = data_hora
+        df["Data_Filtro"] = df[col_data].str[:10].where(data_hora.notna(), "")
+
+    col_coords = esquema.get("coordenadas")
+    if col_coords and col_coords in df.columns:
+        partes = df[col_coords].str.split(",", n=1, expand=True)
+        if partes.shape[1] == 2:
+            df["lat"] = pd.to_numeric(partes[0].str.strip(), errors='coerce')
+            df["lon"] = pd.to_numeric(partes[1].str.strip(), errors='coerce')
+        else:
+            df["lat"] = float("nan")
+            df["lon"] = float("nan")
+
+    return _categorizar(df, nome_aba)
+
+
+def _categorizar(df, nome_aba):
+    """Aplica as colunas category do esquema (também após concatenações)"""
+    for coluna in ESQUEMAS_ABAS.get(nome_aba, {}).get("categorias", []):
+        if coluna in df.columns:
+            df[coluna] = df[coluna].astype("category")
+    return df
+
+
+def _url_gviz(planilha_id, nome_aba, consulta=None):
+    """Monta a URL pública (gviz) em CSV, opcionalmente com uma consulta tq"""
+    url = f"https://docs.google.com/spreadsheets/d/{planilha_id}/gviz/tq?tqx=out:csv&headers=1&sheet={nome_aba}"
+    if consulta:
+        url += f"&tq={urllib.parse.quote(consulta)}"
+    return url
+
+
+def _ler_csv(planilha_id, nome_aba, consulta=None):
+    """Lê o CSV do gviz só como texto (vazio vira "", nunca "nan")"""
+    with _chamada_google('gviz'):
+        return pd.read_csv(_url_gviz(planilha_id, nome_aba, consulta), dtype=str, keep_default_na=False)
+
+
+def _concatenar_blocos(blocos, nome_aba):
+    """Junta blocos já tipados sem desfazer as colunas category (nada volta a ser object)"""
+    if not blocos:
+        return _aplicar_esquema(pd.DataFrame(), nome_aba)
+    if len(blocos) == 1:
+        return blocos[0]
+
+    colunas = list(blocos[0].columns)
+    categorias = [c for c in ESQUEMAS_ABAS.get(nome_aba, {}).get("categorias", []) if c in colunas]
+    unidas = {c: union_categoricals([bloco[c] for bloco in blocos]) for c in categorias}
+    df = pd.concat([bloco.drop(columns=categorias) for bloco in blocos], ignore_index=True)
+    for coluna in categorias:
+        df[coluna] = unidas[coluna]
+    return df[colunas]
+
+
+def _baixar_aba(nome_aba, planilha_id, consulta=None):
+    """Baixa a aba (ou o resultado de uma consulta) via gviz em streaming, tipando bloco a bloco"""
+    with _chamada_google('gviz'), requests.get(_url_gviz(planilha_id, nome_aba, consulta),
+                                               stream=True, timeout=TIMEOUT_DOWNLOAD) as resposta:
+        resposta.raise_for_status()
+        resposta.raw.decode_content = True  # Descompacta o gzip durante a leitura
+        leitor = pd.read_csv(resposta.raw, dtype=str, keep_default_na=False,
+                             encoding='utf-8', chunksize=LINHAS_POR_BLOCO)
+        blocos = [_aplicar_esquema(bloco, nome_aba) for bloco in leitor]
+    return _concatenar_blocos(blocos, nome_aba)
+
+
+def _sondar_cauda(nome_aba, planilha_id, df_anterior):
+    """
+    Busca a última linha conhecida e tudo que veio depois dela.
+    Retorna (cauda, intacta): intacta=False se a planilha mudou de outro jeito.
+    """
+    # Repete a última linha conhecida para confirmar que o histórico não mudou
+    cauda = _ler_csv(planilha_id, nome_aba, f"select * offset {len(df_anterior) - 1}")
+    colunas = list(cauda.columns)
+    # Colunas que sumiram da planilha (as criadas pelo esquema não contam)
+    criadas = set(COLUNAS_DERIVADAS) | set(ESQUEMAS_ABAS.get(nome_aba, {}).get("obrigatorias", {}))
+    sumiram = set(df_anterior.columns) - set(colunas) - criadas
+    intacta = (
+        not cauda.empty
+        and not sumiram
+        and all(c in df_anterior.columns for c in colunas)
+        and [str(v).strip() for v in cauda.iloc[0]] == [str(v) for v in df_anterior[colunas].iloc[-1]]
+    )
+    return cauda, intacta
+
+
+def _recarregar_aba(nome_aba, planilha_id, df_anterior=None, completa=False):
+    """
+    Atualiza uma aba gastando o mínimo: sonda a cauda e só baixa tudo se preciso.
+    Retorna (df, completa) — df é o próprio df_anterior quando nada mudou.
+    """
+    if completa or df_anterior is None or df_anterior.empty:
+        return _baixar_aba(nome_aba, planilha_id), True
+
+    cauda, intacta = _sondar_cauda(nome_aba, planilha_id, df_anterior)
+    if not intacta:
+        # Linhas apagadas ou editadas na planilha: só uma carga completa é confiável
+        # (e as colunas podem ter mudado de lugar: o cabeçalho guardado também vence)
+        _CABECALHOS.pop((planilha_id, nome_aba), None)
+        return _baixar_aba(nome_aba, planilha_id), True
+
+    if len(cauda) == 1:
+        return df_anterior, False
+
+    if nome_aba not in ABAS_INCREMENTAIS:
+        return _baixar_aba(nome_aba, planilha_id), True
+
+    # Aba append-only: anexa só as linhas novas
+    novas = _aplicar_esquema(cauda.iloc[1:].reset_index(drop=True), nome_aba)
+    df = _categorizar(pd.concat([df_anterior, novas], ignore_index=True), nome_aba)
+    df.attrs['linhas_anexadas'] = len(novas)  # O espelho local grava só estas
+    return df, False
+
+
+# =============================================================================
+# ESPELHO LOCAL DAS PLANILHAS (SQLITE)
+# =============================================================================
+
+# Cada aba baixada é gravada aqui com o horário da busca. Um processo novo
+# (redeploy/restart) serve o espelho na hora e reconcilia com o Google depois.
+ARQUIVO_ESPELHO = os.path.join(PASTA_CACHE_LOCAL, "espelho_planilhas.sqlite")
+_ESPELHO_LOCK = threading.Lock()
+
+
+def _conectar_espelho():
+    """Abre o SQLite do espelho (WAL, para leitura enquanto outra thread grava)"""
+    os.makedirs(PASTA_CACHE_LOCAL, exist_ok=True)
+    con = sqlite3.connect(ARQUIVO_ESPELHO, timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS espelho_meta ("
+        " planilha_id TEXT, aba TEXT, tabela TEXT, buscado_em REAL, linhas INTEGER,"
+        " PRIMARY KEY (planilha_id, aba))"
+    )
+    return con
+
+
+def _tabela_espelho(chave):
+    """Nome da tabela SQLite de uma aba"""
+    planilha_id, nome_aba = chave
+    return f"espelho_{hashlib.sha1(planilha_id.encode()).hexdigest()[:10]}_{nome_aba}"
+
+
+def _gravar_espelho(chave, df, buscado_em):
+    """Persiste a aba no espelho; na sincronização incremental grava só as linhas novas"""
+    planilha_id, nome_aba = chave
+    tabela = _tabela_espelho(chave)
+    colunas = [c for c in df.columns if c not in COLUNAS_DERIVADAS]
+    anexadas = df.attrs.get('linhas_anexadas', 0)
+
+    try:
+        with _ESPELHO_LOCK:
+            con = _conectar_espelho()
+            try:
+                meta = con.execute(
+                    "SELECT linhas FROM espelho_meta WHERE planilha_id = ? AND aba = ?",
+                    (planilha_id, nome_aba)
+                ).fetchone()
+                if anexadas and meta is not None and meta[0] == len(df) - anexadas:
+                    inicio = len(df) - anexadas
+                else:
+                    inicio = 0
+                    df.iloc[:0][colunas].astype(str).to_sql(tabela, con, if_exists='replace', index=False)
+                # Converte para texto bloco a bloco (não duplica a aba inteira na memória)
+                for pos in range(inicio, len(df), LINHAS_POR_BLOCO):
+                    bloco = df.iloc[pos:pos + LINHAS_POR_BLOCO][colunas].astype(str)
+                    bloco.to_sql(tabela, con, if_exists='append', index=False)
+                con.execute(
+                    "INSERT OR REPLACE INTO espelho_meta VALUES (?, ?, ?, ?, ?)",
+                    (planilha_id, nome_aba, tabela, buscado_em, len(df))
+                )
+                con.commit()
+            finally:
+                con.close()
+    except Exception as e:
+        print(f"Erro ao gravar espelho de {nome_aba}: {e}")
+
+
+def _alterar_linha_no_espelho(chave, posicao, valores, total_linhas):
+    """Leva ao espelho uma edição de linha feita no snapshot (se o espelho tem a mesma aba)"""
+    planilha_id, nome_aba = chave
+    try:
+        with _ESPELHO_LOCK:
+            con = _conectar_espelho()
+            try:
+                meta = con.execute(
+                    "SELECT tabela, linhas FROM espelho_meta WHERE planilha_id = ? AND aba = ?",
+                    (planilha_id, nome_aba)
+                ).fetchone()
+                # Linha que o espelho ainda não tem (anexada pelo app): a próxima gravação a leva junto
+                if meta is None or not (posicao < meta[1] <= total_linhas):
+                    return
+                colunas = list(valores)
+                atribuicoes = ", ".join(f'"{c}" = ?' for c in colunas)
+                # As linhas entram na tabela em ordem: rowid = posição + 1
+                con.execute(f'UPDATE "{meta[0]}" SET {atribuicoes} WHERE rowid = ?',
+                            [valores[c] for c in colunas] + [posicao + 1])
+                con.commit()
+            finally:
+                con.close()
+    except Exception as e:
+        print(f"Erro ao atualizar espelho de {nome_aba}: {e}")
+
+
+def _existe_no_espelho(chave):
+    """Indica se a aba já tem cópia no espelho local (sem carregá-la)"""
+    if not os.path.exists(ARQUIVO_ESPELHO):
+        return False
+    try:
+        with _ESPELHO_LOCK:
+            con = _conectar_espelho()
+            try:
+                return con.execute(
+                    "SELECT 1 FROM espelho_meta WHERE planilha_id = ? AND aba = ?", chave
+                ).fetchone() is not None
+            finally:
+                con.close()
+    except Exception as e:
+        print(f"Erro ao consultar espelho: {e}")
+        return False
+
+
+def _ler_espelho(chave):
+    """Lê a aba do espelho local. Retorna (DataFrame tipado, buscado_em) ou (None, None)"""
+    planilha_id, nome_aba = chave
+    if not os.path.exists(ARQUIVO_ESPELHO):
+        return None, None
+    try:
+        with _ESPELHO_LOCK:
+            con = _conectar_espelho()
+            try:
+                meta = con.execute(
+                    "SELECT tabela, buscado_em FROM espelho_meta WHERE planilha_id = ? AND aba = ?",
+                    (planilha_id, nome_aba)
+                ).fetchone()
+                if meta is None:
+                    return None, None
+                blocos = [
+                    _aplicar_esquema(bloco, nome_aba)
+                    for bloco in pd.read_sql_query(f'SELECT * FROM "{meta[0]}" ORDER BY rowid', con,
+                                                   chunksize=LINHAS_POR_BLOCO)
+                ]
+            finally:
+                con.close()
+        return _concatenar_blocos(blocos, nome_aba), meta[1]
+    except Exception as e:
+        print(f"Erro ao ler espelho de {nome_aba}: {e}")
+        return None, None
+
+
+# =============================================================================
+# CACHE COMPARTILHADO (SNAPSHOTS)
+# =============================================================================
+
+def _df_do_snapshot(chave):
+    """DataFrame atual do snapshot (ou None)"""
+    with _SNAPSHOTS_LOCK:
+        entrada = _SNAPSHOTS.get(chave)
+        return entrada['df'] if entrada is not None else None
+
+
+def _guardar_snapshot(chave, df, buscado_em=None, origem="google", completa=True, df_base=None):
+    """
+    Substitui o snapshot de uma aba, marca o horário da busca e persiste no espelho.
+    df_base é o DataFrame de onde a revalidação partiu: se o snapshot mudou no meio
+    (linha anexada/editada pelo app), o resultado está velho e é descartado (False).
+    """
+    buscado_em = buscado_em or time.time()
+    with _SNAPSHOTS_LOCK:
+        anterior = _SNAPSHOTS.get(chave)
+        if df_base is not None and anterior is not None and anterior['df'] is not df_base:
+            return False
+        if anterior is not None and anterior['df'] is df:
+            # Nada mudou na planilha: só renova o prazo
+            anterior.update(atualizado_em=buscado_em, atualizando=False, tentar_apos=0, ultimo_erro=None)
+            return True
+        if completa or anterior is None:
+            carga_completa_em = buscado_em
+        else:
+            carga_completa_em = anterior['carga_completa_em']
+        _SNAPSHOTS[chave] = {
+            'df': df,
+            'atualizado_em': buscado_em,
+            'carga_completa_em': carga_completa_em,
+            'atualizando': False,
+            'tentar_apos': 0,
+            'versao': anterior['versao'] + 1 if anterior else 1,
+            'origem': origem,
+            'ultimo_erro': None
+        }
+
+    if origem == "google":
+        threading.Thread(target=_gravar_espelho, args=(chave, df, buscado_em), daemon=True).start()
+    return True
+
+
+def _revalidar_snapshot(chave, completa=False):
+    """Sonda/rebusca a aba e guarda o resultado (carga completa se a última já está velha)"""
+    planilha_id, nome_aba = chave
+    for _ in range(TENTATIVAS_REVALIDACAO):
+        with _SNAPSHOTS_LOCK:
+            entrada = _SNAPSHOTS.get(chave)
+            df_anterior = entrada['df'] if entrada is not None else None
+            carga_completa = completa or (
+                entrada is not None and time.time() - entrada['carga_completa_em'] > RECARGA_COMPLETA_A_CADA)
+        df, carga_completa = _recarregar_aba(nome_aba, planilha_id, df_anterior, carga_completa)
+        # O app pode ter anexado/editado linhas durante a busca: aí sonda de novo a partir delas
+        if _guardar_snapshot(chave, df, completa=carga_completa, df_base=df_anterior):
+            return
+    # Continua mudando: mantém a versão do app e deixa para a próxima leitura
+    with _SNAPSHOTS_LOCK:
+        entrada = _SNAPSHOTS.get(chave)
+        if entrada is not None:
+            entrada.update(atualizando=False, tentar_apos=0)
+
+
+def _atualizar_em_segundo_plano(chave):
+    """Rebusca a aba sem bloquear ninguém; em caso de falha mantém a versão antiga"""
+    planilha_id, nome_aba = chave
+    try:
+        _revalidar_snapshot(chave)
+    except Exception as e:
+        with _SNAPSHOTS_LOCK:
+            entrada = _SNAPSHOTS.get(chave)
+            if entrada is not None:
+                entrada['atualizando'] = False
+                # Com o disjuntor aberto, nem tenta antes de a pausa acabar
+                entrada['tentar_apos'] = max(time.time() + ESPERA_APOS_FALHA, _fim_da_pausa('gviz'))
+                entrada['ultimo_erro'] = f"{type(e).__name__}: {e}"
+        print(f"Erro ao atualizar snapshot de {nome_aba}: {e}")
+
+
+def _obter_snapshot(nome_aba, planilha_id):
+    """Retorna o DataFrame compartilhado da aba (nunca espera o Google se já houver versão)"""
+    chave = (planilha_id, nome_aba)
+
+    with _SNAPSHOTS_LOCK:
+        entrada = _SNAPSHOTS.get(chave)
+        if entrada is not None:
+            agora = time.time()
+            vencido = agora - entrada['atualizado_em'] > TTL_ABAS.get(nome_aba, TTL_PADRAO)
+            if vencido and not entrada['atualizando'] and agora >= entrada['tentar_apos']:
+                entrada['atualizando'] = True
+                threading.Thread(target=_atualizar_em_segundo_plano, args=(chave,), daemon=True).start()
+            return entrada['df']
+        lock_carga = _CARGA_INICIAL_LOCKS.setdefault(chave, threading.Lock())
+
+    # Primeira carga do processo: só uma sessão busca, as demais aguardam o resultado
+    with lock_carga:
+        with _SNAPSHOTS_LOCK:
+            entrada = _SNAPSHOTS.get(chave)
+        if entrada is not None:
+            return entrada['df']
+
+        # Cold start: serve o espelho local e reconcilia com o Google em segundo plano
+        df, buscado_em = _ler_espelho(chave)
+        if df is not None:
+            _guardar_snapshot(chave, df, buscado_em, origem="espelho")
+            with _SNAPSHOTS_LOCK:
+                _SNAPSHOTS[chave]['atualizando'] = True
+            threading.Thread(target=_atualizar_em_segundo_plano, args=(chave,), daemon=True).start()
+            return df
+
+        df = _baixar_aba(nome_aba, planilha_id)
+        _guardar_snapshot(chave, df)
+        return df
+
+
+# Estruturas derivadas que sabem se atualizar quando o app acrescenta uma
+# linha ao snapshot: (aba, nome_derivado) -> função(valor, registro)
+_ATUALIZADORES_DERIVADOS = {}
+
+
+def _obter_derivado(nome_aba, planilha_id, nome, construtor):
+    """Estrutura calculada a partir do snapshot, refeita só quando o snapshot muda"""
+    chave = (planilha_id, nome_aba)
+    df = _obter_snapshot(nome_aba, planilha_id)
+    with _SNAPSHOTS_LOCK:
+        derivados = _SNAPSHOTS[chave].setdefault('derivados', {})
+        if nome in derivados and derivados[nome][0] is df:
+            return derivados[nome][1]
+
+    valor = construtor(df)
+    with _SNAPSHOTS_LOCK:
+        entrada = _SNAPSHOTS.get(chave)
+        if entrada is not None and entrada['df'] is df:
+            entrada.setdefault('derivados', {})[nome] = (df, valor)
+    return valor
+
+
+def _anexar_ao_snapshot(nome_aba, planilha_id, registros):
+    """Acrescenta ao snapshot em memória linhas que o próprio app acabou de gravar"""
+    chave = (planilha_id, nome_aba)
+    with _SNAPSHOTS_LOCK:
+        entrada = _SNAPSHOTS.get(chave)
+        if entrada is None:
+            return
+        df_atual = entrada['df']
+        colunas = [c for c in df_atual.columns if c not in COLUNAS_DERIVADAS]
+        novas = pd.DataFrame([{c: str(r.get(c, "")) for c in colunas} for r in registros], columns=colunas)
+        novo_df = _categorizar(pd.concat([df_atual, _aplicar_esquema(novas, nome_aba)], ignore_index=True), nome_aba)
+
+        # Derivados com atualizador são corrigidos no lugar; os demais são refeitos na próxima leitura
+        derivados = {}
+        for nome, (_, valor) in entrada.get('derivados', {}).items():
+            atualizador = _ATUALIZADORES_DERIVADOS.get((nome_aba, nome))
+            if atualizador is not None:
+                for registro in registros:
+                    atualizador(valor, registro)
+                derivados[nome] = (novo_df, valor)
+
+        entrada.update(df=novo_df, versao=entrada['versao'] + 1, derivados=derivados)
+
+
+def _alterar_linha_no_snapshot(nome_aba, planilha_id, numero_linha, valores, esperado=None):
+    """
+    Aplica no snapshot em memória uma edição que o app acabou de gravar na
+    linha numero_linha da planilha. Só altera se a linha conferir com 'esperado'.
+    """
+    chave = (planilha_id, nome_aba)
+    with _SNAPSHOTS_LOCK:
+        entrada = _SNAPSHOTS.get(chave)
+        if entrada is None:
+            return False
+        df = entrada['df']
+        posicao = numero_linha - 2  # Linha 1 é o cabeçalho
+        if not (0 <= posicao < len(df)):
+            return False
+        if any(c not in df.columns for c in list(valores) + list(esperado or {})):
+            return False
+        if any(str(df[c].iat[posicao]) != str(v) for c, v in (esperado or {}).items()):
+            return False
+
+        # Quem já pegou o df (cópias, derivados, espelho) continua lendo a versão antiga
+        # intacta: o novo df só copia as colunas alteradas e entra no lugar do antigo
+        novo_df = df.copy(deep=False)
+        for coluna, valor in valores.items():
+            serie = novo_df[coluna].copy()
+            if isinstance(serie.dtype, pd.CategoricalDtype) and valor not in serie.cat.categories:
+                serie = serie.cat.add_categories([valor])
+            serie.iat[posicao] = valor
+            novo_df[coluna] = serie
+        # Índices/modelos podem depender do valor alterado: são refeitos na próxima leitura
+        entrada.update(df=novo_df, versao=entrada['versao'] + 1, derivados={})
+        total_linhas = len(novo_df)
+
+    valores_espelho = {c: str(v) for c, v in valores.items() if c not in COLUNAS_DERIVADAS}
+    threading.Thread(target=_alterar_linha_no_espelho,
+                     args=(chave, posicao, valores_espelho, total_linhas), daemon=True).start()
+    return True
+
+
 def carregar_dados(nome_aba, planilha_id, error_log=None):
-    """Carrega dados de uma aba da planilha como DataFrame"""
+    """Carrega dados de uma aba da planilha como DataFrame (via cache compartilhado)"""
     try:
-        url = f"https://docs.google.com/spreadsheets/d/{planilha_id}/gviz/tq?tqx=out:csv&sheet={nome_aba}"
-        df = pd.read_csv(url)
-        return df.astype(str).apply(lambda x: x.str.strip())
+        # Cópia: as telas adicionam colunas no DataFrame e o snapshot é de todos
+        return _obter_snapshot(nome_aba, planilha_id).copy()
     except Exception as e:
         if error_log is not None:
             error_log.append({
@@ -171,36 +1019,388 @@ def carregar_dados(nome_aba, planilha_id, error_log=None):
         return None
 
 
-def registrar_acao(id_usuario, tipo_acao, localizacao, feedback, secrets, error_log=None):
-    """Registra ação do usuário na planilha de Logs"""
+def _valores_para_df(valores, nome_aba):
+    """Converte a matriz de valores da API do Sheets (1ª linha = cabeçalho) em DataFrame tipado"""
+    if not valores:
+        return _aplicar_esquema(pd.DataFrame(), nome_aba)
+    cabecalho = [str(c).strip() for c in valores[0]]
+    largura = len(cabecalho)
+    # A API omite as células vazias no fim de cada linha
+    linhas = [(list(linha) + [""] * largura)[:largura] for linha in valores[1:]]
+    return _aplicar_esquema(pd.DataFrame(linhas, columns=cabecalho, dtype=str), nome_aba)
+
+
+def _baixar_abas_em_lote(nomes_abas, secrets):
+    """Baixa várias abas em UMA chamada spreadsheets.values.batchGet"""
+    planilha = _get_planilha(secrets)
+    if planilha is None:
+        raise RuntimeError("Cliente do Google Sheets indisponível")
+    with _chamada_google('sheets'):
+        resposta = planilha.values_batch_get([f"'{aba}'" for aba in nomes_abas])
+    intervalos = resposta.get('valueRanges', [])
+    return {
+        aba: _valores_para_df(intervalos[i].get('values', []) if i < len(intervalos) else [], aba)
+        for i, aba in enumerate(nomes_abas)
+    }
+
+
+def carregar_abas(nomes_abas, secrets, error_log=None):
+    """Carrega várias abas de uma vez: snapshots em memória/espelho, e o que faltar num único batchGet"""
+    planilha_id = secrets["planilha"]["id"]
+    resultado = {}
+    faltando = []
+
+    for nome_aba in nomes_abas:
+        chave = (planilha_id, nome_aba)
+        with _SNAPSHOTS_LOCK:
+            em_memoria = chave in _SNAPSHOTS
+        if em_memoria or _existe_no_espelho(chave):
+            resultado[nome_aba] = carregar_dados(nome_aba, planilha_id, error_log)
+        else:
+            faltando.append(nome_aba)
+
+    # Abas grandes só de acréscimo (Logs) ficam fora do lote: o batchGet traria todo o
+    # histórico numa resposta JSON só; pelo gviz em streaming ele é tipado bloco a bloco
+    em_lote = [aba for aba in faltando if aba not in ABAS_INCREMENTAIS]
+    if em_lote:
+        # Segura as cargas iniciais dessas abas (ordem fixa, sem deadlock) enquanto busca o lote
+        with _SNAPSHOTS_LOCK:
+            locks = [_CARGA_INICIAL_LOCKS.setdefault((planilha_id, aba), threading.Lock()) for aba in sorted(em_lote)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            with _SNAPSHOTS_LOCK:
+                em_lote = [aba for aba in em_lote if (planilha_id, aba) not in _SNAPSHOTS]
+            if em_lote:
+                for nome_aba, df in _baixar_abas_em_lote(em_lote, secrets).items():
+                    _guardar_snapshot((planilha_id, nome_aba), df)
+        except Exception as e:
+            if error_log is not None:
+                error_log.append({
+                    'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                    'erro': str(e),
+                    'funcao': 'carregar_abas.batchGet',
+                    'traceback': traceback.format_exc(),
+                    'tipo': type(e).__name__
+                })
+            print(f"batchGet indisponível, buscando abas em paralelo: {e}")
+        finally:
+            for lock in locks:
+                lock.release()
+
+    # O que o lote não trouxe (Logs, ou tudo se ele falhou) vem pelo gviz, em paralelo;
+    # o que ele trouxe já sai do snapshot em memória
+    if faltando:
+        with ThreadPoolExecutor(max_workers=len(faltando)) as executor:
+            futuros = {aba: executor.submit(carregar_dados, aba, planilha_id, error_log) for aba in faltando}
+        for nome_aba, futuro in futuros.items():
+            resultado[nome_aba] = futuro.result()
+
+    return {nome_aba: resultado.get(nome_aba) for nome_aba in nomes_abas}
+
+
+def invalidar_snapshots(planilha_id=None, nome_aba=None, linhas=None):
+    """
+    Marca snapshots como vencidos (a próxima leitura dispara a atualização em segundo plano).
+    Com 'linhas' (valores recém-anexados), só descarta as consultas filtradas que
+    essas linhas atendem: o painel de um voluntário não perde o cache pela ação de outro.
+    """
+    with _SNAPSHOTS_LOCK:
+        for (p_id, aba), entrada in _SNAPSHOTS.items():
+            if (planilha_id is None or p_id == planilha_id) and (nome_aba is None or aba == nome_aba):
+                entrada['atualizado_em'] = 0
+                entrada['tentar_apos'] = 0
+        for chave in list(_CONSULTAS):
+            if (planilha_id is None or chave[0] == planilha_id) and (nome_aba is None or chave[1] == nome_aba):
+                if linhas is None or _consulta_afetada(chave, _CONSULTAS[chave][2], linhas):
+                    del _CONSULTAS[chave]
+
+
+def atualizar_snapshots(planilha_id, nomes_abas=None, error_log=None, completa=False):
+    """
+    Atualiza snapshots AGORA (botões de atualizar e telas logo após uma gravação).
+    completa=True ignora a sonda e baixa tudo (após editar linhas existentes); pedidos
+    simultâneos viram uma carga só, e uma carga de segundos atrás não é repetida.
+    """
+    if nomes_abas is None:
+        with _SNAPSHOTS_LOCK:
+            nomes_abas = [aba for (p_id, aba) in _SNAPSHOTS if p_id == planilha_id]
+
+    for nome_aba in nomes_abas:
+        chave = (planilha_id, nome_aba)
+        try:
+            if not completa:
+                _revalidar_snapshot(chave)
+                continue
+            with _SNAPSHOTS_LOCK:
+                lock = _CARGA_FORCADA_LOCKS.setdefault(chave, threading.Lock())
+            with lock:
+                with _SNAPSHOTS_LOCK:
+                    entrada = _SNAPSHOTS.get(chave)
+                    recente = (entrada is not None
+                               and time.time() - entrada['carga_completa_em'] < INTERVALO_MINIMO_CARGA_COMPLETA)
+                if not recente:
+                    _revalidar_snapshot(chave, completa=True)
+        except Exception as e:
+            if error_log is not None:
+                error_log.append({
+                    'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                    'erro': str(e),
+                    'funcao': 'atualizar_snapshots',
+                    'traceback': traceback.format_exc(),
+                    'tipo': type(e).__name__
+                })
+            print(f"Erro ao atualizar {nome_aba}: {e}")
+
+
+def descartar_consultas(planilha_id, valores):
+    """Esquece as consultas filtradas em cache que usam algum destes valores (ex.: ID do usuário)"""
+    valores = {str(v).strip() for v in valores} - {""}
+    with _SNAPSHOTS_LOCK:
+        for chave in [c for c, (_, _, filtros) in _CONSULTAS.items()
+                      if c[0] == planilha_id and any(str(f[2]).strip() in valores for f in filtros)]:
+            del _CONSULTAS[chave]
+
+
+def status_snapshots():
+    """Resumo dos snapshots em memória (para o painel de suporte)"""
+    agora = time.time()
+    with _SNAPSHOTS_LOCK:
+        return [
+            {
+                'aba': aba,
+                'linhas': len(entrada['df']),
+                'idade_s': int(agora - entrada['atualizado_em']) if entrada['atualizado_em'] else None,
+                'carga_completa_s': int(agora - entrada['carga_completa_em']),
+                'ttl_s': TTL_ABAS.get(aba, TTL_PADRAO),
+                'versao': entrada['versao'],
+                'origem': entrada['origem'],
+                'atualizando': entrada['atualizando'],
+                'ultimo_erro': entrada['ultimo_erro']
+            }
+            for (_, aba), entrada in sorted(_SNAPSHOTS.items())
+        ]
+
+
+# =============================================================================
+# CONSULTAS FILTRADAS NO SERVIDOR (GVIZ QUERY)
+# =============================================================================
+
+# Resultados de consultas recentes: (planilha_id, aba, tq) -> (DataFrame, buscado_em, filtros).
+# As chaves levam usuário, grupo e data: os vencidos saem a cada gravação e o total
+# é limitado (LRU), senão o dicionário cresceria a campanha inteira.
+LIMITE_CONSULTAS = 500
+_CONSULTAS = OrderedDict()
+# Cabeçalho de cada aba: (planilha_id, aba) -> (colunas, lido_em); vence junto com a aba
+_CABECALHOS = {}
+
+# Operadores aceitos em consultar_dados e o equivalente local em pandas
+_OPERADORES_CONSULTA = {
+    "=": lambda serie, valor: serie == valor,
+    "!=": lambda serie, valor: serie != valor,
+    "<": lambda serie, valor: serie < valor,
+    ">": lambda serie, valor: serie > valor,
+    "<=": lambda serie, valor: serie <= valor,
+    ">=": lambda serie, valor: serie >= valor,
+    "starts with": lambda serie, valor: serie.str.startswith(valor),
+    "contains": lambda serie, valor: serie.str.contains(valor, regex=False),
+}
+
+
+def _letra_coluna(indice):
+    """Converte índice 0-based em letra de coluna (0 -> A, 26 -> AA)"""
+    letras = ""
+    indice += 1
+    while indice:
+        indice, resto = divmod(indice - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def _cabecalho_aba(nome_aba, planilha_id):
+    """
+    Cabeçalho da aba (busca só a 1ª linha via 'limit 0' e guarda na memória).
+    Relido depois do TTL da aba: colunas inseridas ou movidas na planilha
+    mudariam as letras dos filtros e o alinhamento das gravações.
+    """
+    chave = (planilha_id, nome_aba)
+    guardado = _CABECALHOS.get(chave)
+    if guardado is None or time.time() - guardado[1] > TTL_ABAS.get(nome_aba, TTL_PADRAO):
+        guardado = (list(_ler_csv(planilha_id, nome_aba, "select * limit 0").columns), time.time())
+        _CABECALHOS[chave] = guardado
+    return guardado[0]
+
+
+def _literal_gviz(valor):
+    """Literal de texto para a linguagem de consulta (não há escape: escolhe as aspas)"""
+    valor = str(valor)
+    if "'" not in valor:
+        return f"'{valor}'"
+    if '"' not in valor:
+        return f'"{valor}"'
+    raise ValueError(f"Valor não pode ser usado em consulta gviz: {valor}")
+
+
+def _montar_consulta(nome_aba, planilha_id, filtros):
+    """Traduz [(coluna, operador, valor), ...] em 'select * where ...' com as letras das colunas"""
+    cabecalho = _cabecalho_aba(nome_aba, planilha_id)
+    condicoes = []
+    for coluna, operador, valor in filtros:
+        if operador not in _OPERADORES_CONSULTA:
+            raise ValueError(f"Operador não suportado: {operador}")
+        letra = _letra_coluna(cabecalho.index(coluna))
+        condicoes.append(f"{letra} {operador} {_literal_gviz(valor)}")
+    return "select * where " + " and ".join(condicoes)
+
+
+def _filtrar_local(df, filtros):
+    """Aplica os mesmos filtros num DataFrame já em memória"""
+    mascara = pd.Series(True, index=df.index)
+    for coluna, operador, valor in filtros:
+        mascara &= _OPERADORES_CONSULTA[operador](df[coluna].astype(str), str(valor))
+    return df[mascara]
+
+
+def _guardar_consulta(chave, df, filtros):
+    """Guarda o resultado, descarta os vencidos e o menos usado se passar de LIMITE_CONSULTAS"""
+    agora = time.time()
+    with _SNAPSHOTS_LOCK:
+        for vencida in [c for c, (_, buscado_em, _) in _CONSULTAS.items()
+                        if agora - buscado_em > TTL_ABAS.get(c[1], TTL_PADRAO)]:
+            del _CONSULTAS[vencida]
+        _CONSULTAS[chave] = (df, agora, filtros)
+        _CONSULTAS.move_to_end(chave)
+        while len(_CONSULTAS) > LIMITE_CONSULTAS:
+            _CONSULTAS.popitem(last=False)
+
+
+def _consulta_afetada(chave, filtros, linhas):
+    """Diz se alguma das linhas novas entraria no resultado da consulta em cache"""
+    guardado = _CABECALHOS.get(chave[:2])
+    if guardado is None:
+        return True
+    cabecalho = guardado[0]
     try:
-        loc_safe = str(localizacao) if localizacao is not None else "Não informada"
-        gps_valido = validar_gps_basico(loc_safe)
-        if not gps_valido:
-            loc_safe = "GPS Inválido/Desativado"
+        novas = pd.DataFrame([list(linha[:len(cabecalho)]) + [""] * (len(cabecalho) - len(linha))
+                              for linha in linhas], columns=cabecalho)
+        return not _filtrar_local(novas, filtros).empty
+    except Exception:
+        return True
 
-        client = _get_gspread_client(secrets, error_log)
-        if client is None:
-            return False
 
-        planilha = client.open_by_key(secrets["planilha"]["id"])
-        aba = planilha.worksheet("Logs")
-        agora_br = get_agora_br()
+def consultar_dados(nome_aba, planilha_id, filtros, error_log=None):
+    """
+    Carrega só as linhas que atendem aos filtros [(coluna, operador, valor), ...].
+    Se a aba inteira já está em memória filtra localmente; senão o filtro vai
+    para o Google (gviz 'select ... where') e só o resultado é transferido.
+    """
+    try:
+        with _SNAPSHOTS_LOCK:
+            em_memoria = (planilha_id, nome_aba) in _SNAPSHOTS
+        if em_memoria:
+            return _filtrar_local(_obter_snapshot(nome_aba, planilha_id), filtros).copy()
+
+        consulta = _montar_consulta(nome_aba, planilha_id, filtros)
+        chave = (planilha_id, nome_aba, consulta)
+        with _SNAPSHOTS_LOCK:
+            em_cache = _CONSULTAS.get(chave)
+            if em_cache is not None:
+                _CONSULTAS.move_to_end(chave)
+        if em_cache is not None and time.time() - em_cache[1] <= TTL_ABAS.get(nome_aba, TTL_PADRAO):
+            return em_cache[0].copy()
+
+        if _disjuntor_aberto('gviz'):
+            # Google em pausa: resultado vencido ou a aba do espelho local valem mais que nada
+            if em_cache is not None:
+                return em_cache[0].copy()
+            if _existe_no_espelho((planilha_id, nome_aba)):
+                return _filtrar_local(_obter_snapshot(nome_aba, planilha_id), filtros).copy()
+
+        df = _baixar_aba(nome_aba, planilha_id, consulta)
+        _guardar_consulta(chave, df, filtros)
+        return df.copy()
+    except Exception as e:
+        if error_log is not None:
+            error_log.append({
+                'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                'erro': str(e),
+                'funcao': 'consultar_dados',
+                'traceback': traceback.format_exc(),
+                'tipo': type(e).__name__
+            })
+        # O cabeçalho pode ter mudado na planilha: relê na próxima consulta
+        _CABECALHOS.pop((planilha_id, nome_aba), None)
+        print(f"Erro ao consultar dados: {e}")
+        return None
 
-        endereco = "Sem GPS"
-        if gps_valido:
-            endereco = obter_endereco_simples(loc_safe, error_log)
 
-        aba.append_row([
-            agora_br.strftime("%Y%m%d%H%M%S"),
-            str(id_usuario),
-            str(tipo_acao),
-            agora_br.strftime("%d/%m/%Y %H:%M:%S"),
-            loc_safe,
-            str(endereco),
-            str(feedback)
+# O endereço não é buscado na hora da gravação: a linha entra com este texto e
+# o preenchimento em segundo plano troca pelo endereço real depois.
+ENDERECO_PENDENTE = "Endereço pendente"
+POSICAO_ENDERECO_LOGS = 5  # Índice da coluna Endereço na linha montada abaixo
+
+
+def _montar_linha_acao(id_usuario, tipo_acao, localizacao, feedback, agora_br, error_log=None):
+    """Monta a linha da aba Logs (horário da ação vem de quem chamou)"""
+    loc_safe = str(localizacao) if localizacao is not None else "Não informada"
+    gps_valido = validar_gps_basico(loc_safe)
+    if not gps_valido:
+        loc_safe = "GPS Inválido/Desativado"
+
+    endereco = "Sem GPS"
+    if gps_valido:
+        # Dentro do DF a região sai na hora, sem rede; o resto fica para o preenchimento
+        endereco = _endereco_offline(loc_safe) or ENDERECO_PENDENTE
+
+    return [
+        agora_br.strftime("%Y%m%d%H%M%S"),
+        str(id_usuario),
+        str(tipo_acao),
+        agora_br.strftime("%d/%m/%Y %H:%M:%S"),
+        loc_safe,
+        str(endereco),
+        str(feedback)
+    ]
+
+
+def _anexar_linhas_logs(linhas, secrets, error_log=None):
+    """Grava várias linhas na aba Logs numa única chamada append_rows (na ordem da lista)"""
+    aba = _get_worksheet(secrets, "Logs", error_log)
+    if aba is None:
+        raise RuntimeError("Aba Logs indisponível")
+
+    try:
+        with _chamada_google('sheets'):
+            resposta = aba.append_rows(linhas)
+    except gspread.exceptions.APIError:
+        _descartar_handles(secrets["planilha"]["id"])
+        raise
+
+    # Linha real de cada registro (ex.: "Logs!A120:G125") para o preenchimento do endereço e da foto
+    intervalo = resposta.get('updates', {}).get('updatedRange', '') if isinstance(resposta, dict) else ''
+    inicio = re.search(r"![A-Z]+(\d+)", intervalo)
+    if inicio:
+        primeira = int(inicio.group(1))
+        _agendar_enderecos(secrets, [
+            (primeira + i, linha[4]) for i, linha in enumerate(linhas)
+            if linha[POSICAO_ENDERECO_LOGS] == ENDERECO_PENDENTE
         ])
-        return True
+        _localizar_fotos([
+            (primeira + i, linha[POSICAO_ACAO_LOGS]) for i, linha in enumerate(linhas)
+            if FOTO_PENDENTE in linha[POSICAO_ACAO_LOGS]
+        ])
+    invalidar_snapshots(secrets["planilha"]["id"], "Logs", linhas)
+
+
+def registrar_acao(id_usuario, tipo_acao, localizacao, feedback, secrets, error_log=None, chave=None):
+    """
+    Registra ação do usuário na planilha de Logs (espera a gravação; falha temporária
+    fica para reenvio). Retorna False se o Google recusou a linha de vez ("falhou").
+    """
+    try:
+        linha = _montar_linha_acao(id_usuario, tipo_acao, localizacao, feedback, get_agora_br(), error_log)
+        chave = chave or uuid.uuid4().hex
+        return gravar_linha_duravel(secrets, "Logs", linha, chave, error_log) != "falhou"
 
     except Exception as e:
         if error_log is not None:
@@ -216,23 +1416,19 @@ def registrar_acao(id_usuario, tipo_acao, localizacao, feedback, secrets, error_
 
 
 def registrar_novo_contrato_admin(id_usuario, nome_arquivo, link_original, secrets, error_log=None):
-    """Cria uma nova linha na aba Contratos"""
+    """
+    Cria uma nova linha na aba Contratos. Retorna a situação da gravação
+    ("gravada", "pendente" ou "duplicada") ou False em caso de erro.
+    """
     try:
-        client = _get_gspread_client(secrets, error_log)
-        if client is None:
-            return False
-
-        planilha = client.open_by_key(secrets["planilha"]["id"])
-        aba = planilha.worksheet("Contratos")
-
-        aba.append_row([
+        # Só o MESMO upload (mesmo link) repetido é duplicado; um PDF corrigido é outro link
+        return gravar_linha_duravel(secrets, "Contratos", [
             str(id_usuario),
             str(nome_arquivo),
             str(link_original),
             "Aguardando Assinatura",
             ""
-        ])
-        return True
+        ], f"contrato|{id_usuario}|{nome_arquivo}|{link_original}", error_log)
     except Exception as e:
         if error_log is not None:
             error_log.append({
@@ -246,35 +1442,75 @@ def registrar_novo_contrato_admin(id_usuario, nome_arquivo, link_original, secre
         return False
 
 
-def atualizar_contrato_enviado(id_usuario, nome_arquivo, link_drive, secrets, error_log=None):
-    """Atualiza o link e status do contrato na planilha"""
-    try:
-        client = _get_gspread_client(secrets, error_log)
-        if client is None:
-            return False
+def _montar_indice_contratos(df):
+    """(ID_Usuario, Nome_Arquivo) -> nº da linha na planilha (vale a primeira ocorrência)"""
+    indice = {}
+    if 'ID_Usuario' not in df.columns or 'Nome_Arquivo' not in df.columns:
+        return indice
+    for posicao, chave in enumerate(zip(df['ID_Usuario'].astype(str), df['Nome_Arquivo'].astype(str))):
+        indice.setdefault(chave, posicao + 2)
+    return indice
 
-        planilha = client.open_by_key(secrets["planilha"]["id"])
-        aba = planilha.worksheet("Contratos")
-        dados = aba.get_all_records()
-        linha_para_atualizar = None
 
-        for i, linha in enumerate(dados, start=2):
-            if str(linha.get('ID_Usuario')) == str(id_usuario) and \
-                    str(linha.get('Nome_Arquivo')) == str(nome_arquivo):
-                linha_para_atualizar = i
-                break
+def atualizar_contrato_enviado(id_usuario, nome_arquivo, link_drive, secrets, error_log=None):
+    """
+    Atualiza o link e status do contrato na planilha: uma leitura batchGet confere
+    que a linha ainda é deste contrato e um único batch_update grava.
+    """
+    try:
+        planilha_id = secrets["planilha"]["id"]
+        chave = (str(id_usuario), str(nome_arquivo))
+        esperado = {'ID_Usuario': chave[0], 'Nome_Arquivo': chave[1]}
+
+        linha_para_atualizar = _obter_derivado("Contratos", planilha_id, "indice_contratos",
+                                               _montar_indice_contratos).get(chave)
+        if linha_para_atualizar is None:
+            # Contrato recém-criado que o snapshot ainda não tem: sincroniza e tenta de novo
+            atualizar_snapshots(planilha_id, ["Contratos"], error_log)
+            linha_para_atualizar = _obter_derivado("Contratos", planilha_id, "indice_contratos",
+                                                   _montar_indice_contratos).get(chave)
 
         if linha_para_atualizar:
-            cabecalho = aba.row_values(1)
-
-            if 'Link_Assinado' in cabecalho:
-                col_link = cabecalho.index('Link_Assinado') + 1
-                aba.update_cell(linha_para_atualizar, col_link, link_drive)
-
-            if 'Status' in cabecalho:
-                col_status = cabecalho.index('Status') + 1
-                aba.update_cell(linha_para_atualizar, col_status, "Assinado / Em Análise")
-
+            aba = _get_worksheet(secrets, "Contratos", error_log)
+            planilha = _get_planilha(secrets, error_log)
+            if aba is None or planilha is None:
+                return False
+
+            # Letras das colunas pelo snapshot, conferidas junto com a linha (sem buscar o cabeçalho à parte)
+            for tentativa in range(2):
+                cabecalho = _colunas_do_snapshot("Contratos", planilha_id)
+                cabecalho_planilha, lidas = _ler_linhas_da_planilha(planilha, "Contratos", [linha_para_atualizar])
+                if _planilha_confere(cabecalho_planilha, cabecalho, lidas, {linha_para_atualizar: esperado}):
+                    break
+                # Linha apagada/ordenada na planilha: recarrega e procura o contrato de novo
+                _revalidar_snapshot((planilha_id, "Contratos"), completa=True)
+                linha_para_atualizar = _obter_derivado("Contratos", planilha_id, "indice_contratos",
+                                                       _montar_indice_contratos).get(chave)
+                if linha_para_atualizar is None:
+                    return False
+            else:
+                return False
+
+            novos_valores = {}
+            if 'Link_Assinado' in cabecalho_planilha:
+                novos_valores['Link_Assinado'] = link_drive
+            if 'Status' in cabecalho_planilha:
+                novos_valores['Status'] = "Assinado / Em Análise"
+            if not novos_valores:
+                return True
+
+            with _chamada_google('sheets'):
+                aba.batch_update([
+                    {'range': f"{_letra_coluna(cabecalho.index(coluna))}{linha_para_atualizar}", 'values': [[valor]]}
+                    for coluna, valor in novos_valores.items()
+                ])
+
+            # A edição entra no snapshot em memória (sem rebaixar a aba)
+            _alterar_linha_no_snapshot("Contratos", planilha_id, linha_para_atualizar, novos_valores,
+                                       esperado=esperado)
+            with _SNAPSHOTS_LOCK:
+                for chave_consulta in [c for c in _CONSULTAS if c[:2] == (planilha_id, "Contratos")]:
+                    del _CONSULTAS[chave_consulta]
             return True
         return False
     except Exception as e:
@@ -291,74 +1527,1234 @@ def atualizar_contrato_enviado(id_usuario, nome_arquivo, link_drive, secrets, er
 
 
 # =============================================================================
-# FUNÇÕES DE GOOGLE DRIVE - UPLOAD
+# UPSERT EM ABAS COM CHAVE (MENSAGENS, GRUPOS, USUARIOS)
 # =============================================================================
 
-def salvar_foto_drive(foto_arquivo, nome_arquivo, secrets, error_log=None):
-    """Salva foto no Google Drive"""
+def _montar_indice_chave(coluna_chave):
+    """Construtor do índice valor da chave -> nº da linha (vale a última ocorrência)"""
+    def construtor(df):
+        if coluna_chave not in df.columns:
+            return {}
+        return {str(valor).strip(): posicao + 2 for posicao, valor in enumerate(df[coluna_chave].astype(str))}
+    return construtor
+
+
+def _colunas_do_snapshot(nome_aba, planilha_id):
+    """Colunas da planilha na ordem do snapshot (sem as criadas pelo esquema)"""
+    return [c for c in _obter_snapshot(nome_aba, planilha_id).columns if c not in COLUNAS_DERIVADAS]
+
+
+def _ler_linhas_da_planilha(planilha, nome_aba, numeros):
+    """
+    Lê numa única chamada batchGet o cabeçalho e as linhas pedidas, direto da planilha.
+    Retorna (cabecalho, {numero_linha: {coluna: valor}}).
+    """
+    with _chamada_google('sheets'):
+        resposta = planilha.values_batch_get([f"'{nome_aba}'!1:1"] + [f"'{nome_aba}'!{n}:{n}" for n in numeros])
+    intervalos = resposta.get('valueRanges', [])
+
+    def valores(i):
+        linhas = intervalos[i].get('values', []) if i < len(intervalos) else []
+        return [str(v).strip() for v in (linhas[0] if linhas else [])]
+
+    cabecalho = valores(0)
+    return cabecalho, {n: dict(zip(cabecalho, valores(i + 1))) for i, n in enumerate(numeros)}
+
+
+def _planilha_confere(cabecalho, colunas, lidas, esperados):
+    """
+    Diz se a planilha ainda está como o snapshot: colunas no mesmo lugar e cada
+    linha-alvo com os valores esperados (nada apagado/ordenado desde a carga).
+    """
+    if not cabecalho or cabecalho != colunas[:len(cabecalho)]:
+        return False
+    return all(
+        lidas.get(numero, {}).get(coluna, "") == str(valor).strip()
+        for numero, esperado in esperados.items()
+        for coluna, valor in esperado.items()
+    )
+
+
+def _celulas(valores):
+    """Linha no formato RowData da API (texto cru, como append_row faz por padrão)"""
+    return {'values': [{'userEnteredValue': {'stringValue': str(v)}} for v in valores]}
+
+
+def upsert_linhas(secrets, nome_aba, coluna_chave, registros, error_log=None, chaves=None):
+    """
+    Atualiza as linhas cuja coluna_chave já existe e insere as demais, numa ÚNICA
+    chamada spreadsheets.batchUpdate. registros: dicts {coluna: valor} ou listas
+    na ordem do cabeçalho. chaves (opcional): chave a procurar para cada registro
+    (ex.: o ID antigo quando ele está sendo renomeado).
+    Retorna {'atualizadas': n, 'inseridas': n} ou None em caso de erro.
+    """
     try:
-        creds = _get_drive_credentials(secrets, error_log)
-        if not creds:
+        planilha_id = secrets["planilha"]["id"]
+        aba = _get_worksheet(secrets, nome_aba, error_log)
+        planilha = _get_planilha(secrets, error_log)
+        if aba is None or planilha is None:
             return None
 
-        drive_service = build('drive', 'v3', credentials=creds)
-        id_pasta_fotos = secrets["google_drive"]["id_pasta_fotos"]
+        # O nº de cada linha vem do snapshot, que pode estar velho (linha apagada ou aba
+        # ordenada à mão): confere na planilha antes de sobrescrever; se mudou, recarrega
+        for tentativa in range(2):
+            cabecalho = _colunas_do_snapshot(nome_aba, planilha_id)
+            indice = _obter_derivado(nome_aba, planilha_id, f"indice_{coluna_chave}",
+                                     _montar_indice_chave(coluna_chave))
+
+            linhas = []
+            for registro in registros:
+                if isinstance(registro, dict):
+                    linhas.append([str(registro.get(coluna, "")) for coluna in cabecalho])
+                else:
+                    linhas.append([str(v) for v in (list(registro) + [""] * len(cabecalho))[:len(cabecalho)]])
+            posicao_chave = cabecalho.index(coluna_chave)
+            procuradas = chaves or [linha[posicao_chave] for linha in linhas]
+
+            atualizacoes, insercoes, esperados = [], [], {}
+            for chave, linha in zip(procuradas, linhas):
+                numero_linha = indice.get(str(chave).strip())
+                if numero_linha is not None:
+                    atualizacoes.append((numero_linha, linha))
+                    esperados[numero_linha] = {coluna_chave: chave}
+                else:
+                    insercoes.append(linha)
+
+            cabecalho_planilha, lidas = _ler_linhas_da_planilha(planilha, nome_aba, list(esperados))
+            if _planilha_confere(cabecalho_planilha, cabecalho, lidas, esperados):
+                break
+            _revalidar_snapshot((planilha_id, nome_aba), completa=True)
+        else:
+            raise RuntimeError(f"Aba {nome_aba} mudou na planilha durante o upsert: nada foi gravado")
+
+        requisicoes = [
+            {'updateCells': {
+                'rows': [_celulas(linha)],
+                'start': {'sheetId': aba.id, 'rowIndex': numero_linha - 1, 'columnIndex': 0},
+                'fields': 'userEnteredValue'
+            }}
+            for numero_linha, linha in atualizacoes
+        ]
+        if insercoes:
+            requisicoes.append({'appendCells': {
+                'sheetId': aba.id,
+                'rows': [_celulas(linha) for linha in insercoes],
+                'fields': 'userEnteredValue'
+            }})
+        if requisicoes:
+            try:
+                with _chamada_google('sheets'):
+                    planilha.batch_update({'requests': requisicoes})
+            except gspread.exceptions.APIError:
+                _descartar_handles(planilha_id)
+                raise
+
+        # Reflete no snapshot em memória sem rebaixar a aba
+        for numero_linha, linha in atualizacoes:
+            _alterar_linha_no_snapshot(nome_aba, planilha_id, numero_linha, dict(zip(cabecalho, linha)))
+        if insercoes:
+            _anexar_ao_snapshot(nome_aba, planilha_id, [dict(zip(cabecalho, linha)) for linha in insercoes])
+        with _SNAPSHOTS_LOCK:
+            for chave_consulta in [c for c in _CONSULTAS if c[:2] == (planilha_id, nome_aba)]:
+                del _CONSULTAS[chave_consulta]
+
+        return {'atualizadas': len(atualizacoes), 'inseridas': len(insercoes)}
+    except Exception as e:
+        if error_log is not None:
+            error_log.append({
+                'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                'erro': str(e),
+                'funcao': 'upsert_linhas',
+                'traceback': traceback.format_exc(),
+                'tipo': type(e).__name__
+            })
+        print(f"Erro no upsert em {nome_aba}: {e}")
+        return None
+
+
+# =============================================================================
+# SAÍDA DURÁVEL DAS GRAVAÇÕES (SQLITE)
+# =============================================================================
+
+# Toda linha a gravar no Sheets passa antes por aqui, com uma chave de
+# idempotência: a mesma chave nunca vira duas linhas (toque duplo, reenvio) e
+# o que falhar (queda, 429, restart) é reenviado com espera crescente.
+ARQUIVO_SAIDA = os.path.join(PASTA_CACHE_LOCAL, "saida_planilhas.sqlite")
+PRAZO_RESERVA_SAIDA = 300  # Segundos em que uma linha já entregue à fila não é reenviada
+ESPERA_BASE_SAIDA = 15  # Segundos; dobra a cada falha
+ESPERA_MAXIMA_SAIDA = 900
+INTERVALO_REENVIO = 30
+GUARDAR_GRAVADAS_POR = 7 * 24 * 3600  # Chaves gravadas seguem valendo para dedupe por 7 dias
+CAUDA_CONFERENCIA = 2000  # Últimas linhas da aba conferidas antes de um reenvio
+
+_SAIDA_LOCK = threading.Lock()
+_SECRETS_SAIDA = {}  # planilha_id -> secrets (credenciais só em memória, nunca no disco)
+_REENVIADOR = {'thread': None}
+
+
+def _conectar_saida():
+    """Abre o SQLite da saída durável (WAL)"""
+    os.makedirs(PASTA_CACHE_LOCAL, exist_ok=True)
+    con = sqlite3.connect(ARQUIVO_SAIDA, timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS saida ("
+        " chave TEXT PRIMARY KEY, planilha_id TEXT, aba TEXT, linha TEXT, situacao TEXT,"
+        " tentativas INTEGER, proxima_tentativa REAL, criada_em REAL, erro TEXT)"
+    )
+    return con
+
+
+def _garantir_reenviador():
+    """Sobe a thread de reenvio (uma por processo) se ainda não estiver rodando"""
+    with _SAIDA_LOCK:
+        if _REENVIADOR['thread'] is None or not _REENVIADOR['thread'].is_alive():
+            _REENVIADOR['thread'] = threading.Thread(target=_reenviador_da_saida, daemon=True)
+            _REENVIADOR['thread'].start()
+
+
+def iniciar_saida(secrets):
+    """Registra as credenciais e retoma o reenvio do que ficou pendente (ex.: após restart)"""
+    _SECRETS_SAIDA[secrets["planilha"]["id"]] = secrets
+    _garantir_reenviador()
+
+
+def _registrar_na_saida(chave, secrets, nome_aba, linha, reservar=True):
+    """
+    Grava a linha como pendente. Retorna (nova, situacao): nova=False se a
+    chave já existia (situacao = a registrada antes). Sem disco, segue sem durabilidade.
+    """
+    iniciar_saida(secrets)
+    agora = time.time()
+    try:
+        with _SAIDA_LOCK:
+            con = _conectar_saida()
+            try:
+                cursor = con.execute(
+                    "INSERT OR IGNORE INTO saida VALUES (?, ?, ?, ?, 'pendente', 0, ?, ?, NULL)",
+                    (chave, secrets["planilha"]["id"], nome_aba, json.dumps(linha),
+                     agora + PRAZO_RESERVA_SAIDA if reservar else agora, agora)
+                )
+                con.commit()
+                if cursor.rowcount == 0:
+                    anterior = con.execute("SELECT situacao FROM saida WHERE chave = ?", (chave,)).fetchone()
+                    return False, anterior[0] if anterior else None
+                return True, "pendente"
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Saída durável indisponível, gravando sem ela: {e}")
+        return True, "pendente"
+
+
+def _erro_definitivo(erro):
+    """4xx que não é cota nem tempo esgotado: reenviar a mesma linha nunca vai dar certo"""
+    status = _status_http(erro)
+    return status is not None and 400 <= status < 500 and status not in (408, 429)
+
+
+def _marcar_saida(chaves, gravada, erro=None, definitiva=False):
+    """
+    Marca linhas como gravadas ou agenda nova tentativa (espera dobra a cada falha).
+    definitiva=True: erro que não se resolve sozinho, a linha sai do reenvio como "falhou".
+    """
+    try:
+        with _SAIDA_LOCK:
+            con = _conectar_saida()
+            try:
+                agora = time.time()
+                for chave in chaves:
+                    if gravada:
+                        con.execute("UPDATE saida SET situacao = 'gravada', erro = NULL WHERE chave = ?", (chave,))
+                    elif definitiva:
+                        con.execute("UPDATE saida SET situacao = 'falhou', tentativas = tentativas + 1, erro = ?"
+                                    " WHERE chave = ?", (erro, chave))
+                    else:
+                        con.execute(
+                            "UPDATE saida SET tentativas = tentativas + 1, erro = ?,"
+                            " proxima_tentativa = ? + MIN(?, ? * (1 << MIN(tentativas, 10))) WHERE chave = ?",
+                            (erro, agora, ESPERA_MAXIMA_SAIDA, ESPERA_BASE_SAIDA, chave)
+                        )
+                con.commit()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao atualizar saída durável: {e}")
+
+
+def _gravar_na_planilha(secrets, nome_aba, linhas, error_log=None):
+    """Um append_rows na aba (Logs também agenda o preenchimento de endereços)"""
+    if nome_aba == "Logs":
+        _anexar_linhas_logs(linhas, secrets, error_log)
+        return
+
+    aba = _get_worksheet(secrets, nome_aba, error_log)
+    if aba is None:
+        raise RuntimeError(f"Aba {nome_aba} indisponível")
+    try:
+        with _chamada_google('sheets'):
+            aba.append_rows(linhas)
+    except gspread.exceptions.APIError:
+        _descartar_handles(secrets["planilha"]["id"])
+        raise
+    invalidar_snapshots(secrets["planilha"]["id"], nome_aba, linhas)
 
-        file_metadata = {'name': nome_arquivo, 'parents': [id_pasta_fotos]}
-        foto_bytes = io.BytesIO(foto_arquivo.getvalue())
-        media = MediaIoBaseUpload(foto_bytes, mimetype='image/jpeg', resumable=False)
 
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
+def _assinatura_linha(nome_aba, valores):
+    """Colunas que identificam uma linha gravada (fora as que o app ainda preenche depois)"""
+    valores = [str(v).strip() for v in valores]
+    if nome_aba == "Logs":
+        # Endereço e o link da foto são trocados depois da gravação
+        return (valores[0], valores[1], valores[2].split(" | Foto:")[0], valores[3])
+    return tuple(valores[:3])
 
-        drive_service.permissions().create(
-            fileId=file.get('id'),
-            body={'type': 'anyone', 'role': 'reader'}
-        ).execute()
 
-        return file.get('webViewLink')
+def _ja_na_planilha(planilha_id, nome_aba, linhas):
+    """
+    Índices das linhas que já estão na aba, conferidos na cauda atualizada antes
+    de reenviar: um append que estourou o tempo pode ter sido aplicado pelo Google.
+    """
+    chave = (planilha_id, nome_aba)
+    _revalidar_snapshot(chave)
+    df = _df_do_snapshot(chave)
+    if df is None or df.empty:
+        return set()
+    largura = min(len(df.columns), max(len(linha) for linha in linhas))
+    cauda = df.iloc[-CAUDA_CONFERENCIA:, :largura].astype(str).values.tolist()
+    gravadas = {_assinatura_linha(nome_aba, valores) for valores in cauda}
+    return {i for i, linha in enumerate(linhas) if _assinatura_linha(nome_aba, linha[:largura]) in gravadas}
+
+
+def gravar_linha_duravel(secrets, nome_aba, linha, chave, error_log=None):
+    """
+    Grava UMA linha agora, passando pela saída durável.
+    Retorna "gravada", "duplicada" (chave já usada), "pendente" (falhou; será
+    reenviada) ou "falhou" (erro definitivo, ex.: aba inexistente; não é reenviada).
+    """
+    nova, _ = _registrar_na_saida(chave, secrets, nome_aba, linha)
+    if not nova:
+        return "duplicada"
+    try:
+        _gravar_na_planilha(secrets, nome_aba, [linha], error_log)
+        _marcar_saida([chave], gravada=True)
+        return "gravada"
     except Exception as e:
+        _marcar_saida([chave], gravada=False, erro=f"{type(e).__name__}: {e}", definitiva=_erro_definitivo(e))
         if error_log is not None:
             error_log.append({
                 'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
                 'erro': str(e),
-                'funcao': 'salvar_foto_drive',
+                'funcao': 'gravar_linha_duravel',
                 'traceback': traceback.format_exc(),
                 'tipo': type(e).__name__
             })
-        print(f"Erro no Drive (Foto): {e}")
+        print(f"Gravação em {nome_aba} adiada: {e}")
+        return "falhou" if _erro_definitivo(e) else "pendente"
+
+
+def _reenviador_da_saida():
+    """Thread que reenvia, em lote por aba e na ordem de chegada, as linhas pendentes vencidas"""
+    while True:
+        time.sleep(INTERVALO_REENVIO)
+        if _disjuntor_aberto('sheets'):
+            continue
+        try:
+            agora = time.time()
+            with _SAIDA_LOCK:
+                con = _conectar_saida()
+                try:
+                    pendentes = con.execute(
+                        "SELECT chave, planilha_id, aba, linha FROM saida"
+                        " WHERE situacao = 'pendente' AND proxima_tentativa <= ? ORDER BY rowid",
+                        (agora,)
+                    ).fetchall()
+                    # Reserva o que vai ser enviado agora (ninguém mais pega no meio do envio)
+                    con.executemany(
+                        "UPDATE saida SET proxima_tentativa = ? WHERE chave = ?",
+                        [(agora + PRAZO_RESERVA_SAIDA, p[0]) for p in pendentes]
+                    )
+                    con.execute("DELETE FROM saida WHERE situacao = 'gravada' AND criada_em < ?",
+                                (agora - GUARDAR_GRAVADAS_POR,))
+                    con.commit()
+                finally:
+                    con.close()
+
+            grupos = {}
+            for chave, planilha_id, nome_aba, linha in pendentes:
+                grupos.setdefault((planilha_id, nome_aba), []).append((chave, json.loads(linha)))
+
+            for (planilha_id, nome_aba), itens in grupos.items():
+                chaves = [chave for chave, _ in itens]
+                secrets = _SECRETS_SAIDA.get(planilha_id)
+                if secrets is None:
+                    # Sem credenciais ainda (processo recém-iniciado): tenta na próxima volta
+                    _marcar_saida(chaves, gravada=False, erro="Aguardando credenciais")
+                    continue
+                try:
+                    # O que o Google já tinha aplicado (resposta perdida) só é marcado como gravado
+                    ja_gravadas = _ja_na_planilha(planilha_id, nome_aba, [linha for _, linha in itens])
+                    faltam = [linha for i, (_, linha) in enumerate(itens) if i not in ja_gravadas]
+                    if faltam:
+                        _gravar_na_planilha(secrets, nome_aba, faltam)
+                    _marcar_saida(chaves, gravada=True)
+                    for chave in chaves:
+                        _marcar_acao(chave, situacao="gravada", erro=None, gravada_em=time.time())
+                except Exception as e:
+                    definitiva = _erro_definitivo(e)
+                    _marcar_saida(chaves, gravada=False, erro=f"{type(e).__name__}: {e}", definitiva=definitiva)
+                    if definitiva:
+                        for chave in chaves:
+                            _marcar_acao(chave, situacao="falhou")
+                    print(f"Reenvio de {len(itens)} linhas em {nome_aba} falhou: {e}")
+        except Exception as e:
+            print(f"Erro inesperado no reenvio da saída: {e}")
+
+
+def status_saida():
+    """Resumo da saída durável (para o painel de suporte)"""
+    if not os.path.exists(ARQUIVO_SAIDA):
+        return {'pendentes': 0, 'gravadas': 0, 'falhas': 0, 'mais_antiga_s': None, 'ultimo_erro': None}
+    try:
+        with _SAIDA_LOCK:
+            con = _conectar_saida()
+            try:
+                pendentes, mais_antiga = con.execute(
+                    "SELECT COUNT(*), MIN(criada_em) FROM saida WHERE situacao = 'pendente'"
+                ).fetchone()
+                gravadas = con.execute("SELECT COUNT(*) FROM saida WHERE situacao = 'gravada'").fetchone()[0]
+                falhas = con.execute("SELECT COUNT(*) FROM saida WHERE situacao = 'falhou'").fetchone()[0]
+                erro = con.execute(
+                    "SELECT erro FROM saida WHERE situacao IN ('pendente', 'falhou') AND erro IS NOT NULL"
+                    " ORDER BY rowid DESC LIMIT 1"
+                ).fetchone()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao ler saída durável: {e}")
+        return {'pendentes': None, 'gravadas': None, 'falhas': None, 'mais_antiga_s': None, 'ultimo_erro': str(e)}
+    return {
+        'pendentes': pendentes,
+        'gravadas': gravadas,
+        'falhas': falhas,
+        'mais_antiga_s': int(time.time() - mais_antiga) if mais_antiga else None,
+        'ultimo_erro': erro[0] if erro else None
+    }
+
+
+# =============================================================================
+# FILA DE GRAVAÇÃO EM SEGUNDO PLANO (LOGS)
+# =============================================================================
+
+# Os botões só enfileiram a ação e devolvem a tela na hora; UMA thread do
+# processo grava na planilha. Fila cheia = o Google não está dando conta.
+# Ações de todas as sessões que chegam dentro da mesma janela viram UM único
+# append_rows, na ordem em que entraram na fila. Cada ação já está na saída
+# durável antes de entrar na fila: o que a fila não conseguir gravar é reenviado.
+LIMITE_FILA_ACOES = 500
+JANELA_LOTE = 1.5  # Segundos esperando mais ações depois da primeira
+MAX_LINHAS_LOTE = 50
+TENTATIVAS_ACAO = 3
+ESPERA_ENTRE_TENTATIVAS = 5  # Segundos (multiplicado pelo nº da tentativa)
+HISTORICO_STATUS_ACOES = 2000  # Quantos status de ações ficam em memória
+
+_FILA_ACOES = queue.Queue(maxsize=LIMITE_FILA_ACOES)
+_STATUS_ACOES = {}  # id_acao -> status (mais antigas são descartadas)
+_STATUS_ACOES_LOCK = threading.Lock()
+_GRAVADOR = {'thread': None}
+_GRAVADOR_LOCK = threading.Lock()
+_METRICAS_LOTES = {'chamadas': 0, 'linhas': 0, 'ultimo_lote': 0, 'maior_lote': 0}
+
+
+def _marcar_acao(id_acao, **campos):
+    """Atualiza o status de uma ação enfileirada"""
+    with _STATUS_ACOES_LOCK:
+        if id_acao in _STATUS_ACOES:
+            _STATUS_ACOES[id_acao].update(campos)
+
+
+def _coletar_lote():
+    """Espera a primeira ação e junta as que chegarem na janela (até MAX_LINHAS_LOTE)"""
+    lote = [_FILA_ACOES.get()]
+    prazo = time.monotonic() + JANELA_LOTE
+    while len(lote) < MAX_LINHAS_LOTE:
+        restante = prazo - time.monotonic()
+        if restante <= 0:
+            break
+        try:
+            lote.append(_FILA_ACOES.get(timeout=restante))
+        except queue.Empty:
+            break
+    return lote
+
+
+def _gravar_lote(itens):
+    """Grava um lote (mesma planilha) com um append_rows, com novas tentativas"""
+    secrets = itens[0][1]
+    linhas = [linha for _, _, linha, _ in itens]
+    chaves = [id_acao for id_acao, _, _, _ in itens]
+    for id_acao in chaves:
+        _marcar_acao(id_acao, situacao="gravando")
+
+    for tentativa in range(1, TENTATIVAS_ACAO + 1):
+        for id_acao in chaves:
+            _marcar_acao(id_acao, tentativas=tentativa)
+        try:
+            faltam = linhas
+            if tentativa > 1:
+                # A tentativa anterior pode ter sido aplicada mesmo sem resposta
+                ja_gravadas = _ja_na_planilha(secrets["planilha"]["id"], "Logs", linhas)
+                faltam = [linha for i, linha in enumerate(linhas) if i not in ja_gravadas]
+            if faltam:
+                _anexar_linhas_logs(faltam, secrets, itens[0][3])
+            _marcar_saida(chaves, gravada=True)
+            agora = time.time()
+            for id_acao in chaves:
+                _marcar_acao(id_acao, situacao="gravada", erro=None, gravada_em=agora)
+            with _STATUS_ACOES_LOCK:
+                _METRICAS_LOTES['chamadas'] += 1
+                _METRICAS_LOTES['linhas'] += len(linhas)
+                _METRICAS_LOTES['ultimo_lote'] = len(linhas)
+                _METRICAS_LOTES['maior_lote'] = max(_METRICAS_LOTES['maior_lote'], len(linhas))
+            return
+        except Exception as e:
+            for id_acao in chaves:
+                _marcar_acao(id_acao, erro=f"{type(e).__name__}: {e}")
+            # Com o disjuntor aberto, insistir só gastaria cota: vai direto para o reenvio
+            definitiva = _erro_definitivo(e)
+            if tentativa < TENTATIVAS_ACAO and not definitiva and not _disjuntor_aberto('sheets'):
+                time.sleep(ESPERA_ENTRE_TENTATIVAS * tentativa)
+                continue
+
+            # Nada se perde: a saída durável reenvia depois, com espera crescente
+            # (erro definitivo, ex.: aba apagada, fica como "falhou" no painel)
+            _marcar_saida(chaves, gravada=False, erro=f"{type(e).__name__}: {e}", definitiva=definitiva)
+
+            # Cada sessão afetada vê o erro no próprio log
+            logs_avisados = []
+            for id_acao, _, _, error_log in itens:
+                _marcar_acao(id_acao, situacao="falhou" if definitiva else "aguardando_reenvio")
+                if error_log is not None and not any(error_log is l for l in logs_avisados):
+                    logs_avisados.append(error_log)
+                    error_log.append({
+                        'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                        'erro': str(e),
+                        'funcao': '_gravar_lote',
+                        'traceback': traceback.format_exc(),
+                        'tipo': type(e).__name__
+                    })
+            print(f"Lote de {len(linhas)} ações ficou para reenvio: {e}")
+
+
+def _gravador_de_acoes():
+    """Thread que esvazia a fila gravando as ações em lotes na aba Logs"""
+    while True:
+        lote = _coletar_lote()
+        try:
+            # Lotes só juntam ações seguidas da mesma planilha (mantém a ordem de chegada)
+            inicio = 0
+            for fim in range(1, len(lote) + 1):
+                if fim == len(lote) or lote[fim][1]["planilha"]["id"] != lote[inicio][1]["planilha"]["id"]:
+                    _gravar_lote(lote[inicio:fim])
+                    inicio = fim
+        except Exception as e:
+            print(f"Erro inesperado no gravador de ações: {e}")
+        finally:
+            for _ in lote:
+                _FILA_ACOES.task_done()
+
+
+def _garantir_gravador():
+    """Sobe a thread gravadora (uma por processo) se ainda não estiver rodando"""
+    with _GRAVADOR_LOCK:
+        if _GRAVADOR['thread'] is None or not _GRAVADOR['thread'].is_alive():
+            _GRAVADOR['thread'] = threading.Thread(target=_gravador_de_acoes, daemon=True)
+            _GRAVADOR['thread'].start()
+
+
+def enfileirar_acao(id_usuario, tipo_acao, localizacao, feedback, secrets, error_log=None, chave=None):
+    """
+    Aceita a ação para gravação em segundo plano e retorna na hora.
+    chave: idempotência, criada UMA vez por intenção na tela (a mesma chave
+    nunca gera duas linhas); sem ela a ação é sempre nova.
+    Retorna (id_acao, situacao): "na_fila", "duplicada" ou "adiada" (fila cheia;
+    guardada na saída durável e gravada pelo reenvio).
+    """
+    agora_br = get_agora_br()  # Horário do clique, não o da gravação
+    id_acao = chave or uuid.uuid4().hex
+    linha = _montar_linha_acao(id_usuario, tipo_acao, localizacao, feedback, agora_br, error_log)
+
+    nova, _ = _registrar_na_saida(id_acao, secrets, "Logs", linha)
+    if not nova:
+        return id_acao, "duplicada"
+
+    with _STATUS_ACOES_LOCK:
+        _STATUS_ACOES[id_acao] = {
+            'id_acao': id_acao,
+            'id_usuario': str(id_usuario),
+            'tipo_acao': str(tipo_acao),
+            'situacao': "na_fila",
+            'tentativas': 0,
+            'erro': None,
+            'criada_em': time.time(),
+            'gravada_em': None
+        }
+        while len(_STATUS_ACOES) > HISTORICO_STATUS_ACOES:
+            del _STATUS_ACOES[next(iter(_STATUS_ACOES))]
+
+    if _disjuntor_aberto('sheets'):
+        # Google em pausa: a ação fica só na saída durável até o reenvio
+        _marcar_acao(id_acao, situacao="aguardando_reenvio")
+        _marcar_saida([id_acao], gravada=False, erro="Google Sheets em pausa (disjuntor aberto)")
+        return id_acao, "adiada"
+
+    try:
+        _FILA_ACOES.put_nowait((id_acao, secrets, linha, error_log))
+    except queue.Full:
+        # Já está na saída durável: libera a reserva para o reenvio pegar logo
+        _marcar_acao(id_acao, situacao="aguardando_reenvio")
+        _marcar_saida([id_acao], gravada=False, erro="Fila cheia")
+        return id_acao, "adiada"
+
+    _garantir_gravador()
+    return id_acao, "na_fila"
+
+
+def status_fila_acoes(id_usuario=None):
+    """Resumo da fila (para a tela do voluntário e o painel de suporte)"""
+    with _STATUS_ACOES_LOCK:
+        acoes = [dict(a) for a in _STATUS_ACOES.values()
+                 if id_usuario is None or a['id_usuario'] == str(id_usuario)]
+    with _STATUS_ACOES_LOCK:
+        lotes = dict(_METRICAS_LOTES)
+    lotes['linhas_por_chamada'] = round(lotes['linhas'] / lotes['chamadas'], 1) if lotes['chamadas'] else 0
+    return {
+        'na_fila': _FILA_ACOES.qsize(),
+        'limite': LIMITE_FILA_ACOES,
+        'lotes': lotes,
+        'pendentes': sum(1 for a in acoes if a['situacao'] in ("na_fila", "gravando")),
+        'falhas': [a for a in acoes if a['situacao'] in ("aguardando_reenvio", "falhou")],
+        'acoes': acoes
+    }
+
+
+# =============================================================================
+# PREENCHIMENTO DE ENDEREÇOS EM SEGUNDO PLANO (LOGS)
+# =============================================================================
+
+# Linhas gravadas com ENDERECO_PENDENTE esperam aqui. A cada passada a thread
+# resolve os endereços (cache + Nominatim) e grava todos num único batch_update.
+JANELA_ENDERECOS = 5  # Segundos juntando linhas antes de cada passada
+MAX_ENDERECOS_PASSADA = 100
+TENTATIVAS_ENDERECO = 3
+
+_FILA_ENDERECOS = queue.Queue()
+_PREENCHEDOR = {'thread': None, 'passadas': 0, 'enderecos': 0}
+_PREENCHEDOR_LOCK = threading.Lock()
+
+
+def _agendar_enderecos(secrets, linhas):
+    """Enfileira [(nº da linha na planilha, 'lat, lon'), ...] para preenchimento"""
+    for numero_linha, coords in linhas:
+        _FILA_ENDERECOS.put((secrets, numero_linha, coords, 1))
+    if linhas:
+        with _PREENCHEDOR_LOCK:
+            if _PREENCHEDOR['thread'] is None or not _PREENCHEDOR['thread'].is_alive():
+                _PREENCHEDOR['thread'] = threading.Thread(target=_preenchedor_de_enderecos, daemon=True)
+                _PREENCHEDOR['thread'].start()
+
+
+def _preenchedor_de_enderecos():
+    """Thread que resolve os endereços pendentes e grava em lote na aba Logs"""
+    while True:
+        pendentes = [_FILA_ENDERECOS.get()]
+        prazo = time.monotonic() + JANELA_ENDERECOS
+        while len(pendentes) < MAX_ENDERECOS_PASSADA:
+            restante = prazo - time.monotonic()
+            if restante <= 0:
+                break
+            try:
+                pendentes.append(_FILA_ENDERECOS.get(timeout=restante))
+            except queue.Empty:
+                break
+
+        por_planilha = {}
+        for item in pendentes:
+            por_planilha.setdefault(item[0]["planilha"]["id"], []).append(item)
+
+        letra = _letra_coluna(POSICAO_ENDERECO_LOGS)
+        adiados = 0
+        for planilha_id, itens in por_planilha.items():
+            resolvidos = []
+            for item in itens:
+                secrets, numero, coords, tentativa = item
+                try:
+                    resolvidos.append((numero, coords, _resolver_endereco(coords)))
+                except Exception as e:
+                    # Nominatim fora/limitando: a linha fica pendente e volta para a fila
+                    if tentativa < TENTATIVAS_ENDERECO:
+                        print(f"Endereço da linha {numero} adiado (tentativa {tentativa}): {e}")
+                        _FILA_ENDERECOS.put((secrets, numero, coords, tentativa + 1))
+                        adiados += 1
+                    else:
+                        resolvidos.append((numero, coords, "Endereço indisponível"))
+            if not resolvidos:
+                continue
+            itens = [item for item in itens if any(item[1] == numero for numero, _, _ in resolvidos)]
+            try:
+                aba = _get_worksheet(itens[0][0], "Logs")
+                if aba is None:
+                    raise RuntimeError("Aba Logs indisponível")
+                with _chamada_google('sheets'):
+                    aba.batch_update([
+                        {'range': f"{letra}{numero}", 'values': [[endereco]]}
+                        for numero, _, endereco in resolvidos
+                    ])
+            except Exception as e:
+                print(f"Erro ao preencher {len(itens)} endereços: {e}")
+                if isinstance(e, gspread.exceptions.APIError):
+                    _descartar_handles(planilha_id)
+                # Falha por disjuntor aberto não gasta tentativa: espera a pausa acabar
+                pausado = _disjuntor_aberto('sheets')
+                for secrets, numero, coords, tentativa in itens:
+                    if pausado or tentativa < TENTATIVAS_ENDERECO:
+                        _FILA_ENDERECOS.put((secrets, numero, coords, tentativa if pausado else tentativa + 1))
+                time.sleep(max(ESPERA_ENTRE_TENTATIVAS, _fim_da_pausa('sheets') - time.time()))
+                continue
+
+            for numero, coords, endereco in resolvidos:
+                _alterar_linha_no_snapshot("Logs", planilha_id, numero, {"Endereço": endereco},
+                                           esperado={"Localização": coords, "Endereço": ENDERECO_PENDENTE})
+            with _PREENCHEDOR_LOCK:
+                _PREENCHEDOR['passadas'] += 1
+                _PREENCHEDOR['enderecos'] += len(resolvidos)
+
+        if adiados:
+            time.sleep(ESPERA_ENTRE_TENTATIVAS)  # Dá um respiro ao Nominatim antes de tentar de novo
+
+
+def status_enderecos_pendentes():
+    """Resumo do preenchimento de endereços (para o painel de suporte)"""
+    with _PREENCHEDOR_LOCK:
+        return {
+            'pendentes': _FILA_ENDERECOS.qsize(),
+            'passadas': _PREENCHEDOR['passadas'],
+            'enderecos': _PREENCHEDOR['enderecos']
+        }
+
+
+# =============================================================================
+# FOTOS DE PRESENÇA EM SEGUNDO PLANO
+# =============================================================================
+
+# Com FOTOS_EM_SEGUNDO_PLANO o check-in/out grava a linha na hora com
+# FOTO_PENDENTE no lugar do link. A foto (já reduzida) fica no SQLite dos uploads
+# e uma thread sobe para o Drive e troca a referência pelo link na mesma célula,
+# inclusive depois de um restart do processo.
+FOTOS_EM_SEGUNDO_PLANO = True
+FOTO_PENDENTE = "Foto pendente"
+POSICAO_ACAO_LOGS = 2  # Índice da coluna Tipo_Acao na linha montada por _montar_linha_acao
+INTERVALO_FOTOS = 10  # Segundos entre passadas (uma foto nova acorda a thread na hora)
+TENTATIVAS_FOTO = 8  # Depois disso a foto fica como "falhou" no painel de suporte
+FOTOS_POR_PASSADA = 50  # Cada passada lê só os metadados destas; os bytes vêm um de cada vez
+
+_ENVIADOR_FOTOS = {'thread': None, 'acordar': threading.Event(), 'enviadas': 0}
+_ENVIADOR_FOTOS_LOCK = threading.Lock()
+
+
+def _garantir_enviador_fotos():
+    """Sobe a thread de envio de fotos (uma por processo) e a acorda"""
+    with _ENVIADOR_FOTOS_LOCK:
+        if _ENVIADOR_FOTOS['thread'] is None or not _ENVIADOR_FOTOS['thread'].is_alive():
+            _ENVIADOR_FOTOS['thread'] = threading.Thread(target=_enviador_de_fotos, daemon=True)
+            _ENVIADOR_FOTOS['thread'].start()
+    _ENVIADOR_FOTOS['acordar'].set()
+
+
+def iniciar_envio_fotos(secrets):
+    """Retoma as fotos que ficaram pendentes (ex.: após restart)"""
+    iniciar_saida(secrets)
+    _garantir_enviador_fotos()
+
+
+def agendar_foto(foto, nome_arquivo, tipo_acao, secrets, id_usuario):
+    """
+    Guarda a foto para envio em segundo plano e retorna o texto da ação com a
+    referência pendente (ex.: "Check-in | Foto: Foto pendente #a1b2c3d4e5f6").
+    Retorna None se não deu para guardar (quem chamou sobe a foto na hora).
+    """
+    iniciar_saida(secrets)  # A thread usa as credenciais registradas na saída durável
+    dados = foto.getbuffer()
+    token = hashlib.sha1(dados).hexdigest()[:12]
+    texto = f"{tipo_acao} | Foto: {FOTO_PENDENTE} #{token}"
+    try:
+        with _UPLOADS_LOCK:
+            con = _conectar_uploads()
+            try:
+                # A mesma foto tocada duas vezes é uma só (o check-in também deduplica)
+                con.execute(
+                    "INSERT OR IGNORE INTO fotos VALUES (?, ?, ?, ?, ?, ?, NULL, NULL, 'enviando', 0, 0, ?, NULL)",
+                    (token, secrets["planilha"]["id"], str(id_usuario), nome_arquivo,
+                     sqlite3.Binary(dados), texto, time.time())
+                )
+                con.commit()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Foto não pôde ficar para depois, enviando na hora: {e}")
         return None
+    _garantir_enviador_fotos()
+    return texto
 
 
-def salvar_documento_drive(doc_arquivo, nome_arquivo, secrets, error_log=None):
-    """Salva documento PDF no Google Drive"""
+def _localizar_fotos(linhas):
+    """Anota o nº da linha na aba Logs de cada ação com foto pendente [(nº, texto da ação), ...]"""
+    tokens = [(numero, re.search(rf"{FOTO_PENDENTE} #(\w+)", texto)) for numero, texto in linhas]
+    tokens = [(numero, achado.group(1)) for numero, achado in tokens if achado]
+    if not tokens:
+        return
     try:
-        creds = _get_drive_credentials(secrets, error_log)
-        if not creds:
-            return None
+        with _UPLOADS_LOCK:
+            con = _conectar_uploads()
+            try:
+                con.executemany("UPDATE fotos SET numero_linha = ? WHERE token = ?", tokens)
+                con.commit()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao anotar linhas das fotos: {e}")
+    _garantir_enviador_fotos()
+
+
+def _atualizar_fotos(comando, parametros):
+    """Executa um UPDATE/DELETE na tabela de fotos (vários conjuntos de parâmetros)"""
+    try:
+        with _UPLOADS_LOCK:
+            con = _conectar_uploads()
+            try:
+                con.executemany(comando, parametros)
+                con.commit()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao atualizar fotos pendentes: {e}")
+
+
+def _falha_foto(token, tentativas, erro):
+    """Agenda nova tentativa (espera dobra a cada falha) ou desiste depois de TENTATIVAS_FOTO"""
+    _atualizar_fotos(
+        "UPDATE fotos SET tentativas = ?, proxima_tentativa = ?, erro = ?,"
+        " situacao = CASE WHEN ? >= ? THEN 'falhou' ELSE situacao END WHERE token = ?",
+        [(tentativas + 1, time.time() + min(ESPERA_MAXIMA_SAIDA, ESPERA_BASE_SAIDA * 2 ** tentativas),
+          f"{type(erro).__name__}: {erro}"[:300], tentativas + 1, TENTATIVAS_FOTO, token)]
+    )
+
+
+def _situacao_da_linha_da_foto(planilha_id, token):
+    """Situação na saída durável da linha de Logs que leva a foto (None se não estiver lá)"""
+    try:
+        with _SAIDA_LOCK:
+            con = _conectar_saida()
+            try:
+                linha = con.execute(
+                    "SELECT situacao FROM saida WHERE planilha_id = ? AND aba = 'Logs' AND instr(linha, ?) > 0"
+                    " ORDER BY rowid DESC LIMIT 1",
+                    (planilha_id, f"{FOTO_PENDENTE} #{token}")
+                ).fetchone()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao consultar saída durável: {e}")
+        return None
+    return linha[0] if linha else None
+
+
+def _ler_foto(token):
+    """Bytes de uma foto pendente (lidos só na hora do envio)"""
+    with _UPLOADS_LOCK:
+        con = _conectar_uploads()
+        try:
+            linha = con.execute("SELECT foto FROM fotos WHERE token = ?", (token,)).fetchone()
+        finally:
+            con.close()
+    return linha[0] if linha else None
+
+
+def _passada_fotos():
+    """Sobe as fotos que faltam e grava os links prontos, um batch_update por planilha"""
+    with _UPLOADS_LOCK:
+        con = _conectar_uploads()
+        try:
+            pendentes = con.execute(
+                "SELECT token, planilha_id, nome_arquivo, texto, link, numero_linha, situacao, tentativas"
+                " FROM fotos WHERE situacao IN ('enviando', 'vinculando') AND proxima_tentativa <= ?"
+                " ORDER BY proxima_tentativa, rowid LIMIT ?",
+                (time.time(), FOTOS_POR_PASSADA)
+            ).fetchall()
+            con.execute("DELETE FROM fotos WHERE situacao = 'concluida' AND criada_em < ?",
+                        (time.time() - GUARDAR_GRAVADAS_POR,))
+            con.commit()
+        finally:
+            con.close()
+
+    prontas = {}
+    for token, planilha_id, nome_arquivo, texto, link, numero, situacao, tentativas in pendentes:
+        secrets = _SECRETS_SAIDA.get(planilha_id)
+        if secrets is None:
+            continue  # Credenciais chegam com a primeira sessão (iniciar_envio_fotos)
+        if situacao == "enviando":
+            if _disjuntor_aberto('drive'):
+                continue  # Em pausa não gasta tentativa
+            try:
+                foto = _ler_foto(token)
+                if foto is None:
+                    continue
+                link = _subir_para_drive(io.BytesIO(foto), nome_arquivo, secrets["google_drive"]["id_pasta_fotos"],
+                                         'image/jpeg', secrets)
+                del foto
+            except Exception as e:
+                print(f"Envio da foto {nome_arquivo} falhou: {e}")
+                _falha_foto(token, tentativas, e)
+                continue
+            # A foto já está no Drive: o SQLite não precisa mais dos bytes
+            _atualizar_fotos("UPDATE fotos SET link = ?, foto = NULL, situacao = 'vinculando', tentativas = 0,"
+                             " erro = NULL WHERE token = ?", [(link, token)])
+            with _ENVIADOR_FOTOS_LOCK:
+                _ENVIADOR_FOTOS['enviadas'] += 1
+            tentativas = 0
+        if numero is None:
+            # Sem o nº vindo da gravação (ex.: resposta sem updatedRange): procura no snapshot
+            try:
+                indice = _obter_derivado("Logs", planilha_id, "indice_Tipo_Acao", _montar_indice_chave("Tipo_Acao"))
+                numero = indice.get(texto)
+            except Exception as e:
+                print(f"Erro ao procurar a linha da foto {nome_arquivo}: {e}")
+            if numero is None:
+                situacao_linha = _situacao_da_linha_da_foto(planilha_id, token)
+                if situacao_linha == "pendente":
+                    # A linha ainda está na fila/saída durável: vai para o fim da vez sem gastar tentativa
+                    _atualizar_fotos("UPDATE fotos SET proxima_tentativa = ? WHERE token = ?",
+                                     [(time.time() + INTERVALO_FOTOS, token)])
+                elif situacao_linha == "falhou":
+                    # A linha nunca vai chegar à planilha: não há onde pôr o link
+                    _atualizar_fotos("UPDATE fotos SET situacao = 'falhou', erro = ? WHERE token = ?",
+                                     [("Linha de Logs não gravada (saída durável: falhou)", token)])
+                else:
+                    _falha_foto(token, tentativas, RuntimeError("Linha da foto não encontrada na aba Logs"))
+                continue
+        prontas.setdefault(planilha_id, []).append((token, numero, texto, texto.replace(
+            f"{FOTO_PENDENTE} #{token}", link), tentativas))
+
+    letra = _letra_coluna(POSICAO_ACAO_LOGS)
+    for planilha_id, itens in prontas.items():
+        if _disjuntor_aberto('sheets'):
+            continue
+        try:
+            aba = _get_worksheet(_SECRETS_SAIDA[planilha_id], "Logs")
+            if aba is None:
+                raise RuntimeError("Aba Logs indisponível")
+            with _chamada_google('sheets'):
+                aba.batch_update([{'range': f"{letra}{numero}", 'values': [[novo]]}
+                                  for _, numero, _, novo, _ in itens])
+        except Exception as e:
+            print(f"Erro ao gravar {len(itens)} links de fotos: {e}")
+            if isinstance(e, gspread.exceptions.APIError):
+                _descartar_handles(planilha_id)
+            for token, _, _, _, tentativas in itens:
+                _falha_foto(token, tentativas, e)
+            continue
+
+        for _, numero, texto, novo, _ in itens:
+            _alterar_linha_no_snapshot("Logs", planilha_id, numero, {"Tipo_Acao": novo},
+                                       esperado={"Tipo_Acao": texto})
+        _atualizar_fotos("UPDATE fotos SET situacao = 'concluida', erro = NULL WHERE token = ?",
+                         [(token,) for token, _, _, _, _ in itens])
+
+
+def _enviador_de_fotos():
+    """Thread que sobe as fotos de presença e troca a referência pendente pelo link"""
+    while True:
+        _ENVIADOR_FOTOS['acordar'].wait(INTERVALO_FOTOS)
+        _ENVIADOR_FOTOS['acordar'].clear()
+        try:
+            _passada_fotos()
+        except Exception as e:
+            print(f"Erro inesperado no envio de fotos: {e}")
+
+
+def status_fotos(id_usuario=None):
+    """Fotos ainda a caminho do Drive/da planilha (para a tela do voluntário e o painel de suporte)"""
+    vazio = {'enviando': 0, 'vinculando': 0, 'falhou': 0, 'enviadas': _ENVIADOR_FOTOS['enviadas'], 'fotos': []}
+    if not os.path.exists(ARQUIVO_UPLOADS):
+        return vazio
+    try:
+        with _UPLOADS_LOCK:
+            con = _conectar_uploads()
+            try:
+                linhas = con.execute(
+                    "SELECT id_usuario, nome_arquivo, situacao, tentativas, criada_em, erro FROM fotos"
+                    " WHERE situacao != 'concluida' AND (? IS NULL OR id_usuario = ?) ORDER BY rowid",
+                    (None if id_usuario is None else str(id_usuario),) * 2
+                ).fetchall()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao ler fotos pendentes: {e}")
+        return vazio
+
+    agora = time.time()
+    resumo = dict(vazio)
+    resumo['fotos'] = [
+        {'id_usuario': usuario, 'arquivo': nome, 'situacao': situacao, 'tentativas': tentativas,
+         'idade_s': int(agora - criada_em), 'erro': erro}
+        for usuario, nome, situacao, tentativas, criada_em, erro in linhas
+    ]
+    for foto in resumo['fotos']:
+        resumo[foto['situacao']] += 1
+    return resumo
+
+
+# =============================================================================
+# TRATAMENTO DE FOTOS (ANTES DO UPLOAD)
+# =============================================================================
 
-        drive_service = build('drive', 'v3', credentials=creds)
-        id_pasta_contratos = secrets["google_drive"]["id_pasta_contratos"]
+# A foto da câmera do celular chega com vários MB e metadados (inclusive GPS do
+# aparelho). Antes de subir ela é reduzida, regravada em JPEG e sai sem EXIF.
+FOTO_LADO_MAXIMO = 1600  # Pixels do maior lado
+FOTO_QUALIDADE = 80
+MINIATURA_LADO = 240
+MINIATURA_QUALIDADE = 70
 
-        file_metadata = {'name': nome_arquivo, 'parents': [id_pasta_contratos]}
-        doc_bytes = io.BytesIO(doc_arquivo.getvalue())
-        media = MediaIoBaseUpload(doc_bytes, mimetype='application/pdf', resumable=False)
 
-        file = drive_service.files().create(
-            body=file_metadata,
-            media_body=media,
-            fields='id, webViewLink'
-        ).execute()
+def _jpeg(imagem, qualidade):
+    """Grava a imagem em JPEG num buffer novo, sem metadados, pronto para ler do início"""
+    saida = io.BytesIO()
+    imagem.save(saida, format='JPEG', quality=qualidade, optimize=True, progressive=True)
+    saida.seek(0)
+    return saida
+
+
+def preparar_foto(foto_arquivo, lado_maximo=FOTO_LADO_MAXIMO, qualidade=FOTO_QUALIDADE):
+    """
+    Reduz a foto ao lado máximo, corrige a rotação do EXIF e regrava sem metadados.
+    Retorna (foto, miniatura) como buffers JPEG; se não der para decodificar,
+    (foto original, None) — o upload segue com o arquivo como veio.
+    """
+    try:
+        foto_arquivo.seek(0)
+        imagem = Image.open(foto_arquivo)  # Lê direto do arquivo enviado, sem copiar os bytes
+        # JPEG: o decodificador já entrega a imagem reduzida (escala DCT), bem mais rápido
+        imagem.draft('RGB', (lado_maximo, lado_maximo))
+        imagem = ImageOps.exif_transpose(imagem)
+        if imagem.mode != 'RGB':
+            imagem = imagem.convert('RGB')
+        imagem.thumbnail((lado_maximo, lado_maximo), Image.LANCZOS)
+        foto = _jpeg(imagem, qualidade)
+
+        imagem.thumbnail((MINIATURA_LADO, MINIATURA_LADO), Image.LANCZOS)
+        return foto, _jpeg(imagem, MINIATURA_QUALIDADE)
+    except Exception as e:
+        print(f"Foto enviada sem tratamento: {e}")
+        foto_arquivo.seek(0)
+        return foto_arquivo, None
+
+
+# =============================================================================
+# FUNÇÕES DE GOOGLE DRIVE - UPLOAD
+# =============================================================================
+
+# Acima do limite o arquivo sobe em partes (upload retomável). O endereço da
+# sessão fica no disco: se a conexão cair no meio, a próxima tentativa do MESMO
+# arquivo continua de onde o Drive parou em vez de recomeçar do zero.
+LIMITE_UPLOAD_SIMPLES = 1024 * 1024  # Bytes; abaixo disso vai numa requisição só
+TAMANHO_PARTE_UPLOAD = 1024 * 1024  # Precisa ser múltiplo de 256 KB
+TENTATIVAS_PARTE_UPLOAD = 3  # Novas tentativas de cada parte (5xx/429/rede), com espera crescente
+VALIDADE_SESSAO_UPLOAD = 6 * 24 * 3600  # O Drive mantém a sessão por uma semana
+ARQUIVO_UPLOADS = os.path.join(PASTA_CACHE_LOCAL, "uploads_drive.sqlite")
+
+# Arquivo criado numa pasta já compartilhada ("qualquer pessoa com o link pode
+# ver") herda a leitura pública: sem o permissions().create, o upload é UMA
+# chamada. secrets google_drive.pastas_publicas = true dispensa até a checagem.
+REVER_PASTAS_A_CADA = 3600  # Segundos até conferir de novo se a pasta segue pública
+
+_UPLOADS_LOCK = threading.Lock()
+_PASTAS_PUBLICAS = {}  # id_pasta -> (pública?, conferida_em)
+
+
+def _conectar_uploads():
+    """Abre o SQLite das sessões de upload retomável e das fotos em segundo plano"""
+    os.makedirs(PASTA_CACHE_LOCAL, exist_ok=True)
+    con = sqlite3.connect(ARQUIVO_UPLOADS, timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("CREATE TABLE IF NOT EXISTS sessoes (chave TEXT PRIMARY KEY, uri TEXT, criada_em REAL)")
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS fotos ("
+        " token TEXT PRIMARY KEY, planilha_id TEXT, id_usuario TEXT, nome_arquivo TEXT, foto BLOB, texto TEXT,"
+        " link TEXT, numero_linha INTEGER, situacao TEXT, tentativas INTEGER, proxima_tentativa REAL,"
+        " criada_em REAL, erro TEXT)"
+    )
+    return con
+
+
+def _chave_upload(arquivo, nome_arquivo, id_pasta):
+    """Identifica o mesmo conteúdo indo para o mesmo lugar (só ele pode retomar a sessão)"""
+    return f"{hashlib.sha1(arquivo.getbuffer()).hexdigest()}|{id_pasta}|{nome_arquivo}"
+
+
+def _ler_sessao_upload(chave):
+    """Endereço da sessão interrompida deste arquivo (None se não houver ou se já expirou)"""
+    try:
+        with _UPLOADS_LOCK:
+            con = _conectar_uploads()
+            try:
+                linha = con.execute("SELECT uri FROM sessoes WHERE chave = ? AND criada_em > ?",
+                                    (chave, time.time() - VALIDADE_SESSAO_UPLOAD)).fetchone()
+            finally:
+                con.close()
+        return linha[0] if linha else None
+    except sqlite3.Error as e:
+        print(f"Erro ao ler sessões de upload: {e}")
+        return None
+
+
+def _guardar_sessao_upload(chave, uri):
+    """Guarda o endereço da sessão (uri=None apaga: upload concluído ou sessão perdida)"""
+    try:
+        with _UPLOADS_LOCK:
+            con = _conectar_uploads()
+            try:
+                if uri:
+                    con.execute("INSERT OR IGNORE INTO sessoes VALUES (?, ?, ?)", (chave, uri, time.time()))
+                else:
+                    con.execute("DELETE FROM sessoes WHERE chave = ?", (chave,))
+                con.execute("DELETE FROM sessoes WHERE criada_em < ?", (time.time() - VALIDADE_SESSAO_UPLOAD,))
+                con.commit()
+            finally:
+                con.close()
+    except sqlite3.Error as e:
+        print(f"Erro ao guardar sessão de upload: {e}")
+
+
+def _pasta_publica(drive_service, http, id_pasta, secrets):
+    """Indica se a pasta já dá leitura a qualquer pessoa com o link (conferido uma vez por hora)"""
+    if secrets["google_drive"].get("pastas_publicas"):
+        return True
+    with _UPLOADS_LOCK:
+        em_cache = _PASTAS_PUBLICAS.get(id_pasta)
+    if em_cache is not None and time.time() - em_cache[1] < REVER_PASTAS_A_CADA:
+        return em_cache[0]
+    try:
+        with _chamada_google('drive'):
+            pasta = drive_service.files().get(fileId=id_pasta, fields='permissions(type, role)').execute(http=http)
+        publica = any(p.get('type') == 'anyone' and p.get('role') in ('reader', 'commenter', 'writer')
+                      for p in pasta.get('permissions', []))
+    except Exception as e:
+        print(f"Não deu para conferir o compartilhamento da pasta {id_pasta}: {e}")
+        return False  # Na dúvida, cada arquivo recebe a própria permissão
+    with _UPLOADS_LOCK:
+        _PASTAS_PUBLICAS[id_pasta] = (publica, time.time())
+    return publica
+
+
+def _consultar_sessao_upload(http, uri, tamanho):
+    """
+    Pergunta ao Drive quanto da sessão já chegou (PUT vazio com 'Content-Range: bytes */tamanho').
+    Retorna ('continuar', próximo byte), ('concluido', arquivo) ou ('expirada', None).
+    """
+    with _chamada_google('drive'):
+        resposta, conteudo = http.request(uri, method="PUT",
+                                          headers={'Content-Range': f"bytes */{tamanho}", 'Content-Length': "0"})
+    if resposta.status == 308:
+        intervalo = resposta.get('range')  # "bytes=0-N" (sem cabeçalho: nada chegou ainda)
+        return 'continuar', int(intervalo.rsplit("-", 1)[1]) + 1 if intervalo else 0
+    if resposta.status in (200, 201):
+        return 'concluido', json.loads(conteudo)
+    return 'expirada', None
+
+
+def _subir_para_drive(arquivo, nome_arquivo, id_pasta, mimetype, secrets, progresso=None, error_log=None):
+    """
+    Sobe o arquivo (buffer) para a pasta, libera leitura pública (se a pasta
+    já não der) e retorna o webViewLink.
+    progresso: função chamada com a fração já enviada (0 a 1). Erros são propagados.
+    """
+    drive_service, http = _get_drive_service(secrets, error_log)
+    if drive_service is None:
+        raise RuntimeError("Serviço do Drive indisponível")
+
+    arquivo.seek(0)  # Sobe direto do buffer, sem cópia
+    retomavel = arquivo.getbuffer().nbytes > LIMITE_UPLOAD_SIMPLES
+    media = MediaIoBaseUpload(arquivo, mimetype=mimetype, chunksize=TAMANHO_PARTE_UPLOAD, resumable=retomavel)
+    requisicao = drive_service.files().create(
+        body={'name': nome_arquivo, 'parents': [id_pasta]},
+        media_body=media,
+        fields='id, webViewLink'
+    )
+
+    if not retomavel:
+        with _chamada_google('drive'):
+            file = requisicao.execute(http=http, num_retries=TENTATIVAS_PARTE_UPLOAD)
+    else:
+        chave = _chave_upload(arquivo, nome_arquivo, id_pasta)
+        uri = _ler_sessao_upload(chave)
+        file = None
+        if uri and hasattr(requisicao, 'resumable_progress'):
+            # Sessão interrompida: o Drive diz quanto já chegou e a próxima parte sai dali
+            situacao, resultado = _consultar_sessao_upload(http, uri, arquivo.getbuffer().nbytes)
+            if situacao == 'continuar':
+                requisicao.resumable_uri = uri
+                requisicao.resumable_progress = resultado
+                arquivo.seek(resultado)
+            elif situacao == 'concluido':
+                file = resultado
+            else:
+                _guardar_sessao_upload(chave, None)  # Expirou: recomeça do zero
+        try:
+            while file is None:
+                with _chamada_google('drive'):
+                    andamento, file = requisicao.next_chunk(http=http, num_retries=TENTATIVAS_PARTE_UPLOAD)
+                if andamento is not None and progresso is not None:
+                    progresso(andamento.progress())
+        except Exception as e:
+            # 404/410: a sessão expirou no Drive e a próxima tentativa recomeça do zero
+            _guardar_sessao_upload(chave, None if _status_http(e) in (404, 410) else requisicao.resumable_uri)
+            raise
+        _guardar_sessao_upload(chave, None)
+    if progresso is not None:
+        progresso(1.0)
+
+    if not _pasta_publica(drive_service, http, id_pasta, secrets):
+        with _chamada_google('drive'):
+            drive_service.permissions().create(
+                fileId=file.get('id'),
+                body={'type': 'anyone', 'role': 'reader'}
+            ).execute(http=http)
+
+    return file.get('webViewLink')
+
+
+def salvar_foto_drive(foto_arquivo, nome_arquivo, secrets, error_log=None, progresso=None):
+    """Salva foto no Google Drive (foto_arquivo: arquivo ou buffer, de preferência já passado por preparar_foto)"""
+    try:
+        return _subir_para_drive(foto_arquivo, nome_arquivo, secrets["google_drive"]["id_pasta_fotos"],
+                                 'image/jpeg', secrets, progresso, error_log)
+    except Exception as e:
+        if error_log is not None:
+            error_log.append({
+                'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                'erro': str(e),
+                'funcao': 'salvar_foto_drive',
+                'traceback': traceback.format_exc(),
+                'tipo': type(e).__name__
+            })
+        print(f"Erro no Drive (Foto): {e}")
+        return None
 
-        drive_service.permissions().create(
-            fileId=file.get('id'),
-            body={'type': 'anyone', 'role': 'reader'}
-        ).execute()
 
-        return file.get('webViewLink')
+def salvar_documento_drive(doc_arquivo, nome_arquivo, secrets, error_log=None, progresso=None):
+    """Salva documento PDF no Google Drive (em partes e retomável se for grande)"""
+    try:
+        return _subir_para_drive(doc_arquivo, nome_arquivo, secrets["google_drive"]["id_pasta_contratos"],
+                                 'application/pdf', secrets, progresso, error_log)
     except Exception as e:
         if error_log is not None:
             error_log.append({
@@ -376,25 +2772,153 @@ def salvar_documento_drive(doc_arquivo, nome_arquivo, secrets, error_log=None):
 # FUNÇÕES DE API EXTERNA
 # =============================================================================
 
-def obter_endereco_simples(coords_str, error_log=None):
-    """Converte 'lat, lon' em um endereço curto (Rua ou Bairro)"""
+# Resolução offline da região administrativa: regioes_df.py (sem dependências,
+# testável isoladamente). Com GEOCODE_DETALHE_RUA = True o Nominatim é usado
+# para trazer também a rua.
+GEOCODE_DETALHE_RUA = False
+
+
+def _endereco_offline(c_str):
+    """'Região, Brasília' sem rede; None se precisar do Nominatim (fora do DF ou detalhe de rua)"""
+    if GEOCODE_DETALHE_RUA:
+        return None
+    return endereco_da_regiao(c_str)
+
+
+# Endereços já resolvidos, por célula de uma grade de ~110 m (3 casas decimais):
+# memória (LRU) -> SQLite local -> Nominatim (no máximo 1 requisição/s por processo,
+# como pede a política de uso do serviço).
+CASAS_GRADE_GEOCODE = 3
+LIMITE_CACHE_GEOCODE = 5000
+INTERVALO_NOMINATIM = 1.0
+ARQUIVO_GEOCODE = os.path.join(PASTA_CACHE_LOCAL, "geocode.sqlite")
+
+_GEOCODE_MEMORIA = OrderedDict()
+_GEOCODE_LOCK = threading.Lock()
+_NOMINATIM = {'geolocator': None, 'ultima_chamada': 0.0}
+_NOMINATIM_LOCK = threading.Lock()
+
+
+def _celula_geocode(c_str):
+    """Chave da célula da grade para 'lat, lon' (None se não der para ler)"""
+    try:
+        lat, lon = (float(parte) for parte in c_str.split(",", 1))
+    except ValueError:
+        return None
+    return f"{round(lat, CASAS_GRADE_GEOCODE)},{round(lon, CASAS_GRADE_GEOCODE)}"
+
+
+def _conectar_geocode():
+    """Abre o SQLite do cache de endereços"""
+    os.makedirs(PASTA_CACHE_LOCAL, exist_ok=True)
+    con = sqlite3.connect(ARQUIVO_GEOCODE, timeout=10)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.execute("CREATE TABLE IF NOT EXISTS geocode (celula TEXT PRIMARY KEY, endereco TEXT, criado_em REAL)")
+    return con
+
+
+def _lembrar_endereco(celula, endereco):
+    """Guarda na LRU em memória (descartando o menos usado)"""
+    with _GEOCODE_LOCK:
+        _GEOCODE_MEMORIA[celula] = endereco
+        _GEOCODE_MEMORIA.move_to_end(celula)
+        while len(_GEOCODE_MEMORIA) > LIMITE_CACHE_GEOCODE:
+            _GEOCODE_MEMORIA.popitem(last=False)
+
+
+def _endereco_em_cache(celula):
+    """Procura a célula na memória e depois no disco"""
+    with _GEOCODE_LOCK:
+        if celula in _GEOCODE_MEMORIA:
+            _GEOCODE_MEMORIA.move_to_end(celula)
+            return _GEOCODE_MEMORIA[celula]
+
+    if not os.path.exists(ARQUIVO_GEOCODE):
+        return None
+    try:
+        with _GEOCODE_LOCK:
+            con = _conectar_geocode()
+            try:
+                linha = con.execute("SELECT endereco FROM geocode WHERE celula = ?", (celula,)).fetchone()
+            finally:
+                con.close()
+    except Exception as e:
+        print(f"Erro ao ler cache de endereços: {e}")
+        return None
+    if linha is not None:
+        _lembrar_endereco(celula, linha[0])
+        return linha[0]
+    return None
+
+
+def _guardar_endereco(celula, endereco):
+    """Guarda o endereço resolvido na memória e no disco"""
+    _lembrar_endereco(celula, endereco)
+    try:
+        with _GEOCODE_LOCK:
+            con = _conectar_geocode()
+            try:
+                con.execute("INSERT OR REPLACE INTO geocode VALUES (?, ?, ?)", (celula, endereco, time.time()))
+                con.commit()
+            finally:
+                con.close()
+    except Exception as e:
+        print(f"Erro ao gravar cache de endereços: {e}")
+
+
+def _consultar_nominatim(c_str):
+    """Reverse geocode no Nominatim respeitando 1 req/s (um geolocator para o processo)"""
+    with _NOMINATIM_LOCK:
+        if _NOMINATIM['geolocator'] is None:
+            _NOMINATIM['geolocator'] = Nominatim(user_agent="comando2026_geocoder")
+        espera = _NOMINATIM['ultima_chamada'] + INTERVALO_NOMINATIM - time.monotonic()
+        if espera > 0:
+            time.sleep(espera)
+        try:
+            return _NOMINATIM['geolocator'].reverse(c_str, timeout=10)
+        finally:
+            _NOMINATIM['ultima_chamada'] = time.monotonic()
+
+
+def _resolver_endereco(coords_str):
+    """Como obter_endereco_simples, mas erro do Nominatim (timeout, 429) sobe para quem chamou"""
     c_str = str(coords_str) if coords_str is not None else ""
 
     if not c_str or "GPS" in c_str or "informada" in c_str or "," not in c_str:
         return "Local não identificado"
 
-    try:
-        geolocator = Nominatim(user_agent="comando2026_geocoder")
-        location = geolocator.reverse(c_str, timeout=10)
-        address = location.raw.get('address', {})
+    endereco = _endereco_offline(c_str)
+    if endereco is not None:
+        return endereco
 
-        rua = address.get('road', '')
-        bairro = address.get('suburb', '')
-        cidade = address.get('city', address.get('town', ''))
+    celula = _celula_geocode(c_str)
+    if celula is not None:
+        endereco = _endereco_em_cache(celula)
+        if endereco is not None:
+            return endereco
+
+    location = _consultar_nominatim(c_str)
+    if location is None:
+        return "Endereço indisponível"
+    address = location.raw.get('address', {})
+
+    rua = address.get('road', '')
+    bairro = address.get('suburb', '')
+    cidade = address.get('city', address.get('town', ''))
+
+    if rua:
+        endereco = f"{rua}, {bairro}".strip(", ")
+    else:
+        endereco = f"{bairro}, {cidade}".strip(", ")
+    if celula is not None:
+        _guardar_endereco(celula, endereco)
+    return endereco
 
-        if rua:
-            return f"{rua}, {bairro}".strip(", ")
-        return f"{bairro}, {cidade}".strip(", ")
+
+def obter_endereco_simples(coords_str, error_log=None):
+    """Converte 'lat, lon' em um endereço curto (Região no DF; Rua ou Bairro via Nominatim, com cache)"""
+    try:
+        return _resolver_endereco(coords_str)
     except Exception as e:
         if error_log is not None:
             error_log.append({
@@ -409,76 +2933,163 @@ def obter_endereco_simples(coords_str, error_log=None):
 
 
 # =============================================================================
-# FUNÇÕES DE GESTÃO DE GRUPOS E MACRO_GRUPOS (COM CACHE)
+# ÍNDICES DA ABA USUARIOS
 # =============================================================================
 
-@st.cache_data(ttl=120)  # Cache por 2 minutos
-def carregar_macro_grupos_cached(planilha_id):
-    """Carrega lista única de Macro_Grupos da planilha Grupos (COM CACHE)"""
-    try:
-        # Usa URL pública para evitar chamada de API
-        url = f"https://docs.google.com/spreadsheets/d/{planilha_id}/gviz/tq?tqx=out:csv&sheet=Grupos"
-        df = pd.read_csv(url)
-
-        # Extrai Macro_Grupos únicos (excluindo vazios)
-        if 'Macro_Grupo' in df.columns:
-            macro_grupos = list(set([
-                str(val).strip()
-                for val in df['Macro_Grupo'].dropna().unique()
-                if str(val).strip()
-            ]))
-            return sorted(macro_grupos)
-        return []
-    except Exception as e:
-        print(f"Erro ao carregar Macro_Grupos: {e}")
-        return []
+def _chaves_indice(serie):
+    """Normaliza uma coluna para chave de índice (texto, sem espaços, minúsculo)"""
+    return serie.astype(str).str.strip().str.lower()
 
 
-@st.cache_data(ttl=120)  # Cache por 2 minutos
-def carregar_grupos_completos_cached(planilha_id):
-    """Carrega todos os grupos com suas informações (COM CACHE)"""
+def _agrupar_por(df, coluna):
+    """Dicionário chave normalizada -> sub-DataFrame com as linhas daquela chave"""
+    if coluna not in df.columns:
+        return {}
+    chaves = _chaves_indice(df[coluna])
+    posicoes = chaves.groupby(chaves).indices
+    return {chave: df.iloc[pos] for chave, pos in posicoes.items() if chave}
+
+
+def _montar_indice_usuarios(df):
+    """Monta os índices da aba Usuarios (uma vez por versão do snapshot)"""
+    por_id = {}
+    if 'ID_Usuario' in df.columns:
+        for chave, registro in zip(_chaves_indice(df['ID_Usuario']), df.astype(object).to_dict('records')):
+            # Em ID duplicado vale a primeira linha, como no filtro antigo (.iloc[0])
+            if chave and chave not in por_id:
+                por_id[chave] = registro
+    return {
+        'por_id': por_id,
+        'por_supervisor': _agrupar_por(df, 'ID_Supervisor'),
+        'por_grupo': _agrupar_por(df, 'ID_Grupo'),
+        'por_cargo': _agrupar_por(df, 'Cargo'),
+        'vazio': df.iloc[:0]
+    }
+
+
+def carregar_indice_usuarios(planilha_id, error_log=None):
+    """
+    Índices da aba Usuarios (chaves em minúsculo, sem espaços):
+    por_id -> registro; por_supervisor / por_grupo / por_cargo -> DataFrame da equipe.
+    Compartilhado entre sessões: não alterar (copiar antes, se preciso).
+    """
     try:
-        # Usa URL pública para evitar chamada de API
-        url = f"https://docs.google.com/spreadsheets/d/{planilha_id}/gviz/tq?tqx=out:csv&sheet=Grupos"
-        df = pd.read_csv(url)
+        return _obter_derivado("Usuarios", planilha_id, "indice_usuarios", _montar_indice_usuarios)
+    except Exception as e:
+        if error_log is not None:
+            error_log.append({
+                'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                'erro': str(e),
+                'funcao': 'carregar_indice_usuarios',
+                'traceback': traceback.format_exc(),
+                'tipo': type(e).__name__
+            })
+        print(f"Erro ao indexar Usuarios: {e}")
+        return None
+
+
+# =============================================================================
+# FUNÇÕES DE GESTÃO DE GRUPOS E MACRO_GRUPOS (MODELO EM CACHE)
+# =============================================================================
+
+def _incluir_no_modelo_grupos(modelo, registro):
+    """Acrescenta uma linha da aba Grupos ao modelo (no lugar)"""
+    id_grupo = str(registro.get('ID_Grupo', '')).strip()
+    macro = str(registro.get('Macro_Grupo', '')).strip()
+
+    if macro and macro not in modelo['macro_para_grupos']:
+        modelo['macro_para_grupos'][macro] = []
+        modelo['macros'].append(macro)
+        modelo['macros'].sort()
+
+    # Linhas "_MACRO_..." só existem para registrar o Macro_Grupo
+    if not id_grupo or id_grupo.startswith('_MACRO_'):
+        return
+
+    registro = {k: str(v) for k, v in registro.items()}
+    modelo['grupos'].append(registro)
+    modelo['grupos_por_id'][id_grupo] = registro
+    modelo['grupo_para_macro'][id_grupo] = macro
+    if macro:
+        modelo['macro_para_grupos'][macro].append(registro)
+
+
+def _montar_modelo_grupos(df):
+    """Monta o modelo de Grupos a partir do snapshot da aba"""
+    modelo = {
+        'macros': [],
+        'grupos': [],
+        'grupos_por_id': {},
+        'grupo_para_macro': {},
+        'macro_para_grupos': {}
+    }
+    for registro in df.astype(object).to_dict('records'):
+        _incluir_no_modelo_grupos(modelo, registro)
+    return modelo
+
+
+_ATUALIZADORES_DERIVADOS[("Grupos", "modelo_grupos")] = _incluir_no_modelo_grupos
 
-        # ✅ FILTRA: Exclui linhas que são apenas Macro_Grupos (ID começa com "_MACRO_")
-        df_filtrado = df[~df['ID_Grupo'].astype(str).str.startswith('_MACRO_')]
 
-        # Converte para lista de dicionários
-        dados = df_filtrado.to_dict('records')
-        return dados
+def carregar_modelo_grupos(planilha_id, error_log=None):
+    """
+    Modelo único da aba Grupos (baixada e processada uma vez por versão):
+    macros, grupos, grupos_por_id, grupo_para_macro e macro_para_grupos.
+    """
+    try:
+        modelo = _obter_derivado("Grupos", planilha_id, "modelo_grupos", _montar_modelo_grupos)
+        # Cópia rasa: criar_novo_grupo altera o modelo compartilhado no lugar
+        with _SNAPSHOTS_LOCK:
+            return {
+                'macros': list(modelo['macros']),
+                'grupos': list(modelo['grupos']),
+                'grupos_por_id': dict(modelo['grupos_por_id']),
+                'grupo_para_macro': dict(modelo['grupo_para_macro']),
+                'macro_para_grupos': {k: list(v) for k, v in modelo['macro_para_grupos'].items()}
+            }
     except Exception as e:
+        if error_log is not None:
+            error_log.append({
+                'data': get_agora_br().strftime("%d/%m/%Y %H:%M:%S"),
+                'erro': str(e),
+                'funcao': 'carregar_modelo_grupos',
+                'traceback': traceback.format_exc(),
+                'tipo': type(e).__name__
+            })
         print(f"Erro ao carregar Grupos: {e}")
-        return []
+        return _montar_modelo_grupos(pd.DataFrame())
+
+
+def carregar_macro_grupos_cached(planilha_id):
+    """Carrega lista única de Macro_Grupos da planilha Grupos (via modelo em cache)"""
+    return carregar_modelo_grupos(planilha_id)['macros']
+
+
+def carregar_grupos_completos_cached(planilha_id):
+    """Carrega todos os grupos com suas informações (via modelo em cache)"""
+    return carregar_modelo_grupos(planilha_id)['grupos']
 
 
 def criar_novo_grupo(nome_grupo, macro_grupo, link_grupo, secrets, error_log=None):
     """Cria um novo grupo na planilha"""
     try:
-        client = _get_gspread_client(secrets, error_log)
-        if client is None:
-            return False, "Erro de conexão"
-
-        planilha = client.open_by_key(secrets["planilha"]["id"])
-        aba = planilha.worksheet("Grupos")
-
-        # Verifica se já existe
-        dados = aba.get_all_records()
-        for row in dados:
-            if str(row.get('ID_Grupo', '')).upper() == str(nome_grupo).upper():
-                return False, "Grupo já existe"
+        # Verifica se já existe (no modelo em memória: sem ler a aba de novo)
+        modelo = carregar_modelo_grupos(secrets["planilha"]["id"], error_log)
+        if any(g.upper() == str(nome_grupo).strip().upper() for g in modelo['grupos_por_id']):
+            return False, "Grupo já existe"
 
         # Adiciona novo grupo
-        aba.append_row([
+        linha = [
             str(nome_grupo).upper(),
             str(macro_grupo).strip(),
             str(link_grupo).strip()
-        ])
-
-        # Limpa cache após criação
-        carregar_macro_grupos_cached.clear()
-        carregar_grupos_completos_cached.clear()
+        ]
+        # Upsert pela chave ID_Grupo (também atualiza snapshot e modelo no lugar)
+        resultado = upsert_linhas(secrets, "Grupos", "ID_Grupo", [
+            dict(zip(['ID_Grupo', 'Macro_Grupo', 'Link_Grupo'], linha))
+        ], error_log)
+        if resultado is None:
+            return False, "Erro ao gravar na planilha"
 
         return True, "Grupo criado com sucesso"
     except Exception as e:
@@ -496,29 +3107,23 @@ def criar_novo_grupo(nome_grupo, macro_grupo, link_grupo, secrets, error_log=Non
 def criar_novo_macro_grupo(nome_macro, secrets, error_log=None):
     """Cria um novo Macro_Grupo (adiciona entrada na planilha Grupos)"""
     try:
-        client = _get_gspread_client(secrets, error_log)
-        if client is None:
-            return False, "Erro de conexão"
-
-        planilha = client.open_by_key(secrets["planilha"]["id"])
-        aba = planilha.worksheet("Grupos")
-
-        # Verifica se já existe
-        dados = aba.get_all_records()
-        for row in dados:
-            if str(row.get('Macro_Grupo', '')).strip().upper() == str(nome_macro).upper():
-                return False, "Macro_Grupo já existe"
+        # Verifica se já existe (no modelo em memória: sem ler a aba de novo)
+        modelo = carregar_modelo_grupos(secrets["planilha"]["id"], error_log)
+        if any(m.upper() == str(nome_macro).strip().upper() for m in modelo['macros']):
+            return False, "Macro_Grupo já existe"
 
         # Adiciona entrada
-        aba.append_row([
+        linha = [
             f"_MACRO_{nome_macro.upper().replace(' ', '_')}",
             str(nome_macro).strip(),
             ""
-        ])
-
-        # Limpa cache após criação
-        carregar_macro_grupos_cached.clear()
-        carregar_grupos_completos_cached.clear()
+        ]
+        # Upsert pela chave ID_Grupo (também atualiza snapshot e modelo no lugar)
+        resultado = upsert_linhas(secrets, "Grupos", "ID_Grupo", [
+            dict(zip(['ID_Grupo', 'Macro_Grupo', 'Link_Grupo'], linha))
+        ], error_log)
+        if resultado is None:
+            return False, "Erro ao gravar na planilha"
 
         return True, "Macro_Grupo criado com sucesso"
     except Exception as e:
@@ -552,7 +3157,8 @@ def diagnosticar_conexoes(secrets, error_log=None):
         client = _get_gspread_client(secrets, error_log)
         if client:
             resultados['sheets'] = {'status': '✅', 'msg': 'Conectado'}
-            planilha = client.open_by_key(secrets["planilha"]["id"])
+            with _chamada_google('sheets'):
+                planilha = client.open_by_key(secrets["planilha"]["id"])
             resultados['planilha'] = {'status': '✅', 'msg': f'{planilha.title}'}
         else:
             resultados['sheets'] = {'status': '❌', 'msg': 'Falha na autenticação'}
@@ -569,9 +3175,13 @@ def diagnosticar_conexoes(secrets, error_log=None):
 
     # Teste Google Drive
     try:
-        creds = _get_drive_credentials(secrets, error_log)
-        if creds:
-            resultados['drive'] = {'status': '✅', 'msg': 'Conectado'}
+        drive_service, http = _get_drive_service(secrets, error_log)
+        if drive_service:
+            # Pastas já públicas: cada upload nelas é uma chamada só (sem permissions().create)
+            publicas = [nome for nome, chave in (("fotos", "id_pasta_fotos"), ("contratos", "id_pasta_contratos"))
+                        if _pasta_publica(drive_service, http, secrets["google_drive"][chave], secrets)]
+            resultados['drive'] = {'status': '✅',
+                                   'msg': f"Conectado (pastas públicas: {', '.join(publicas) or 'nenhuma'})"}
         else:
             resultados['drive'] = {'status': '❌', 'msg': 'Falha na autenticação'}
     except Exception as e:
@@ -612,12 +3222,12 @@ def obter_logs_erros(error_log_session, limite=50):
 
 
 def contar_chamadas_api():
-    """Estimativa de chamadas à API (baseado no cache)"""
-    # Isso é mais informativo, já que gviz não conta como API call
+    """Chamadas feitas ao Google desde que o processo subiu (contadas pela cota)"""
+    chamadas = {item['familia']: item['chamadas'] for item in status_google()}
     return {
-        'sheets_api': '0 (usando gviz)',
-        'drive_api': 'Variável (uploads)',
-        'cache_hits': 'Ativo (ttl=120s)'
+        'sheets_api': f"{chamadas['sheets']} (gviz: {chamadas['gviz']})",
+        'drive_api': f"{chamadas['drive']}",
+        'cache_hits': f"Snapshots compartilhados ({len(_SNAPSHOTS)} abas em memória)"
     }
 
 